@@ -0,0 +1,55 @@
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieve_stations import parse_ministry_payload, parse_ministry_payload_compact, normalize_dfs, orjson
+from station_matching import match_nearest_stations
+from synthetic import synthetic_ministry_payload, synthetic_export_dataframe, SPAIN_STATION_COUNT
+
+
+def measure(parse, payload):
+    # Wall time, peak traced memory while parsing and deep memory of the resulting DataFrame.
+    # Tracing slows allocations down, so the time comes from a separate untraced call.
+    gc.collect()
+    start = time.perf_counter()
+    parse(payload)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    df = parse(payload)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return df, seconds, peak, int(df.memory_usage(deep=True).sum())
+
+
+def same_matches(df_full, df_compact, n):
+    # Both loaders must give the same prices and distances to the Red Fleet stations
+    df_cc = synthetic_export_dataframe(max(1, n // 10))
+    results = []
+    for df_min in (df_full, df_compact):
+        cc, ministry = normalize_dfs(df_cc.copy(), df_min.copy())
+        results.append(match_nearest_stations(cc, ministry))
+    return results[0].equals(results[1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare memory and time of the full and compact Ministry loaders")
+    parser.add_argument("--stations", type=int, default=SPAIN_STATION_COUNT,
+                        help=f"Number of synthetic stations (default: {SPAIN_STATION_COUNT})")
+    args = parser.parse_args()
+
+    payload = synthetic_ministry_payload(args.stations)
+    print(f"{args.stations} stations, {len(payload) / 1e6:.1f} MB payload, JSON decoder: {'orjson' if orjson else 'json'}")
+    print(f"{'loader':<10} {'seconds':>8} {'peak MB':>8} {'frame MB':>9} {'columns':>8}")
+    frames = {}
+    for name, parse in (("full", parse_ministry_payload), ("compact", parse_ministry_payload_compact)):
+        df, seconds, peak, size = measure(parse, payload)
+        frames[name] = df
+        print(f"{name:<10} {seconds:8.3f} {peak / 1e6:8.1f} {size / 1e6:9.1f} {len(df.columns):8}")
+
+    print(f"Same matches: {same_matches(frames['full'], frames['compact'], args.stations)}")
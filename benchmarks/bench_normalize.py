@@ -0,0 +1,98 @@
+import argparse
+import os
+import sys
+import time
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieve_stations import parse_ministry_payload, parse_ministry_payload_compact, get_circulo_conductores_dataframe, normalize_dfs
+from station_names import normalize_name
+from synthetic import synthetic_ministry_payload, synthetic_ministry_stations, synthetic_circulo_conductores_payload, SPAIN_STATION_COUNT
+
+
+# normalize_dfs as it was before station_names, kept as the baseline
+def legacy_normalize_dfs(df_cc, df_min):
+    df_cc.rename(columns={"Municipio": "MUNICIPIO", "Provincia": "PROVINCIA"}, inplace=True)
+    df_min.rename(columns={"Municipio": "MUNICIPIO", "Provincia": "PROVINCIA"}, inplace=True)
+
+    df_cc["MUNICIPIO"] = df_cc["MUNICIPIO"].str.upper()
+    df_cc["PROVINCIA"] = df_cc["PROVINCIA"].str.upper()
+    df_min["MUNICIPIO"] = df_min["MUNICIPIO"].str.upper()
+    df_min["PROVINCIA"] = df_min["PROVINCIA"].str.upper()
+
+    province_name_replacement = {
+        "ARABA/ÁLAVA": "ALAVA",
+        "BALEARS (ILLES)": "BALEARES",
+        "BIZKAIA": "VIZCAYA",
+        "CASTELLÓN / CASTELLÓ": "CASTELLON",
+        "CORUÑA (A)": "LA CORUÑA",
+        "GIPUZKOA": "GUIPUZCOA",
+        "GIRONA": "GERONA",
+        "LLEIDA": "LERIDA",
+        "OURENSE": "ORENSE",
+        "PALMAS (LAS)": "LAS PALMAS",
+        "RIOJA (LA)": "LA RIOJA",
+        "SANTA CRUDA DE TENERIFE": "TENERIFE",
+        "VALENCIA / VALÈNCIA": "VALENCIA"
+    }
+    df_min["PROVINCIA"] = df_min["PROVINCIA"].replace(province_name_replacement)
+
+    def remove_accents(text):
+        if isinstance(text, str):
+            return ''.join(
+                c for c in unicodedata.normalize('NFD', text)
+                if unicodedata.category(c) != 'Mn'
+            )
+        return text
+
+    df_cc["MUNICIPIO"] = df_cc["MUNICIPIO"].apply(remove_accents)
+    df_cc["PROVINCIA"] = df_cc["PROVINCIA"].apply(remove_accents)
+    df_min["MUNICIPIO"] = df_min["MUNICIPIO"].apply(remove_accents)
+    df_min["PROVINCIA"] = df_min["PROVINCIA"].apply(remove_accents)
+    return df_cc, df_min
+
+
+def best_time(function, repeat, before=None):
+    times = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def provinces_found(df_cc, df_min):
+    # Red Fleet stations whose province is also a province of the Ministry feed, as --match-by-province needs
+    return int(df_cc["PROVINCIA"].isin(set(df_min["PROVINCIA"].dropna())).sum())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the row-by-row and the cached name normalization")
+    parser.add_argument("--stations", type=int, default=SPAIN_STATION_COUNT,
+                        help=f"Number of synthetic stations (default: {SPAIN_STATION_COUNT})")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions, the best one is reported (default: 5)")
+    args = parser.parse_args()
+
+    payload = synthetic_ministry_payload(args.stations)
+    cc_payload = synthetic_circulo_conductores_payload(synthetic_ministry_stations(args.stations))
+    cc_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_normalize_circulo.csv")
+    try:
+        df_cc = get_circulo_conductores_dataframe(cc_csv, "https://example.invalid/edit?gid=0", cc_payload)
+    finally:
+        if os.path.exists(cc_csv):
+            os.remove(cc_csv)
+
+    print(f"{args.stations} Ministry stations, {len(df_cc)} Circulo Conductores stations")
+    print(f"{'loader':<8} {'legacy s':>9} {'cold s':>8} {'warm s':>8} {'speedup':>8} {'found legacy':>13} {'found now':>10}")
+    for name, parse in (("full", parse_ministry_payload), ("compact", parse_ministry_payload_compact)):
+        df_min = parse(payload)
+        legacy = best_time(lambda: legacy_normalize_dfs(df_cc.copy(), df_min.copy()), args.repeat)
+        # Cold: every name normalized again, as in the first run; warm: names remembered, as in the scheduler
+        cold = best_time(lambda: normalize_dfs(df_cc.copy(), df_min.copy()), args.repeat, normalize_name.cache_clear)
+        warm = best_time(lambda: normalize_dfs(df_cc.copy(), df_min.copy()), args.repeat)
+        found_legacy = provinces_found(*legacy_normalize_dfs(df_cc.copy(), df_min.copy()))
+        found = provinces_found(*normalize_dfs(df_cc.copy(), df_min.copy()))
+        print(f"{name:<8} {legacy:9.3f} {cold:8.3f} {warm:8.3f} {legacy / cold:7.1f}x {found_legacy:13} {found:10}")
@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieve_stations import get_circulo_conductores_dataframe, parse_ministry_payload_compact, normalize_dfs
+from station_matching import match_nearest_stations, PRICE_COLUMNS
+from station_projection import select_networks
+from synthetic import synthetic_ministry_stations, synthetic_circulo_conductores_payload, SPAIN_STATION_COUNT
+
+# Matching modes compared, as keyword arguments of match_nearest_stations
+MODES = {
+    "indexed": {},
+    "by_province": {"by_province": True},
+    "by_province_exact": {"by_province": True, "exact": True},
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the parallel matching against the serial one and compare them")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help=f"Fraction of the {SPAIN_STATION_COUNT} Ministry stations of Spain (default: 1.0)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4],
+                        help="Worker counts to time against the serial matching (default: 2 4)")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES),
+                        help="Matching modes to time (default: all)")
+    args = parser.parse_args()
+
+    stations = synthetic_ministry_stations(int(SPAIN_STATION_COUNT * args.scale))
+    df_min = parse_ministry_payload_compact(json.dumps({"ListaEESSPrecio": stations}).encode("utf-8"), PRICE_COLUMNS)
+    with tempfile.TemporaryDirectory() as tmp:
+        df_cc = select_networks(get_circulo_conductores_dataframe(
+            os.path.join(tmp, "circulo.csv"), "https://example.invalid/edit?gid=0",
+            synthetic_circulo_conductores_payload(stations)
+        ))
+    df_cc, df_min = normalize_dfs(df_cc, df_min)
+
+    print(f"{len(df_cc)} Red Fleet stations, {len(df_min)} Ministry stations, {os.cpu_count()} cores")
+    for mode in args.modes:
+        start = time.perf_counter()
+        serial = match_nearest_stations(df_cc, df_min, **MODES[mode])
+        line = [f"{mode:<18} serial {time.perf_counter() - start:7.3f}s"]
+        for workers in args.workers:
+            start = time.perf_counter()
+            parallel = match_nearest_stations(df_cc, df_min, workers=workers, **MODES[mode])
+            elapsed = time.perf_counter() - start
+            pd.testing.assert_frame_equal(parallel, serial)
+            line.append(f"{workers} workers {elapsed:7.3f}s")
+        print(", ".join(line) + ", identical")
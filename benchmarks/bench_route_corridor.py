@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from route_corridor import corridor_stations, DEFAULT_BUFFER_KM
+from spatial_index import haversine_km, StationIndex
+from synthetic import synthetic_export_dataframe, SPAIN_STATION_COUNT
+
+# Waypoints of a cross-country route, Girona to Huelva through Madrid
+CROSS_COUNTRY_ROUTE = [(41.98, 2.82), (41.39, 2.17), (41.65, -0.88), (40.42, -3.70), (38.89, -6.97), (37.26, -6.95)]
+
+
+def synthetic_route(points, seed=0):
+    # Track of about points positions along CROSS_COUNTRY_ROUTE, winding a couple of km to each side
+    # like a road, with a few meters of GPS noise
+    rng = np.random.default_rng(seed)
+    waypoints = np.array(CROSS_COUNTRY_ROUTE)
+    per_leg = max(2, points // (len(waypoints) - 1))
+    legs = [np.linspace(a, b, per_leg, endpoint=False) for a, b in zip(waypoints[:-1], waypoints[1:])]
+    route = np.vstack(legs + [waypoints[-1:]])
+    bends = np.linspace(0, 400 * np.pi, len(route))
+    route += 0.02 * np.column_stack((np.sin(bends), np.cos(bends * 0.7))) + rng.normal(0, 0.00005, route.shape)
+    return route[:, 0], route[:, 1]
+
+
+def all_pairs_distances(df, lat, lon):
+    # Baseline: haversine from every station to every track point, the closest one per station
+    station_lat = df["Coordenada Y"].to_numpy()
+    station_lon = df["Coordenada X"].to_numpy()
+    return np.array([haversine_km(a, b, lat, lon).min() for a, b in zip(station_lat, station_lon)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the corridor search on a cross-country route")
+    parser.add_argument("--stations", type=int, default=SPAIN_STATION_COUNT,
+                        help=f"Number of synthetic stations (default: {SPAIN_STATION_COUNT})")
+    parser.add_argument("--points", type=int, default=20_000, help="Points of the route (default: 20000)")
+    parser.add_argument("--buffer-km", type=float, default=DEFAULT_BUFFER_KM,
+                        help=f"Corridor width on each side (default: {DEFAULT_BUFFER_KM})")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions, the best one is reported (default: 5)")
+    args = parser.parse_args()
+
+    df = synthetic_export_dataframe(args.stations)
+    lat, lon = synthetic_route(args.points)
+    index = StationIndex(df["Coordenada Y"].to_numpy(), df["Coordenada X"].to_numpy())
+
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        found = corridor_stations(df, lat, lon, args.buffer_km, index=index)
+        times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    corridor_stations(df, lat, lon, args.buffer_km)
+    with_index = time.perf_counter() - start
+
+    start = time.perf_counter()
+    baseline = all_pairs_distances(df, lat, lon)
+    baseline_seconds = time.perf_counter() - start
+    expected = set(np.flatnonzero(baseline <= args.buffer_km))
+    got = set(df.index.get_indexer(found.index))
+
+    print(f"{args.stations} stations, {len(lat)} route points, {args.buffer_km:g} km corridor")
+    print(f"corridor search {min(times):.3f}s ({with_index:.3f}s building the index), all pairs {baseline_seconds:.3f}s")
+    print(f"{len(found)} stations found, {len(expected)} by all pairs, "
+          f"{len(expected - got)} missed and {len(got - expected)} extra at the edge of the corridor")
@@ -0,0 +1,165 @@
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from station_writers import write_kml, write_gpx
+from synthetic import synthetic_export_dataframe, SPAIN_STATION_COUNT
+
+NOW_KML = "2024-01-01 00:00:00"
+NOW_GPX = "2024-01-01T00:00:00Z"
+
+
+# Row-by-row writers as they were before station_writers, kept as the baseline; only their comments
+# were left out, the output is the same
+def legacy_create_kml(df, filename, now):
+    kml_header = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+<Document>
+    <name>Gasolineras</name>
+'''
+    kml_footer = '''</Document>
+</kml>
+'''
+
+    placemarks = []
+    for _, row in df.iterrows():
+        try:
+            lon = float(row["Coordenada X"])
+            lat = float(row["Coordenada Y"])
+        except (ValueError, TypeError):
+            continue
+
+        gasolina_95 = row.get("Precio Gasolina 95 E5", "")
+        gasoleo_a = row.get("Precio Gasoleo A", "")
+        provincia = escape(str(row.get("PROVINCIA", "")))
+        municipio = escape(str(row.get("MUNICIPIO", "")))
+        centro = escape(str(row.get("CENTRO", "")))
+        direccion = escape(str(row.get("DIRECCIÓN", "")))
+        concesion = escape(str(row.get("CONCESIÓN", "")))
+
+        description = f"""Concesión {concesion}"""
+
+        placemark = f"""
+    <Placemark>
+        <name>{centro}</name>
+        <description><![CDATA[{description}]]></description>
+        <ExtendedData>
+            <Data name="Gasolina 95 E5">
+                <value>{gasolina_95} €</value>
+            </Data>
+            <Data name="Gasóleo A">
+                <value>{gasoleo_a} €</value>
+            </Data>
+            <Data name="Dirección">
+                <value>{direccion}</value>
+            </Data>
+            <Data name="Municipio">
+                <value>{municipio}</value>
+            </Data>
+            <Data name="Provincia">
+                <value>{provincia}</value>
+            </Data>
+            <Data name="Fecha">
+                <value>{now}</value>
+            </Data>
+        </ExtendedData>
+        <Point>
+            <coordinates>{lon},{lat},0</coordinates>
+        </Point>
+    </Placemark>
+"""
+        placemarks.append(placemark)
+
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(kml_header)
+        for pm in placemarks:
+            f.write(pm)
+        f.write(kml_footer)
+
+
+def legacy_create_gpx(df, filename, now):
+    gpx_header = '''<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="Gasolineras" xmlns="http://www.topografix.com/GPX/1/1">
+'''
+    gpx_footer = '''</gpx>
+'''
+
+    waypoints = []
+    for _, row in df.iterrows():
+        try:
+            lon = float(row["Coordenada X"])
+            lat = float(row["Coordenada Y"])
+        except (ValueError, TypeError):
+            continue
+
+        gasolina_95 = row.get("Precio Gasolina 95 E5", "")
+        gasoleo_a = row.get("Precio Gasoleo A", "")
+        provincia = escape(str(row.get("PROVINCIA", "")))
+        municipio = escape(str(row.get("MUNICIPIO", "")))
+        centro = escape(str(row.get("CENTRO", "")))
+        direccion = escape(str(row.get("DIRECCIÓN", "")))
+
+        description = f"""Gasolina 95: {gasolina_95}
+Gasoleo A: {gasoleo_a}
+Provincia: {provincia}
+Municipio: {municipio}
+Centro: {centro}
+Direccion: {direccion}"""
+
+        waypoint = f"""
+  <wpt lat="{lat}" lon="{lon}">
+    <name>{centro}</name>
+    <desc>{description}</desc>
+    <time>{now}</time>
+  </wpt>
+"""
+        waypoints.append(waypoint)
+
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(gpx_header)
+        for wp in waypoints:
+            f.write(wp)
+        f.write(gpx_footer)
+
+
+def timed(function, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the KML/GPX writers", allow_abbrev=False)
+    parser.add_argument("--stations", type=int, default=SPAIN_STATION_COUNT, help="Number of synthetic stations")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per writer (best time is reported)")
+    args = parser.parse_args()
+
+    df = synthetic_export_dataframe(args.stations)
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [
+            ("KML", legacy_create_kml, write_kml, "stations.kml", NOW_KML),
+            ("GPX", legacy_create_gpx, write_gpx, "stations.gpx", NOW_GPX),
+        ]
+        for name, legacy, streaming, filename, now in cases:
+            legacy_file = os.path.join(tmp, "legacy_" + filename)
+            streaming_file = os.path.join(tmp, "streaming_" + filename)
+            legacy_time = timed(legacy, df, legacy_file, now, repeat=args.repeat)
+            streaming_time = timed(lambda: streaming(df, streaming_file, now=now), repeat=args.repeat)
+            identical = filecmp.cmp(legacy_file, streaming_file, shallow=False)
+            print(f"{name}: {len(df)} stations, iterrows {legacy_time:.3f}s ({len(df) / legacy_time:,.0f} rows/s), "
+                  f"streaming {streaming_time:.3f}s ({len(df) / streaming_time:,.0f} rows/s), "
+                  f"speedup x{legacy_time / streaming_time:.1f}, byte-identical: {identical}")
+
+        kmz_file = os.path.join(tmp, "stations.kmz")
+        kmz_time = timed(lambda: write_kml(df, kmz_file, now=NOW_KML), repeat=args.repeat)
+        print(f"KMZ: {kmz_time:.3f}s, {os.path.getsize(kmz_file) / 1024:,.0f} KiB "
+              f"(KML {os.path.getsize(os.path.join(tmp, 'streaming_stations.kml')) / 1024:,.0f} KiB)")
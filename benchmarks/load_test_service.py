@@ -0,0 +1,128 @@
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import synthetic_export_dataframe, PROVINCES, SPAIN_STATION_COUNT
+
+QUERIES = ["nearest", "bbox", "cheapest", "station"]
+
+
+def write_stations_csv(path, n, seed=0):
+    df = synthetic_export_dataframe(n, seed)
+    df.insert(0, "CÓDIGO", [f"CC{i:06d}" for i in range(n)])
+    df["IDEESS"] = np.arange(1000, 1000 + n)
+    df["Distancia (km)"] = 0.01
+    df.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+
+def query_path(kind, rng, n):
+    lat, lon = rng.uniform(36.0, 43.8), rng.uniform(-9.3, 3.3)
+    if kind == "nearest":
+        return f"/nearest?lat={lat:.5f}&lon={lon:.5f}&n=5"
+    if kind == "bbox":
+        return f"/bbox?min_lat={lat:.4f}&min_lon={lon:.4f}&max_lat={lat + 0.2:.4f}&max_lon={lon + 0.3:.4f}"
+    if kind == "cheapest":
+        return f"/cheapest?fuel={quote('Gasoleo A')}&province={quote(rng.choice(PROVINCES))}&n=10"
+    return f"/stations/CC{rng.randrange(n):06d}"
+
+
+def client(port, duration, n, seed, cpus):
+    # One keep-alive connection sending queries back to back; returns the latencies by kind and the errors
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    latencies = {kind: [] for kind in QUERIES}
+    errors = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        kind = rng.choice(QUERIES)
+        start = time.perf_counter()
+        connection.request("GET", query_path(kind, rng, n))
+        response = connection.getresponse()
+        response.read()
+        latencies[kind].append(time.perf_counter() - start)
+        errors += response.status != 200
+    connection.close()
+    return latencies, errors
+
+
+def wait_for_service(port, timeout=30):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("The station service did not start")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of station_service.py pinned to a single core")
+    parser.add_argument("--stations", type=int, default=SPAIN_STATION_COUNT,
+                        help=f"Number of synthetic stations (default: {SPAIN_STATION_COUNT})")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent keep-alive connections (default: 4)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load (default: 10)")
+    parser.add_argument("--swap-every", type=float, default=2,
+                        help="Seconds between rewrites of the stations CSV, to measure under hot swaps; 0 disables (default: 2)")
+    parser.add_argument("--port", type=int, default=8099, help="Port of the service (default: 8099)")
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "stations.csv")
+        write_stations_csv(csv_file, args.stations)
+        # The server runs on the first core and the clients on the others, when there are others
+        pin = (lambda: os.sched_setaffinity(0, {0})) if hasattr(os, "sched_setaffinity") else None
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "station_service.py"), "--stations", csv_file, "--port", str(args.port),
+             "--reload-interval", "0.5"],
+            cwd=tmp, preexec_fn=pin, stdout=subprocess.DEVNULL
+        )
+        try:
+            wait_for_service(args.port)
+            client_cpus = set(range(1, cpu_count)) if cpu_count > 1 else None
+            with multiprocessing.Pool(args.clients) as pool:
+                pending = pool.starmap_async(client, [
+                    (args.port, args.duration, args.stations, seed, client_cpus) for seed in range(args.clients)
+                ])
+                swaps = 0
+                start = time.perf_counter()
+                while not pending.ready():
+                    pending.wait(args.swap_every or None)
+                    if args.swap_every and not pending.ready():
+                        write_stations_csv(csv_file, args.stations, seed=swaps + 1)
+                        swaps += 1
+                results = pending.get()
+                elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies = {kind: np.concatenate([r[0][kind] for r in results]) * 1000 for kind in QUERIES}
+    errors = sum(r[1] for r in results)
+    total = sum(len(v) for v in latencies.values())
+    print(f"{args.stations} stations, {args.clients} clients, {elapsed:.1f}s, {swaps} dataset swaps, server on 1 core")
+    print(f"{'query':<10} {'requests':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for kind, values in latencies.items():
+        print(f"{kind:<10} {len(values):>9} {np.percentile(values, 50):8.2f} {np.percentile(values, 99):8.2f}")
+    every = np.concatenate(list(latencies.values()))
+    print(f"{'all':<10} {total:>9} {np.percentile(every, 50):8.2f} {np.percentile(every, 99):8.2f}")
+    print(f"{total / elapsed:.0f} requests/s, {errors} errors")
+    print(json.dumps({"requests_per_second": round(total / elapsed, 1), "errors": errors}))
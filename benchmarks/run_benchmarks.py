@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieve_stations import (
+    get_circulo_conductores_dataframe, parse_ministry_payload_compact, normalize_dfs, create_kml, create_gpx
+)
+from station_matching import build_station_index, match_nearest_stations, match_columns
+from station_projection import parse_fuels, select_networks
+from synthetic import (
+    synthetic_ministry_stations, synthetic_circulo_conductores_payload, SPAIN_STATION_COUNT
+)
+
+# Relative slowdown of the best time above which a stage is reported as a regression
+DEFAULT_THRESHOLD = 0.2
+
+
+def measure(function, repeat):
+    # Best and median wall time of repeat calls; setup work belongs outside function
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def run_scale(scale, repeat, tmp, fuels):
+    n = int(SPAIN_STATION_COUNT * scale)
+    stations = synthetic_ministry_stations(n)
+    ministry_payload = json.dumps({"ListaEESSPrecio": stations}, ensure_ascii=False).encode("utf-8")
+    circulo_payload = synthetic_circulo_conductores_payload(stations)
+    del stations
+    cc_csv = os.path.join(tmp, "circulo.csv")
+
+    def parse_circulo():
+        if os.path.exists(cc_csv):
+            os.remove(cc_csv)
+        return get_circulo_conductores_dataframe(cc_csv, "https://example.invalid/edit?gid=0", circulo_payload)
+
+    # Inputs of each stage are produced once by the previous one and reused by every repetition
+    df_min = parse_ministry_payload_compact(ministry_payload, fuels)
+    df_cc = select_networks(parse_circulo())
+    df_cc_norm, df_min_norm = normalize_dfs(df_cc.copy(), df_min.copy())
+    index = build_station_index(df_min_norm)
+    matched = df_cc_norm.copy()
+    matched[match_columns(fuels)] = match_nearest_stations(df_cc_norm, df_min_norm, index=index, fuels=fuels)
+
+    stages = [
+        ("parse_ministry", len(df_min), lambda: parse_ministry_payload_compact(ministry_payload, fuels)),
+        ("parse_circulo_conductores", len(df_cc), parse_circulo),
+        ("normalize", len(df_min) + len(df_cc), lambda: normalize_dfs(df_cc.copy(), df_min.copy())),
+        ("build_index", len(df_min_norm), lambda: build_station_index(df_min_norm)),
+        ("match", len(df_cc_norm), lambda: match_nearest_stations(df_cc_norm, df_min_norm, index=index, fuels=fuels)),
+        ("export_kml", len(matched), lambda: create_kml(matched, os.path.join(tmp, "stations.kml"), fuels=fuels)),
+        ("export_gpx", len(matched), lambda: create_gpx(matched, os.path.join(tmp, "stations.gpx"), fuels=fuels)),
+    ]
+    results = []
+    for stage, rows, function in stages:
+        best, median = measure(function, repeat)
+        results.append({
+            "scale": scale,
+            "stage": stage,
+            "rows": rows,
+            "min_seconds": round(best, 6),
+            "median_seconds": round(median, 6)
+        })
+        print(f"{scale:>5g}x {stage:<28} {rows:>9} rows  min {best:8.3f}s  median {median:8.3f}s", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Returns the (scale, stage, ratio) of the stages whose best time grew more than threshold
+    previous = {(r["scale"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get((r["scale"], r["stage"]))
+        if not old or old["min_seconds"] <= 0:
+            continue
+        ratio = r["min_seconds"] / old["min_seconds"]
+        marker = "REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{r['scale']:>5g}x {r['stage']:<28} {old['min_seconds']:8.3f}s -> {r['min_seconds']:8.3f}s  x{ratio:.2f} {marker}")
+        if marker:
+            regressions.append((r["scale"], r["stage"], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of the retrieve/match/export stages on synthetic national-scale data",
+        allow_abbrev=False
+    )
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10],
+                        help="Multiples of the national station count to benchmark, e.g. 1 10 100 (default: 1 10)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per stage (default: 3)")
+    parser.add_argument("--fuels", help="Comma separated fuels to parse, match and export, as in FUEL_COLUMNS (default: the two default fuels)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Slowdown reported as a regression (default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args()
+    fuels = parse_fuels(args.fuels)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales:
+            results += run_scale(scale, args.repeat, tmp, fuels)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fuels": fuels,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
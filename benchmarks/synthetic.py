@@ -0,0 +1,186 @@
+import csv
+import io
+import json
+import numpy as np
+import pandas as pd
+from station_names import normalize_name, PROVINCE_ALIASES, PROVINCE_IDS
+
+# Approximate number of gas stations published by the Ministry for the whole country
+SPAIN_STATION_COUNT = 12_000
+
+# Share of the Ministry stations that appear in the Circulo Conductores sheet
+CIRCULO_CONDUCTORES_SHARE = 0.1
+
+PROVINCES = [
+    "MADRID", "BARCELONA", "VALENCIA", "SEVILLA", "MALAGA", "ALICANTE", "MURCIA", "CADIZ",
+    "VIZCAYA", "LA CORUÑA", "BALEARES", "LAS PALMAS", "ZARAGOZA", "ASTURIAS", "GRANADA"
+]
+
+# (name in the Ministry feed, name in the Circulo Conductores sheet, latitude, longitude)
+MINISTRY_PROVINCES = [
+    ("MADRID", "Madrid", 40.42, -3.70),
+    ("BARCELONA", "Barcelona", 41.39, 2.17),
+    ("VALENCIA / VALÈNCIA", "Valencia", 39.47, -0.38),
+    ("SEVILLA", "Sevilla", 37.39, -5.98),
+    ("MÁLAGA", "Málaga", 36.72, -4.42),
+    ("ALICANTE", "Alicante", 38.35, -0.48),
+    ("MURCIA", "Murcia", 37.99, -1.13),
+    ("CÁDIZ", "Cádiz", 36.53, -6.29),
+    ("BIZKAIA", "Vizcaya", 43.26, -2.93),
+    ("CORUÑA (A)", "La Coruña", 43.36, -8.41),
+    ("BALEARS (ILLES)", "Baleares", 39.57, 2.65),
+    ("PALMAS (LAS)", "Las Palmas", 28.12, -15.44),
+    ("ZARAGOZA", "Zaragoza", 41.65, -0.88),
+    ("ASTURIAS", "Asturias", 43.36, -5.85),
+    ("GRANADA", "Granada", 37.18, -3.60),
+    ("GIRONA", "Gerona", 41.98, 2.82),
+    ("LLEIDA", "Lérida", 41.62, 0.62),
+    ("OURENSE", "Orense", 42.34, -7.86),
+    ("RIOJA (LA)", "La Rioja", 42.47, -2.45),
+    ("CASTELLÓN / CASTELLÓ", "Castellón", 39.99, -0.05),
+]
+
+# INE code of each of MINISTRY_PROVINCES, as the IDProvincia of the feed and its FiltroProvincia URLs
+MINISTRY_PROVINCE_IDS = [
+    PROVINCE_IDS[PROVINCE_ALIASES.get(normalize_name(name), normalize_name(name))] for name, _, _, _ in MINISTRY_PROVINCES
+]
+
+MINISTRY_PRICE_COLUMNS = [
+    "Precio Biodiesel", "Precio Bioetanol", "Precio Gas Natural Comprimido", "Precio Gas Natural Licuado",
+    "Precio Gases licuados del petróleo", "Precio Gasoleo A", "Precio Gasoleo B", "Precio Gasoleo Premium",
+    "Precio Gasolina 95 E10", "Precio Gasolina 95 E5", "Precio Gasolina 95 E5 Premium", "Precio Gasolina 98 E10",
+    "Precio Gasolina 98 E5", "Precio Hidrogeno"
+]
+
+# Share of the stations that sell each fuel; the rest publish an empty price
+FUEL_AVAILABILITY = {
+    "Precio Gasoleo A": 0.99,
+    "Precio Gasolina 95 E5": 0.97,
+    "Precio Gasolina 98 E5": 0.6,
+    "Precio Gasoleo Premium": 0.7,
+    "Precio Gases licuados del petróleo": 0.1,
+}
+
+BRANDS = ["REPSOL", "CEPSA", "GALP", "SHELL", "BP", "PLENOIL", "BALLENOIL", "PETROPRIX"]
+
+CIRCULO_CONDUCTORES_COLUMNS = [
+    "CÓDIGO", "CENTRO", "DIRECCIÓN", "C.P.", "Municipio", "Provincia", "CONCESIÓN", "TELÉFONO",
+    "HORARIO", "Coordenada X", "Coordenada Y", "Red Fleet", "Descuento", "Notas"
+]
+
+
+def _decimal_comma(values, digits):
+    return [f"{v:.{digits}f}".replace(".", ",") for v in values]
+
+
+def synthetic_ministry_stations(n=SPAIN_STATION_COUNT, seed=0):
+    # Deterministic list of stations with the fields and formats of ListaEESSPrecio
+    rng = np.random.default_rng(seed)
+    province = rng.integers(0, len(MINISTRY_PROVINCES), n)
+    centers = np.array([(lat, lon) for _, _, lat, lon in MINISTRY_PROVINCES])
+    lat = centers[province, 0] + rng.normal(0, 0.35, n)
+    lon = centers[province, 1] + rng.normal(0, 0.45, n)
+    municipality = rng.integers(0, 400, n)
+    brand = rng.integers(0, len(BRANDS), n)
+
+    prices = {}
+    for col in MINISTRY_PRICE_COLUMNS:
+        available = rng.random(n) < FUEL_AVAILABILITY.get(col, 0.02)
+        values = _decimal_comma(rng.uniform(1.25, 1.95, n), 3)
+        prices[col] = [v if a else "" for v, a in zip(values, available)]
+
+    lat_text, lon_text = _decimal_comma(lat, 6), _decimal_comma(lon, 6)
+    stations = []
+    for i in range(n):
+        ministry_name = MINISTRY_PROVINCES[province[i]][0]
+        station = {
+            "C.P.": f"{28000 + municipality[i]:05d}",
+            "Dirección": f"CALLE MAYOR, {i % 300}",
+            "Horario": "L-D: 24H",
+            "Latitud": lat_text[i],
+            "Localidad": f"LOCALIDAD {province[i]}-{municipality[i]}",
+            "Longitud (WGS84)": lon_text[i],
+            "Margen": "D",
+            "Municipio": f"Municipio {province[i]}-{municipality[i]}",
+        }
+        station.update({col: prices[col][i] for col in MINISTRY_PRICE_COLUMNS})
+        station.update({
+            "Provincia": ministry_name,
+            "Remisión": "dm",
+            "Rótulo": BRANDS[brand[i]],
+            "Tipo Venta": "P",
+            "% BioEtanol": "0,0",
+            "% Éster metílico": "0,0",
+            "IDEESS": str(1000 + i),
+            "IDMunicipio": str(province[i] * 1000 + municipality[i]),
+            "IDProvincia": MINISTRY_PROVINCE_IDS[province[i]],
+            "IDCCAA": "13",
+        })
+        stations.append(station)
+    return stations
+
+
+def synthetic_ministry_payload(n=SPAIN_STATION_COUNT, seed=0):
+    # Bytes of a response of the EstacionesTerrestres endpoint
+    data = {
+        "Fecha": "01/01/2024 8:00:00",
+        "ListaEESSPrecio": synthetic_ministry_stations(n, seed),
+        "Nota": "Archivo de todos los productos en todas las estaciones de servicio.",
+        "ResultadoConsulta": "OK"
+    }
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def synthetic_circulo_conductores_payload(stations, share=CIRCULO_CONDUCTORES_SHARE, seed=0):
+    # Bytes of the CSV export of the Circulo Conductores sheet: three filler rows, the header in the
+    # fourth row and an extra column that get_circulo_conductores_dataframe drops. The stations are
+    # placed a few meters away from a subset of the Ministry stations.
+    rng = np.random.default_rng(seed + 1)
+    n = max(1, int(len(stations) * share))
+    chosen = rng.choice(len(stations), n, replace=False)
+    circulo_names = {ministry: circulo for ministry, circulo, _, _ in MINISTRY_PROVINCES}
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([f"Unnamed: {i}" for i in range(len(CIRCULO_CONDUCTORES_COLUMNS))])
+    writer.writerow(["CIRCULO DE CONDUCTORES"] + [""] * (len(CIRCULO_CONDUCTORES_COLUMNS) - 1))
+    writer.writerow(["Red de estaciones"] + [""] * (len(CIRCULO_CONDUCTORES_COLUMNS) - 1))
+    writer.writerow([""] * len(CIRCULO_CONDUCTORES_COLUMNS))
+    writer.writerow(CIRCULO_CONDUCTORES_COLUMNS)
+    for i, j in enumerate(chosen):
+        station = stations[j]
+        lat = float(station["Latitud"].replace(",", ".")) + rng.normal(0, 0.0002)
+        lon = float(station["Longitud (WGS84)"].replace(",", ".")) + rng.normal(0, 0.0002)
+        writer.writerow([
+            f"CC{i:06d}",
+            f"E.S. {station['Rótulo']} {i}",
+            station["Dirección"],
+            station["C.P."],
+            station["Municipio"].upper(),
+            circulo_names[station["Provincia"]],
+            station["Rótulo"],
+            "900000000",
+            station["Horario"],
+            f"{lon:.6f}".replace(".", ","),
+            f"{lat:.6f}".replace(".", ","),
+            "Sí" if rng.random() < 0.8 else "No",
+            "5 cts/l",
+            ""
+        ])
+    return output.getvalue().encode("utf-8")
+
+
+def synthetic_export_dataframe(n=SPAIN_STATION_COUNT, seed=0):
+    # Deterministic DataFrame with the columns used by the KML/GPX writers
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "CENTRO": [f"Estación & Servicio {i}" for i in range(n)],
+        "DIRECCIÓN": [f"Calle <Mayor> {i % 300}, km {i % 50}" for i in range(n)],
+        "MUNICIPIO": [f"MUNICIPIO {i % 8000}" for i in range(n)],
+        "PROVINCIA": rng.choice(PROVINCES, n),
+        "CONCESIÓN": rng.choice(["REPSOL", "CEPSA", "GALP"], n),
+        "Coordenada X": rng.uniform(-9.3, 3.3, n).round(6),
+        "Coordenada Y": rng.uniform(36.0, 43.8, n).round(6),
+        "Precio Gasolina 95 E5": rng.uniform(1.40, 1.85, n).round(3),
+        "Precio Gasoleo A": rng.uniform(1.30, 1.75, n).round(3),
+    })
@@ -0,0 +1,137 @@
+import logging
+from logging.handlers import RotatingFileHandler
+
+# Pieces shared by the command line scripts that only need the standard library, so that redfleet.py can
+# build the parsers of every subcommand and set up logging without importing pandas or Playwright
+
+DEFAULT_LOG_LEVEL = "INFO"
+
+DEFAULT_STATIONS_PRICE_FILE = "gasolineras_red_fleet_precio.kml"
+
+DEFAULT_STATIONS_METRICS_FILE = "stations_metrics.json"
+
+LOG_FORMAT = '%(asctime)s %(levelname)s:%(message)s'
+
+# Handlers installed by setup_logging, replaced when it is called again
+_handlers = []
+
+
+def setup_logging(log_file, log_level, log_console=False):
+    # Set up logging to write to a file instead of the console. A second call replaces the handlers of the
+    # first one instead of adding more, so each message is written once.
+    logger = logging.getLogger()
+    while _handlers:
+        handler = _handlers.pop()
+        logger.removeHandler(handler)
+        handler.close()
+    # Convert the string to a numeric logging level
+    logger.setLevel(getattr(logging, log_level, logging.INFO))
+
+    # Handler para fichero rotativo (100MB, hasta 3 backups)
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=100*1024*1024, backupCount=3, encoding='utf-8'
+    )
+    _handlers.append(file_handler)
+
+    # Handler para consola solo si --log-console está presente
+    if log_console:
+        _handlers.append(logging.StreamHandler())
+
+    for handler in _handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+
+
+def add_log_console_argument(parser):
+    parser.add_argument(
+        "--log-console",
+        action="store_true",
+        default=False,
+        help="Enable logging to console (default: False)"
+    )
+
+
+def add_retrieve_arguments(parser):
+    parser.add_argument(
+        "--exact-matching",
+        action="store_true",
+        default=False,
+        help="Measure every candidate station with geodesic distance instead of the haversine prefilter (default: False)"
+    )
+
+    parser.add_argument(
+        "--match-by-province",
+        action="store_true",
+        default=False,
+        help="Only search the nearest station within the same province (default: False)"
+    )
+
+    parser.add_argument(
+        "--province-fetch",
+        action="store_true",
+        default=False,
+        help="Download only the Ministry feeds of the provinces with Red Fleet stations (default: False)"
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes that match the stations, by province or by map tile; 0 uses every core (default: 1)"
+    )
+
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        default=False,
+        help="Ignore the previous run state and write every file (default: False)"
+    )
+
+    parser.add_argument(
+        "--rebuild-matches",
+        action="store_true",
+        default=False,
+        help="Clear the match cache and match every station again (default: False)"
+    )
+
+    parser.add_argument(
+        "--split-layers",
+        choices=["province", "price"],
+        required=False,
+        help="Also write one KML layer file per province or per price band"
+    )
+
+    parser.add_argument(
+        "--price-trends",
+        type=int,
+        metavar="DAYS",
+        required=False,
+        help="Add the minimum, average and change of the prices over the last DAYS days to the KML (needs PRICE_HISTORY_FILE)"
+    )
+
+
+def add_browser_arguments(parser):
+    # Options of the browser that updates Google My Maps
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        default=False,
+        help="Use persistent session (default: False)"
+    )
+    parser.add_argument(
+        "--headed",
+        action="store_true",
+        default=False,
+        help="Run in headed mode (default: False)"
+    )
+    parser.add_argument(
+        "--docker-server",
+        required=False,
+        help="WebSocket URL of the Playwright server running in Docker (e.g., ws://localhost:3000)"
+    )
+    parser.add_argument(
+        "--reuse-session",
+        action="store_true",
+        default=False,
+        help="Save the Google session after logging in and reuse it in later runs (default: False)"
+    )
@@ -0,0 +1,89 @@
+import gzip
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_cache import create_session, fetch_cached, bytes_received
+
+# Checks the hit and miss paths of http_cache.fetch_cached, and the bytes counted as received, against a
+# local stub of a feed that answers If-None-Match with 304, without reaching the Ministry:
+# python dev/check_http_cache.py
+
+
+class StubFeed(BaseHTTPRequestHandler):
+    # body, etag and status of the feed, and the If-None-Match header of each request received
+    body = b'{"ListaEESSPrecio": []}'
+    etag = '"v1"'
+    status = 200
+    requests = []
+
+    def do_GET(self):
+        StubFeed.requests.append(self.headers.get("If-None-Match"))
+        if self.status != 200:
+            self.send_response(self.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.etag)
+            self.end_headers()
+            return
+        body = gzip.compress(self.body) if "gzip" in self.headers.get("Accept-Encoding", "") else self.body
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def check(name, condition):
+    print(f"{'✅' if condition else '❌'} {name}")
+    return condition
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubFeed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/feed.json"
+    # Without retries, so the error responses are not repeated with backoff
+    session = create_session(retries=0)
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        payload, changed = fetch_cached(url, cache_dir, ttl=300, session=session)
+        results.append(check("miss: downloaded and stored", changed and payload == StubFeed.body and StubFeed.requests == [None]))
+        results.append(check("miss: compressed bytes counted", bytes_received(session, reset=True) == len(gzip.compress(StubFeed.body))))
+
+        payload, changed = fetch_cached(url, cache_dir, ttl=300, session=session)
+        results.append(check("hit within the TTL: no request", not changed and payload == StubFeed.body and len(StubFeed.requests) == 1))
+
+        payload, changed = fetch_cached(url, cache_dir, ttl=0, session=session)
+        results.append(check("expired: revalidated with If-None-Match and answered 304",
+                             not changed and payload == StubFeed.body and StubFeed.requests[-1] == '"v1"'))
+        results.append(check("304: no bytes counted", bytes_received(session) == 0))
+
+        StubFeed.body, StubFeed.etag = b'{"ListaEESSPrecio": [{}]}', '"v2"'
+        payload, changed = fetch_cached(url, cache_dir, ttl=0, session=session)
+        results.append(check("expired and changed: downloaded again", changed and payload == StubFeed.body))
+
+        StubFeed.status = 503
+        payload, changed = fetch_cached(url, cache_dir, ttl=0, session=session)
+        results.append(check("server error: cached copy", not changed and payload == StubFeed.body))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        try:
+            fetch_cached(url, cache_dir, ttl=0, session=session)
+            results.append(check("server error without a cached copy: raised", False))
+        except requests.RequestException:
+            results.append(check("server error without a cached copy: raised", True))
+    server.shutdown()
+    exit(0 if all(results) else 1)
@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+from playwright.sync_api import sync_playwright, Error as PlaywrightError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Metrics
+from update_mymaps import MyMapsSession
+from upload_targets import file_payload
+
+# Runs MyMapsSession.update_map against dev/mymaps_standin.html for each case and checks that the file
+# ends up in the expected layer, without a Google account: python dev/run_standin.py [--headed]
+
+STANDIN_FILE = Path(__file__).resolve().parent / "mymaps_standin.html"
+
+# (case, layers of the stand-in map, layer passed to update_map, layer expected to take the file,
+#  whether the file is passed in memory)
+CASES = [
+    ("single layer", 1, None, "Gasolineras", False),
+    ("second of two layers", 2, "Gasóleo", "Gasóleo", False),
+    ("first of two layers, from memory", 2, "Gasolineras", "Gasolineras", True),
+]
+
+KML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document><Placemark><name>Stand-in</name>
+<Point><coordinates>-3.7038,40.4168</coordinates></Point></Placemark></Document></kml>
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the My Maps update flow against the offline stand-in")
+    parser.add_argument("--headed", action="store_true", default=False, help="Show the browser (default: False)")
+    parser.add_argument("--slow", type=float, default=1, help="Factor of the delays of the stand-in (default: 1)")
+    args = parser.parse_args()
+
+    metrics = Metrics("mymaps_standin")
+    messages = []
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        stations_file = os.path.join(tmp, "stand-in.kml")
+        with open(stations_file, "wb") as f:
+            f.write(KML)
+        try:
+            with sync_playwright() as p:
+                # An empty restored session, so the flow opens the map without logging in to Google
+                with MyMapsSession(p, None, None, headless=not args.headed, metrics=metrics,
+                                   storage_state={"cookies": [], "origins": []}) as session:
+                    session.context.on("page", lambda page: page.on("console", lambda message: messages.append(message.text)))
+                    for case, layers, layer, expected, in_memory in CASES:
+                        map_url = f"{STANDIN_FILE.as_uri()}?layers={layers}&slow={args.slow}"
+                        upload = file_payload(stations_file)[0] if in_memory else stations_file
+                        del messages[:]
+                        uploaded = session.update_map(map_url, upload, layer)
+                        ok = uploaded and f"Imported {os.path.basename(stations_file)} into {expected}" in messages
+                        print(f"{'✅' if ok else '❌'} {case}: {messages[-1] if messages else 'nothing imported'}")
+                        results.append(ok)
+        except PlaywrightError as e:
+            print(f"❌ {e}")
+            exit(1)
+
+    failed = [record["step"] for record in metrics.trace if record["status"] != "ok"]
+    print(f"{len(metrics.trace)} steps traced{f', failed: {failed}' if failed else ''}")
+    exit(0 if all(results) and not failed else 1)
@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = 60
+
+DEFAULT_RETRIES = 3
+
+
+def create_session(retries=DEFAULT_RETRIES, pool_size=10):
+    # Session with connection reuse and retries with exponential backoff on transient errors
+    retry = Retry(
+        total=retries,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"]
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Bytes of the response bodies as they came over the wire, before they are decompressed
+    session.bytes_received = 0
+    session.bytes_received_lock = threading.Lock()
+    session.hooks["response"].append(lambda response, *args, **kwargs: _count_received(session, response))
+    return session
+
+
+def _count_received(session, response):
+    # The body is read here, as requests would do next anyway, so that urllib3 has counted its bytes as
+    # received; a 304 has no body. Downloads of the same session may run in several threads.
+    response.content
+    with session.bytes_received_lock:
+        session.bytes_received += response.raw.tell()
+
+
+def bytes_received(session, reset=False):
+    # Bytes received by a session of create_session since it was created or last reset
+    with session.bytes_received_lock:
+        received = session.bytes_received
+        if reset:
+            session.bytes_received = 0
+    return received
+
+
+def fetch_concurrently(downloads, max_workers=None):
+    # Runs every download callable of the dict at the same time (at most max_workers at once) and returns
+    # their results by name. The first error is raised once all downloads have finished.
+    if not downloads:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(downloads), max_workers or len(downloads))) as executor:
+        futures = {name: executor.submit(download) for name, download in downloads.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def cache_file(cache_dir, url, extension):
+    # Path of a file derived from url inside the cache directory
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{key}{extension}")
+
+
+def _cache_paths(cache_dir, url):
+    return cache_file(cache_dir, url, ".gz"), cache_file(cache_dir, url, ".meta.json")
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def _read_payload(payload_path):
+    with gzip.open(payload_path, "rb") as f:
+        return f.read()
+
+
+def fetch_cached(url, cache_dir, ttl=0, headers=None, session=None, timeout=DEFAULT_TIMEOUT):
+    # Returns (payload, changed). The payload is served from disk while it is younger than ttl
+    # seconds; after that it is revalidated with ETag/Last-Modified, so an unchanged resource
+    # costs a 304 round-trip. changed is False whenever the cached payload is returned.
+    os.makedirs(cache_dir, exist_ok=True)
+    payload_path, meta_path = _cache_paths(cache_dir, url)
+    meta = _read_meta(meta_path) if os.path.exists(payload_path) else {}
+
+    if meta and time.time() - meta.get("fetched_at", 0) < ttl:
+        logging.info(f"💾 Using cached copy of {url}")
+        return _read_payload(payload_path), False
+
+    request_headers = {"Accept-Encoding": "gzip"}
+    request_headers.update(headers or {})
+    if meta.get("etag"):
+        request_headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        request_headers["If-Modified-Since"] = meta["last_modified"]
+
+    session = session or create_session()
+    try:
+        response = session.get(url, headers=request_headers, timeout=timeout)
+    except requests.RequestException as e:
+        if meta:
+            logging.warning(f"⚠️ Error fetching {url} ({e}), using cached copy")
+            return _read_payload(payload_path), False
+        raise
+
+    if response.status_code == 304 and meta:
+        logging.info(f"💾 {url} not modified, using cached copy")
+        meta["fetched_at"] = time.time()
+        _write_meta(meta_path, meta)
+        return _read_payload(payload_path), False
+
+    if response.status_code != 200 and meta:
+        logging.warning(f"⚠️ Error fetching {url} (status code {response.status_code}), using cached copy")
+        return _read_payload(payload_path), False
+    response.raise_for_status()
+
+    payload = response.content
+    tmp_path = payload_path + ".tmp"
+    with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+        f.write(payload)
+    os.replace(tmp_path, payload_path)
+    _write_meta(meta_path, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time()
+    })
+    return payload, True
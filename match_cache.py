@@ -0,0 +1,152 @@
+import logging
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from spatial_index import StationIndex
+from station_matching import PRICE_COLUMNS, EXACT_SEARCH_FACTOR, DEFAULT_TOP_K, match_columns, price_values
+
+# Appended to the Circulo Conductores CSV file name when MATCH_CACHE_FILE is not configured
+MATCH_CACHE_SUFFIX = "_matches.sqlite"
+
+# Version of SCHEMA; a cache written by an older version is dropped and filled again
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    centro TEXT NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    ideess TEXT NOT NULL,
+    distance REAL,
+    ministry_lat REAL,
+    ministry_lon REAL,
+    mode TEXT NOT NULL,
+    PRIMARY KEY (centro, lat, lon)
+);
+CREATE INDEX IF NOT EXISTS matches_ideess ON matches (ideess);
+CREATE TABLE IF NOT EXISTS ministry_stations (
+    ideess TEXT PRIMARY KEY,
+    lat REAL,
+    lon REAL
+);
+"""
+
+
+def default_match_cache_file(cc_csv_filename):
+    return os.path.splitext(cc_csv_filename)[0] + MATCH_CACHE_SUFFIX
+
+
+def open_match_cache(path):
+    conn = sqlite3.connect(path)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # Older caches do not record the matching mode of their matches
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS matches")
+            conn.execute("DROP TABLE IF EXISTS ministry_stations")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def match_mode(by_province=False, exact=False, top_k=DEFAULT_TOP_K):
+    # Name of the search that produced a match (see station_matching.match_nearest_stations). Each mode
+    # may pick a different station, so a cached match is only reused by a run of the same mode.
+    return f"{'by_province' if by_province else 'indexed'}{'_exact' if exact else ''}_top{top_k}"
+
+
+def clear_match_cache(conn):
+    with conn:
+        conn.execute("DELETE FROM matches")
+        conn.execute("DELETE FROM ministry_stations")
+    logging.info("🧹 Match cache cleared, every station will be matched again")
+
+
+def empty_matches(index, fuels=PRICE_COLUMNS):
+    matches = pd.DataFrame(np.nan, index=index, columns=match_columns(fuels))
+    matches["IDEESS"] = matches["IDEESS"].astype(object)
+    return matches
+
+
+def _cc_keys(df_cc):
+    return pd.DataFrame({
+        "centro": df_cc["CENTRO"].fillna("").astype(str).to_numpy(),
+        "lat": pd.to_numeric(df_cc["Coordenada Y"], errors="coerce").to_numpy(dtype=float),
+        "lon": pd.to_numeric(df_cc["Coordenada X"], errors="coerce").to_numpy(dtype=float)
+    }, index=df_cc.index)
+
+
+def _ministry_stations(df_min):
+    return pd.DataFrame({
+        "ideess": df_min["IDEESS"].astype(str).to_numpy(),
+        "lat": df_min["Latitud"].to_numpy(dtype=float),
+        "lon": df_min["Longitud (WGS84)"].to_numpy(dtype=float)
+    }).drop_duplicates("ideess")
+
+
+def cached_matches(conn, df_cc, df_min, fuels=PRICE_COLUMNS, mode=match_mode()):
+    # Returns (matches, pending). Cached matches are joined by IDEESS with the fresh Ministry prices.
+    # A cached match is invalidated when it was found by another matching mode, when the Red Fleet
+    # station moved (it is part of the key), when its Ministry station moved or disappeared, or when a
+    # new Ministry station opened closer to it.
+    matches = empty_matches(df_cc.index, fuels)
+    cached = pd.read_sql_query("SELECT * FROM matches", conn)
+    other_mode = cached["mode"] != mode
+    if other_mode.any():
+        logging.info(f"🔎 {int(other_mode.sum())} cached matches of another matching mode than {mode} are ignored")
+    cached = cached[~other_mode].drop(columns="mode")
+    if cached.empty:
+        return matches, pd.Series(True, index=df_cc.index)
+
+    ministry = _ministry_stations(df_min)
+    rows = _cc_keys(df_cc).reset_index().merge(cached, on=["centro", "lat", "lon"], how="inner")
+    rows = rows.merge(ministry, on="ideess", how="inner", suffixes=("", "_now"))
+    rows = rows[(rows["ministry_lat"] == rows["lat_now"]) & (rows["ministry_lon"] == rows["lon_now"])]
+
+    known_ids = pd.read_sql_query("SELECT ideess FROM ministry_stations", conn)["ideess"]
+    new_stations = ministry[~ministry["ideess"].isin(known_ids)]
+    if len(new_stations) and len(known_ids) and len(rows):
+        logging.info(f"🆕 {len(new_stations)} new Ministry stations since the matches were cached")
+        new_index = StationIndex(new_stations["lat"].to_numpy(), new_stations["lon"].to_numpy())
+        closer = [
+            len(new_index.query_radius(lat, lon, distance * EXACT_SEARCH_FACTOR + 0.001)[0]) > 0
+            for lat, lon, distance in zip(rows["lat"], rows["lon"], rows["distance"])
+        ]
+        rows = rows[~np.array(closer, dtype=bool)]
+
+    index_column = df_cc.index.name or "index"
+    rows = rows.set_index(index_column)
+    prices_by_id = df_min.assign(IDEESS=df_min["IDEESS"].astype(str)).drop_duplicates("IDEESS").set_index("IDEESS")
+    matches.loc[rows.index, list(fuels)] = price_values(prices_by_id.loc[rows["ideess"]], fuels)
+    matches.loc[rows.index, "IDEESS"] = rows["ideess"].to_numpy()
+    matches.loc[rows.index, "Distancia (km)"] = rows["distance"].to_numpy()
+    return matches, pd.Series(~df_cc.index.isin(rows.index), index=df_cc.index)
+
+
+def store_matches(conn, df_cc, df_min, partial=False, mode=match_mode()):
+    # partial is True when df_min only has the stations of some provinces (--province-fetch): they are then
+    # merged into the known Ministry stations instead of replacing them, so the next national run does not
+    # take the stations of the other provinces for new ones. Such a run matches within each province, and
+    # its matches are only kept by later runs of that mode (see match_mode).
+    keys = _cc_keys(df_cc)
+    ministry = _ministry_stations(df_min).set_index("ideess")
+    found = df_cc["IDEESS"].notna() & keys["lat"].notna() & keys["lon"].notna()
+    ids = df_cc.loc[found, "IDEESS"].astype(str)
+    records = zip(
+        keys.loc[found, "centro"],
+        keys.loc[found, "lat"],
+        keys.loc[found, "lon"],
+        ids,
+        df_cc.loc[found, "Distancia (km)"].astype(float),
+        ministry.loc[ids, "lat"],
+        ministry.loc[ids, "lon"],
+        [mode] * int(found.sum())
+    )
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+        if not partial:
+            conn.execute("DELETE FROM ministry_stations")
+        conn.executemany(
+            "INSERT OR REPLACE INTO ministry_stations VALUES (?, ?, ?)",
+            ministry.reset_index()[["ideess", "lat", "lon"]].itertuples(index=False, name=None)
+        )
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Prefix of the metric names written in Prometheus textfile-collector format
+PROMETHEUS_PREFIX = "redfleet"
+
+
+def peak_rss_bytes():
+    # Peak resident set size of the process so far, None where it cannot be measured
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Metrics:
+    # Collects per-stage measurements of one run of a job:
+    #
+    #     metrics = Metrics("retrieve_stations")
+    #     with metrics.stage("match") as stage:
+    #         ...
+    #         stage["rows_in"] = len(df)
+
+    def __init__(self, job):
+        self.job = job
+        self.started_at = time.time()
+        self.stages = {}
+        self.trace = []
+        # Stages and steps may be recorded from the worker threads of a batch update
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        record = self.stages.setdefault(name, {})
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        except BaseException as e:
+            # failed is a number so that it is also written as a gauge
+            record["failed"] = 1
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            with self._lock:
+                record["wall_seconds"] = round(record.get("wall_seconds", 0) + time.perf_counter() - wall_start, 6)
+                record["cpu_seconds"] = round(record.get("cpu_seconds", 0) + time.process_time() - cpu_start, 6)
+                record["peak_rss_bytes"] = peak_rss_bytes()
+            logging.info(f"⏱️ Stage {name}: {record['wall_seconds']:.2f}s wall, {record['cpu_seconds']:.2f}s CPU")
+
+    @contextmanager
+    def step(self, name):
+        # Finer grained than stages: every step is appended to the trace in order, with its outcome
+        record = {"step": name, "status": "ok", "offset_seconds": round(time.time() - self.started_at, 6)}
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            if record["status"] == "ok":
+                record["status"] = "error"
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            with self._lock:
+                self.trace.append(record)
+            logging.debug(f"⏱️ Step {name}: {record['seconds']:.2f}s ({record['status']})")
+
+    def add(self, record, key, amount):
+        # Adds amount to a counter of a stage record; stages are shared by the worker threads of a batch
+        with self._lock:
+            record[key] = record.get(key, 0) + amount
+
+    def as_dict(self):
+        return {
+            "job": self.job,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "wall_seconds": round(time.time() - self.started_at, 6),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "stages": self.stages,
+            "trace": self.trace
+        }
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.as_dict(), indent=2, ensure_ascii=False))
+
+    def write_prometheus(self, path):
+        # Textfile-collector format: only numeric stage values become gauges labelled by job and stage
+        names = sorted({key for record in self.stages.values() for key, value in record.items() if _is_number(value)})
+        lines = []
+        for key in names:
+            metric = f"{PROMETHEUS_PREFIX}_stage_{key}"
+            lines.append(f"# TYPE {metric} gauge")
+            for stage, record in self.stages.items():
+                if _is_number(record.get(key)):
+                    lines.append(f'{metric}{{job="{self.job}",stage="{stage}"}} {record[key]}')
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds{{job="{self.job}"}} {int(self.started_at)}')
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+    def write(self, json_file=None, prometheus_dir=None):
+        try:
+            if json_file:
+                self.write_json(json_file)
+            if prometheus_dir:
+                self.write_prometheus(os.path.join(prometheus_dir, f"{self.job}.prom"))
+        except OSError as e:
+            logging.warning(f"⚠️ Could not write metrics: {e}")
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _write_atomic(path, content):
+    # The textfile collector may read at any time, so never expose a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
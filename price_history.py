@@ -0,0 +1,165 @@
+import logging
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from station_matching import PRICE_COLUMNS, PRICE_DECIMALS
+
+# The history is kept only when PRICE_HISTORY_FILE names a file
+DEFAULT_PRICE_HISTORY_FILE = ""
+
+# Days of price changes kept in the history; 0 keeps them all
+DEFAULT_PRICE_HISTORY_DAYS = 90
+
+SECONDS_PER_DAY = 86400
+
+# One row per change of price: a price is valid from fetched_at until the next row of the same
+# station and fuel. latest keeps the current price of each station to find the changes quickly.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    ideess TEXT NOT NULL,
+    fuel TEXT NOT NULL,
+    fetched_at INTEGER NOT NULL,
+    price REAL,
+    PRIMARY KEY (ideess, fuel, fetched_at)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS latest (
+    ideess TEXT NOT NULL,
+    fuel TEXT NOT NULL,
+    fetched_at INTEGER NOT NULL,
+    price REAL,
+    PRIMARY KEY (ideess, fuel)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS snapshots (
+    fetched_at INTEGER PRIMARY KEY,
+    stations INTEGER NOT NULL,
+    changes INTEGER NOT NULL
+);
+"""
+
+# Names of the aggregate columns added by price_trends
+STAT_NAMES = {"min": "mínimo", "avg": "media", "delta": "variación"}
+
+
+def open_price_history(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _long_prices(df_min, fuels):
+    # (ideess, fuel, price) of every station and fuel; a missing price is kept as NULL so that a
+    # station that stops selling a fuel is recorded as well
+    ids = df_min["IDEESS"].astype(str).to_numpy()
+    frames = [
+        pd.DataFrame({"ideess": ids, "fuel": fuel, "price": np.round(df_min[fuel].to_numpy(dtype=float), PRICE_DECIMALS)})
+        for fuel in fuels if fuel in df_min.columns
+    ]
+    return pd.concat(frames, ignore_index=True).drop_duplicates(["ideess", "fuel"])
+
+
+def record_snapshot(conn, df_min, fetched_at=None, fuels=PRICE_COLUMNS):
+    # Appends the prices of df_min that changed since the previous snapshot; returns how many changed
+    fetched_at = int(fetched_at if fetched_at is not None else time.time())
+    current = _long_prices(df_min, fuels)
+    latest = pd.read_sql_query("SELECT ideess, fuel, price FROM latest", conn)
+    merged = current.merge(latest, on=["ideess", "fuel"], how="left", suffixes=("", "_latest"), indicator=True)
+    same = (merged["price"] == merged["price_latest"]) | (merged["price"].isna() & merged["price_latest"].isna())
+    changed = merged[(merged["_merge"] == "left_only") | ~same]
+
+    records = [
+        (ideess, fuel, fetched_at, None if np.isnan(price) else float(price))
+        for ideess, fuel, price in zip(changed["ideess"], changed["fuel"], changed["price"])
+    ]
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?)", records)
+        conn.executemany("INSERT OR REPLACE INTO latest VALUES (?, ?, ?, ?)", records)
+        conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)", (fetched_at, len(df_min), len(records)))
+    logging.info(f"📈 {len(records)} price changes added to the history")
+    return len(records)
+
+
+def prune_history(conn, days, now=None):
+    # Deletes the price changes older than days, except the last one of each station and fuel before
+    # them, which is still the price when the window starts; returns how many were deleted. The history
+    # is pruned once a day at most, when its oldest snapshot is more than a day past the window.
+    cutoff = int(now if now is not None else time.time()) - days * SECONDS_PER_DAY
+    oldest = conn.execute("SELECT MIN(fetched_at) FROM snapshots").fetchone()[0]
+    if oldest is None or oldest >= cutoff - SECONDS_PER_DAY:
+        return 0
+    with conn:
+        deleted = conn.execute("""
+            DELETE FROM prices WHERE fetched_at < :cutoff AND fetched_at < (
+                SELECT MAX(q.fetched_at) FROM prices q
+                WHERE q.ideess = prices.ideess AND q.fuel = prices.fuel AND q.fetched_at < :cutoff
+            )
+        """, {"cutoff": cutoff}).rowcount
+        conn.execute("DELETE FROM snapshots WHERE fetched_at < ?", (cutoff,))
+    logging.info(f"🧹 {deleted} price changes older than {days} days removed from the history")
+    return deleted
+
+
+def price_window(conn, ids, days, now=None, fuels=PRICE_COLUMNS):
+    # Price changes of the stations ids in the last days, plus the price each one had when the window started
+    now = int(now if now is not None else time.time())
+    start = now - days * SECONDS_PER_DAY
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (ideess TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM wanted")
+    conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((str(i),) for i in ids))
+    # CROSS JOIN keeps wanted as the outer loop, so every lookup is a range of the primary key instead
+    # of a scan of the whole history
+    query = """
+        SELECT p.ideess, p.fuel, p.fetched_at, p.price
+        FROM wanted w CROSS JOIN prices p
+        WHERE p.ideess = w.ideess AND p.fuel = ? AND p.fetched_at >= ?
+        UNION ALL
+        SELECT p.ideess, p.fuel, p.fetched_at, p.price
+        FROM wanted w CROSS JOIN prices p
+        WHERE p.ideess = w.ideess AND p.fuel = ? AND p.fetched_at = (
+            SELECT MAX(q.fetched_at) FROM prices q WHERE q.ideess = w.ideess AND q.fuel = p.fuel AND q.fetched_at < ?
+        )
+    """
+    rows = pd.concat(
+        [pd.read_sql_query(query, conn, params=[fuel, start, fuel, start]) for fuel in fuels], ignore_index=True
+    )
+    return rows.sort_values(["ideess", "fuel", "fetched_at"], ignore_index=True), start, now
+
+
+def price_stats(conn, ids, days, now=None, fuels=PRICE_COLUMNS):
+    # Minimum, time-weighted average and change of the price of each station and fuel over the last days.
+    # Returns a DataFrame indexed by (ideess, fuel) with the columns min, avg and delta.
+    rows, start, now = price_window(conn, ids, days, now, fuels)
+    if rows.empty:
+        return pd.DataFrame(columns=["min", "avg", "delta"], index=pd.MultiIndex.from_tuples([], names=["ideess", "fuel"]))
+
+    group = rows.groupby(["ideess", "fuel"], sort=False)
+    # Each price holds from its change (or the window start) until the next change (or now)
+    valid_from = rows["fetched_at"].clip(lower=start)
+    valid_until = group["fetched_at"].shift(-1).fillna(now).clip(lower=start)
+    rows["weight"] = (valid_until - valid_from).where(rows["price"].notna(), 0)
+    rows["weighted"] = rows["price"].fillna(0) * rows["weight"]
+
+    sums = rows.groupby(["ideess", "fuel"], sort=False)[["weighted", "weight"]].sum()
+    prices = rows.dropna(subset=["price"]).groupby(["ideess", "fuel"], sort=False)["price"]
+    stats = pd.DataFrame({
+        "min": prices.min(),
+        "avg": (sums["weighted"] / sums["weight"].replace(0, np.nan)).round(PRICE_DECIMALS),
+        "delta": (prices.last() - prices.first()).round(PRICE_DECIMALS)
+    })
+    return stats
+
+
+def price_trends(conn, df_cc, days, now=None, fuels=PRICE_COLUMNS):
+    # Aggregates of price_stats for the Ministry station matched to each Red Fleet station, as columns
+    # named "<fuel> <stat> <days>d" aligned with df_cc
+    columns = {}
+    found = df_cc["IDEESS"].notna()
+    ids = df_cc.loc[found, "IDEESS"].astype(str)
+    stats = price_stats(conn, ids.unique(), days, now, fuels)
+    for fuel in fuels:
+        by_id = stats.xs(fuel, level="fuel") if fuel in stats.index.get_level_values("fuel") else pd.DataFrame(columns=STAT_NAMES)
+        for stat, name in STAT_NAMES.items():
+            values = pd.Series(np.nan, index=df_cc.index)
+            values[found] = by_id[stat].reindex(ids).to_numpy(dtype=float)
+            columns[f"{fuel} {name} {days}d"] = values
+    return pd.DataFrame(columns, index=df_cc.index)
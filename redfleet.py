@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from cli_common import (
+    setup_logging, add_log_console_argument, add_retrieve_arguments, add_browser_arguments,
+    DEFAULT_STATIONS_PRICE_FILE, DEFAULT_STATIONS_METRICS_FILE
+)
+from upload_targets import (
+    load_upload_config, add_upload_arguments, missing_upload_settings, print_upload_plan, upload_status, file_payload,
+    UPLOAD_PLAN_LABELS
+)
+
+# Single entry point of the pipeline. Each command imports what it needs when it runs: pandas, geopy and
+# requests for retrieve and run, Playwright for upload and run, so status and upload --dry-run start
+# without any of them.
+
+# Values of the last metrics of each job shown by status: (stage, key, label)
+STATUS_FIELDS = {
+    "retrieve_stations": [("match", "rows_out", "stations matched"), ("export", "changed_rows", "changed")],
+    "update_mymaps": [("upload", "uploads", "uploads"), ("upload", "bytes_uploaded", "bytes uploaded")],
+}
+
+
+def retrieve(args):
+    from retrieve_stations import load_config, retrieve_once
+    try:
+        config = load_config()
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    setup_logging(config["LOG_FILE"], config["LOG_LEVEL"], args.log_console)
+    return 0 if retrieve_once(config, args) is not None else 1
+
+
+def upload(args):
+    config = load_upload_config()
+    if args.file:
+        config["STATIONS_FILE"] = args.file
+    if args.dry_run:
+        try:
+            return 1 if print_upload_plan(config, args.manifest) else 0
+        except (OSError, ValueError) as e:
+            print(f"❌ Invalid manifest: {e}")
+            return 1
+    missing = missing_upload_settings(config, args.manifest)
+    if missing:
+        print(f"❌ The following variables are missing in the .env file: {', '.join(missing)}")
+        return 1
+    setup_logging(config["LOG_FILE"], config["LOG_LEVEL"], args.log_console)
+    from update_mymaps import upload as update_mymaps
+    return update_mymaps(config, args)
+
+
+def run(args):
+    # Retrieve and then upload in one process: the settings are read and logging is set up once, and the KML
+    # written by the retrieve is uploaded from memory, where it is hashed, uploaded and recorded. It is
+    # uploaded unless it is the one already uploaded, so a file kept because no price changed (read from
+    # disk then) is still uploaded after a failed upload.
+    if args.split_layers:
+        print("❌ run uploads a single KML file; use retrieve --split-layers and upload --manifest for the layer files")
+        return 1
+    from retrieve_stations import load_config, retrieve_once
+    try:
+        config = load_config()
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    upload_config = dict(load_upload_config(), STATIONS_FILE=config["STATIONS_FILE"])
+    missing = missing_upload_settings(upload_config)
+    if missing:
+        print(f"❌ The following variables are missing in the .env file: {', '.join(missing)}")
+        return 1
+    setup_logging(config["LOG_FILE"], config["LOG_LEVEL"], args.log_console)
+
+    warm = {}
+    if retrieve_once(config, args, warm) is None:
+        return 1
+    stations_file = config["STATIONS_FILE"]
+    from update_mymaps import upload as update_mymaps
+    return update_mymaps(upload_config, args, {stations_file: file_payload(stations_file, warm["kml"])})
+
+
+def _metrics_summary(metrics_file):
+    # One line with the time, duration and main figures of the last run of a job, from its metrics file
+    try:
+        with open(metrics_file, "r", encoding="utf-8") as f:
+            metrics = json.load(f)
+    except (OSError, ValueError):
+        return "no runs yet"
+    figures = [
+        f"{metrics['stages'][stage][key]} {label}"
+        for stage, key, label in STATUS_FIELDS.get(metrics.get("job"), [])
+        if key in metrics.get("stages", {}).get(stage, {})
+    ]
+    failed = sum(step.get("status") != "ok" for step in metrics.get("trace", []))
+    if failed:
+        figures.append(f"{failed} failed steps")
+    failed_stages = [stage for stage, record in metrics.get("stages", {}).items() if record.get("failed")]
+    if failed_stages:
+        figures.append(f"failed in {', '.join(failed_stages)}")
+    return ", ".join([f"{metrics.get('started_at')}", f"{metrics.get('wall_seconds', 0):.1f}s"] + figures)
+
+
+def status(args):
+    stations_file = os.getenv("STATIONS_PRICE_FILE", DEFAULT_STATIONS_PRICE_FILE)
+    upload_config = load_upload_config()
+    if os.path.exists(stations_file):
+        modified = datetime.fromtimestamp(os.path.getmtime(stations_file)).isoformat(timespec="seconds")
+        print(f"🗺️ Stations file  {stations_file} ({os.path.getsize(stations_file)} bytes, written {modified})")
+    else:
+        print(f"🗺️ Stations file  {stations_file} (not written yet)")
+    icon, action = UPLOAD_PLAN_LABELS[upload_status(stations_file)]
+    print(f"{icon} My Maps        {action} ({upload_config['MAP_URL'] or 'no MAP_URL'})")
+    print(f"📥 Last retrieve  {_metrics_summary(os.getenv('METRICS_STATIONS_FILE', DEFAULT_STATIONS_METRICS_FILE))}")
+    print(f"📤 Last upload    {_metrics_summary(upload_config['METRICS_FILE'])}")
+    return 0
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    add_log_console_argument(common)
+
+    parser = argparse.ArgumentParser(
+        description="Retrieve the prices of the Red Fleet stations and keep Google My Maps up to date",
+        allow_abbrev=False
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("retrieve", parents=[common], allow_abbrev=False,
+                                  help="Download the prices, match the stations and write the KML, CSV and GPX files")
+    add_retrieve_arguments(command)
+    command.set_defaults(handler=retrieve)
+
+    command = commands.add_parser("upload", parents=[common], allow_abbrev=False,
+                                  help="Import the KML file, or the targets of a manifest, into Google My Maps")
+    add_browser_arguments(command)
+    add_upload_arguments(command)
+    command.set_defaults(handler=upload)
+
+    command = commands.add_parser("run", parents=[common], allow_abbrev=False,
+                                  help="Retrieve and then upload the KML file in one process, unless it is already uploaded")
+    add_retrieve_arguments(command)
+    add_browser_arguments(command)
+    command.set_defaults(handler=run, manifest=None, skip_unchanged=True)
+
+    command = commands.add_parser("status", allow_abbrev=False,
+                                  help="Show the stations file, whether it is uploaded and the last runs, without importing pandas or Playwright")
+    command.set_defaults(handler=status)
+    return parser
+
+
+if __name__ == "__main__":
+
+    load_dotenv('.env', override=True)
+    args = build_parser().parse_args()
+    exit(args.handler(args))
@@ -1,35 +1,80 @@
 import logging
-from logging.handlers import RotatingFileHandler
+import numpy as np
 import pandas as pd
 import requests
 import json
-from geopy.distance import geodesic
-import unicodedata
-from xml.sax.saxutils import escape
+import io
+import hashlib
+import pickle
 import os
-from datetime import datetime
 import argparse
 from dotenv import load_dotenv
-
-DEFAULT_LOG_LEVEL = "INFO"
+try:
+    import orjson
+except ImportError:  # Optional, the standard json module is used without it
+    orjson = None
+from cli_common import (
+    setup_logging, add_log_console_argument, add_retrieve_arguments,
+    DEFAULT_LOG_LEVEL, DEFAULT_STATIONS_PRICE_FILE, DEFAULT_STATIONS_METRICS_FILE as DEFAULT_METRICS_FILE
+)
+from http_cache import create_session, fetch_cached, fetch_concurrently, cache_file, bytes_received
+from metrics import Metrics
+from station_writers import write_kml, write_kml_layers, write_gpx
+from station_matching import build_station_index, match_nearest_stations, match_columns, PRICE_COLUMNS
+from station_projection import parse_fuels, parse_networks, select_networks
+from station_names import normalize_names, province_ids, MUNICIPALITY_ALIASES, PROVINCE_ALIASES, PROVINCE_IDS
+from station_state import load_state, save_state, price_changes, DEFAULT_STATIONS_STATE_FILE
+from match_cache import (
+    open_match_cache, clear_match_cache, cached_matches, store_matches, match_mode, default_match_cache_file
+)
+from price_history import (
+    open_price_history, record_snapshot, prune_history, price_trends, DEFAULT_PRICE_HISTORY_FILE, DEFAULT_PRICE_HISTORY_DAYS
+)
 
 DEFAULT_LOG_FILE="stations.log"
 
-DEFAULT_STATIONS_PRICE_FILE="gasolineras_red_fleet_precio.kml"
-
 DEFAULT_CIRCULO_CONDUCTORES_CSV_FILENAME = "gasolineras_circulo_conductores.csv"
 DEFAULT_CIRCULO_CONDUCTORES_SHEET_URL = "https://docs.google.com/spreadsheets/d/1N1GeJAJjegM58kpIU-R6JtXkOXI5mM7t/edit?gid=834431412"
 
 DEFAULT_MINISTRY_PRICE_URL= "https://sedeaplicaciones.minetur.gob.es/ServiciosRESTCarburantes/PreciosCarburantes/EstacionesTerrestres/"
 
-def get_circulo_conductores_dataframe(cc_csv_filename, sheet_url):
-    if not os.path.exists(cc_csv_filename):
+DEFAULT_MINISTRY_CACHE_DIR = "ministry_cache"
+# Seconds during which the cached Ministry data is used without asking the server
+DEFAULT_MINISTRY_CACHE_TTL = 300
+
+# Seconds to wait for each remote source
+DEFAULT_CIRCULO_CONDUCTORES_TIMEOUT = 30
+DEFAULT_MINISTRY_TIMEOUT = 60
+
+# Share of the provinces above which --province-fetch downloads the national feed instead
+DEFAULT_MINISTRY_PROVINCE_SHARE = 0.5
+# Province feeds downloaded at the same time, within the connection pool of the session
+MINISTRY_PROVINCE_WORKERS = 8
+
+MINISTRY_HEADERS = {
+    "Accept": "application/json"
+}
+
+# Columns of the Ministry feed kept by the compact loader, besides the prices
+MINISTRY_CATEGORY_COLUMNS = ["Rótulo", "Municipio", "Provincia"]
+MINISTRY_COORDINATE_COLUMNS = ["Latitud", "Longitud (WGS84)"]
 
-        # Convert to CSV export URL
-        csv_url = sheet_url.replace("/edit?gid=", "/export?format=csv&gid=")
+def circulo_conductores_csv_url(sheet_url):
+    # Convert to CSV export URL
+    return sheet_url.replace("/edit?gid=", "/export?format=csv&gid=")
 
-        # Read the content as DataFrame
-        df_cc = pd.read_csv(csv_url)
+def fetch_circulo_conductores_payload(sheet_url, session=None, timeout=DEFAULT_CIRCULO_CONDUCTORES_TIMEOUT):
+    response = (session or create_session()).get(circulo_conductores_csv_url(sheet_url), timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+def get_circulo_conductores_dataframe(cc_csv_filename, sheet_url, payload=None):
+    if not os.path.exists(cc_csv_filename):
+
+        # Read the content as DataFrame (the payload may have been downloaded already)
+        if payload is None:
+            payload = fetch_circulo_conductores_payload(sheet_url)
+        df_cc = pd.read_csv(io.BytesIO(payload))
 
         # Set row 3 as column names
         df_cc.columns = df_cc.iloc[3]
@@ -57,18 +102,61 @@ def get_circulo_conductores_dataframe(cc_csv_filename, sheet_url):
 
 # Coger los datos del Ministerio
 PRICE_URL = "https://sedeaplicaciones.minetur.gob.es/ServiciosRESTCarburantes/PreciosCarburantes/EstacionesTerrestres/"
-def get_ministry_dataframe(price_url):
-
-    headers = {
-        "Accept": "application/json"
-    }
-
-    response = requests.get(price_url, headers=headers)
-    if response.status_code != 200:
-        logging.error(f"Error fetching data from Ministerio. Status code: {response.status_code}")
-        exit(1)
+def fetch_ministry_payload(price_url, cache_dir=None, cache_ttl=DEFAULT_MINISTRY_CACHE_TTL, session=None, timeout=DEFAULT_MINISTRY_TIMEOUT):
+    # Returns (payload, changed); changed is False when the cached payload is still valid
+    if cache_dir:
+        return fetch_cached(price_url, cache_dir, ttl=cache_ttl, headers=MINISTRY_HEADERS, session=session, timeout=timeout)
+
+    response = (session or create_session()).get(price_url, headers=MINISTRY_HEADERS, timeout=timeout)
+    response.raise_for_status()
+    return response.content, True
+
+def ministry_province_url(price_url, province_id):
+    return f"{price_url.rstrip('/')}/FiltroProvincia/{province_id}"
+
+def merge_ministry_payloads(payloads):
+    # One payload with the stations of several province feeds, in the format of the national feed
+    documents = [orjson.loads(p.removeprefix(b"\xef\xbb\xbf")) if orjson else json.loads(p.decode("utf-8-sig")) for p in payloads]
+    merged = {key: value for key, value in documents[0].items() if key != "ListaEESSPrecio"}
+    merged["ListaEESSPrecio"] = [station for document in documents for station in document["ListaEESSPrecio"]]
+    return orjson.dumps(merged) if orjson else json.dumps(merged, ensure_ascii=False).encode("utf-8")
+
+def get_ministry_dataframe(price_url, cache_dir=None, cache_ttl=DEFAULT_MINISTRY_CACHE_TTL, fetched=None, compact=True,
+                           fuels=PRICE_COLUMNS):
+    # fetched is the (payload, changed) result of fetch_ministry_payload if it was downloaded already.
+    # compact=False keeps every column of the feed (see parse_ministry_payload_compact), compact keeps
+    # the prices of fuels only.
+    if fetched is None:
+        try:
+            fetched = fetch_ministry_payload(price_url, cache_dir, cache_ttl)
+        except requests.RequestException as e:
+            logging.error(f"Error fetching data from Ministerio: {e}")
+            exit(1)
+    payload = fetched[0]
+
+    parse = (lambda p: parse_ministry_payload_compact(p, fuels)) if compact else parse_ministry_payload
+    if not cache_dir:
+        return parse(payload)
+
+    # The parsed DataFrame is stored with the sha256 of the payload it comes from, and reused only for that
+    # same payload and when it has every fuel asked for, so a run that updated the raw cache but did not
+    # get to write the parsed one never leaves old prices behind
+    parsed_file = cache_file(cache_dir, price_url, ".compact.pkl" if compact else ".pkl")
+    digest = hashlib.sha256(payload).hexdigest()
+    if os.path.exists(parsed_file):
+        try:
+            parsed_digest, df_min = pd.read_pickle(parsed_file)
+            if parsed_digest == digest and all(fuel in df_min.columns for fuel in fuels):
+                return df_min
+        except (OSError, ValueError, TypeError, pickle.UnpicklingError, EOFError):
+            logging.warning(f"⚠️ Ignoring unreadable parsed cache {parsed_file}")
+    df_min = parse(payload)
+    pd.to_pickle((digest, df_min), parsed_file + ".tmp")
+    os.replace(parsed_file + ".tmp", parsed_file)
+    return df_min
 
-    data = response.json()
+def parse_ministry_payload(payload):
+    data = json.loads(payload.decode("utf-8-sig") if isinstance(payload, bytes) else payload)
     stations = data["ListaEESSPrecio"]
     df_min = pd.DataFrame(stations)
 
@@ -78,266 +166,340 @@ def get_ministry_dataframe(price_url):
         df_min[col] = pd.to_numeric(df_min[col], errors="coerce")
     return df_min
 
+def _decimal_comma_array(values, dtype):
+    # "1,459" -> 1.459 and "" -> NaN, parsed by NumPy in one pass; pandas only handles malformed values
+    text = [v.replace(",", ".") if v else "nan" for v in values]
+    try:
+        return np.array(text, dtype=dtype)
+    except ValueError:
+        return pd.to_numeric(pd.Series(text), errors="coerce").to_numpy(dtype=dtype)
+
+def parse_ministry_payload_compact(payload, price_columns=PRICE_COLUMNS):
+    # Typed version of parse_ministry_payload that keeps only the columns the pipeline uses: the prices
+    # as float32, brand, municipality and province as categoricals, and the IDEESS. The coordinates stay
+    # float64: float32 would move the stations up to half a meter, changing the matched distances and
+    # invalidating the match cache.
+    if isinstance(payload, bytes) and payload.startswith(b"\xef\xbb\xbf"):
+        payload = payload[3:]
+    data = orjson.loads(payload) if orjson else json.loads(payload)
+    stations = data["ListaEESSPrecio"]
+
+    columns = {"IDEESS": [station.get("IDEESS") for station in stations]}
+    for col in MINISTRY_CATEGORY_COLUMNS:
+        columns[col] = pd.Categorical([station.get(col) for station in stations])
+    for col in MINISTRY_COORDINATE_COLUMNS:
+        columns[col] = _decimal_comma_array([station.get(col) for station in stations], np.float64)
+    for col in price_columns:
+        columns[col] = _decimal_comma_array([station.get(col) for station in stations], np.float32)
+    return pd.DataFrame(columns)
+
 def normalize_dfs(df_cc, df_min):
     # Change the column names "Municipio" and "Provincia" to uppercase in df_estaciones
     df_cc.rename(columns={"Municipio": "MUNICIPIO", "Provincia": "PROVINCIA"}, inplace=True)
     df_min.rename(columns={"Municipio": "MUNICIPIO", "Provincia": "PROVINCIA"}, inplace=True)
 
-    # Convert MUNICIPIO and PROVINCIA to uppercase
-    df_cc["MUNICIPIO"] = df_cc["MUNICIPIO"].str.upper()
-    df_cc["PROVINCIA"] = df_cc["PROVINCIA"].str.upper()
-    df_min["MUNICIPIO"] = df_min["MUNICIPIO"].str.upper()
-    df_min["PROVINCIA"] = df_min["PROVINCIA"].str.upper()
-
-    # Normalize province names
-    province_name_replacement = {
-        "ARABA/ÁLAVA": "ALAVA",
-        "BALEARS (ILLES)": "BALEARES",
-        "BIZKAIA": "VIZCAYA",
-        "CASTELLÓN / CASTELLÓ": "CASTELLON",
-        "CORUÑA (A)": "LA CORUÑA",
-        "GIPUZKOA": "GUIPUZCOA",
-        "GIRONA": "GERONA",
-        "LLEIDA": "LERIDA",
-        "OURENSE": "ORENSE",
-        "PALMAS (LAS)": "LAS PALMAS",
-        "RIOJA (LA)": "LA RIOJA",
-        "SANTA CRUDA DE TENERIFE": "TENERIFE",
-        "VALENCIA / VALÈNCIA": "VALENCIA"
-    }
-
-    df_min["PROVINCIA"] = df_min["PROVINCIA"].replace(province_name_replacement)
-
-    def remove_accents(text):
-        if isinstance(text, str):
-            return ''.join(
-                c for c in unicodedata.normalize('NFD', text)
-                if unicodedata.category(c) != 'Mn'
-            )
-        return text
-
-    df_cc["MUNICIPIO"] = df_cc["MUNICIPIO"].apply(remove_accents)
-    df_cc["PROVINCIA"] = df_cc["PROVINCIA"].apply(remove_accents)
-    df_min["MUNICIPIO"] = df_min["MUNICIPIO"].apply(remove_accents)
-    df_min["PROVINCIA"] = df_min["PROVINCIA"].apply(remove_accents)
+    # Upper case without accents, with the spelling variants of both sources mapped to one name. Each
+    # distinct name is normalized once (and remembered between runs), not once per row.
+    for df in (df_cc, df_min):
+        df["MUNICIPIO"] = normalize_names(df["MUNICIPIO"], MUNICIPALITY_ALIASES)
+        df["PROVINCIA"] = normalize_names(df["PROVINCIA"], PROVINCE_ALIASES)
 
     return df_cc, df_min
 
-def price_nearest_station(row, stations_grouped):
-    municipio = row["MUNICIPIO"]
-    provincia = row["PROVINCIA"]
-    coord_origen = (row["Coordenada Y"], row["Coordenada X"])
-
-    # Filter by group
-    if (provincia) not in stations_grouped.groups:
-        return None, None
-
-    stations_filtered = stations_grouped.get_group((provincia))
+def create_kml(df, filename="stations.kml", compression=None, split_by=None, extra_columns=None, fuels=PRICE_COLUMNS,
+               buffer=None):
+    # Compressed as KMZ when the file name ends in .kmz, or gzip when it ends in .gz.
+    # With split_by ("province" or "price") one extra layer file per group is written next to it.
+    # extra_columns of df, such as the price trends, are added to the ExtendedData of each placemark.
+    # With buffer (an io.BytesIO) the bytes of the main file are kept there as well.
+    write_kml(df, filename, compression=compression, extra_columns=extra_columns, fuels=fuels, buffer=buffer)
+    files = [filename]
+    if split_by:
+        files += write_kml_layers(df, filename, split_by, compression=compression, extra_columns=extra_columns, fuels=fuels)
+    return files
+
+
+def create_gpx(df, filename="stations.gpx", compression=None, fuels=PRICE_COLUMNS):
+    write_gpx(df, filename, compression=compression, fuels=fuels)
+
+def _setting(name, default, convert):
+    # Environment variable converted by convert; a value that cannot be converted is reported by name
+    try:
+        return convert(os.getenv(name, default))
+    except ValueError as e:
+        raise ValueError(f"Invalid {name}: {e}") from e
+
+def load_config():
+    # Settings of the retrieval, from the environment (and .env) with their defaults. An invalid value is
+    # raised as ValueError with the name of its variable, for the scripts to report before starting.
+    circulo_conductores_csv_filename = os.getenv("CIRCULO_CONDUCTORES_CSV_FILENAME", DEFAULT_CIRCULO_CONDUCTORES_CSV_FILENAME)
+    return {
+        "CIRCULO_CONDUCTORES_CSV_FILENAME": circulo_conductores_csv_filename,
+        "CIRCULO_CONDUCTORES_SHEET_URL": os.getenv("CIRCULO_CONDUCTORES_SHEET_URL", DEFAULT_CIRCULO_CONDUCTORES_SHEET_URL),
+        "PRICE_URL": os.getenv("MINISTRY_PRICE_URL", DEFAULT_MINISTRY_PRICE_URL),
+        "MINISTRY_CACHE_DIR": os.getenv("MINISTRY_CACHE_DIR", DEFAULT_MINISTRY_CACHE_DIR),
+        "MINISTRY_CACHE_TTL": _setting("MINISTRY_CACHE_TTL", DEFAULT_MINISTRY_CACHE_TTL, int),
+        "CIRCULO_CONDUCTORES_TIMEOUT": _setting("CIRCULO_CONDUCTORES_TIMEOUT", DEFAULT_CIRCULO_CONDUCTORES_TIMEOUT, float),
+        "MINISTRY_TIMEOUT": _setting("MINISTRY_TIMEOUT", DEFAULT_MINISTRY_TIMEOUT, float),
+        "LOG_FILE": os.getenv("LOG_STATIONS_FILE", DEFAULT_LOG_FILE),
+        "STATIONS_FILE": os.getenv("STATIONS_PRICE_FILE", DEFAULT_STATIONS_PRICE_FILE),
+        "STATIONS_STATE_FILE": os.getenv("STATIONS_STATE_FILE", DEFAULT_STATIONS_STATE_FILE),
+        "MATCH_CACHE_FILE": os.getenv("MATCH_CACHE_FILE", default_match_cache_file(circulo_conductores_csv_filename)),
+        "PRICE_HISTORY_FILE": os.getenv("PRICE_HISTORY_FILE", DEFAULT_PRICE_HISTORY_FILE),
+        "PRICE_HISTORY_DAYS": _setting("PRICE_HISTORY_DAYS", DEFAULT_PRICE_HISTORY_DAYS, int),
+        "METRICS_FILE": os.getenv("METRICS_STATIONS_FILE", DEFAULT_METRICS_FILE),
+        "MINISTRY_PROVINCE_SHARE": _setting("MINISTRY_PROVINCE_SHARE", DEFAULT_MINISTRY_PROVINCE_SHARE, float),
+        "PROMETHEUS_TEXTFILE_DIR": os.getenv("PROMETHEUS_TEXTFILE_DIR"),
+        "FUEL_COLUMNS": _setting("FUEL_COLUMNS", None, parse_fuels),
+        "STATION_NETWORKS": _setting("STATION_NETWORKS", None, parse_networks),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", DEFAULT_LOG_LEVEL).upper()
+    }
 
-    # Calculate distances
-    stations_filtered["distancia"] = stations_filtered.apply(
-        lambda x: geodesic(coord_origen, (x["Latitud"], x["Longitud (WGS84)"])).kilometers, axis=1
+def ministry_urls(config, df_cc=None):
+    # Ministry feeds to download: the national one, or with the Red Fleet stations df_cc the feed of each of
+    # their provinces, unless they are more than MINISTRY_PROVINCE_SHARE of the country or some province
+    # has no known code
+    national = [config["PRICE_URL"]]
+    if df_cc is None:
+        return national
+    ids, unknown = province_ids(df_cc["Provincia" if "Provincia" in df_cc.columns else "PROVINCIA"])
+    if unknown:
+        logging.warning(f"⚠️ Unknown provinces {', '.join(unknown)}, downloading the national feed")
+        return national
+    if not ids or len(ids) > config["MINISTRY_PROVINCE_SHARE"] * len(PROVINCE_IDS):
+        logging.info(f"📥 Red Fleet stations in {len(ids)} provinces, downloading the national feed")
+        return national
+    logging.info(f"📥 Red Fleet stations in {len(ids)} provinces, downloading their feeds")
+    return [ministry_province_url(config["PRICE_URL"], province_id) for province_id in ids]
+
+def fetch_ministry(config, session=None, urls=None):
+    # Returns (payload, changed) of the feeds of ministry_urls (by default the national one), merged in one
+    # payload; changed is True when any of them changed
+    urls = urls or [config["PRICE_URL"]]
+    def fetch(url):
+        return fetch_ministry_payload(url, config["MINISTRY_CACHE_DIR"], config["MINISTRY_CACHE_TTL"], session, config["MINISTRY_TIMEOUT"])
+    if len(urls) == 1:
+        return fetch(urls[0])
+    results = fetch_concurrently({url: (lambda url=url: fetch(url)) for url in urls}, MINISTRY_PROVINCE_WORKERS)
+    return merge_ministry_payloads([payload for payload, _ in results.values()]), any(changed for _, changed in results.values())
+
+def fetch_sources(config, session, fetch_circulo_conductores=True, ministry=None, urls=None):
+    # Both sources are downloaded at the same time over one pooled session; parsing starts once both arrive.
+    # ministry is the (payload, changed) of a Ministry download of urls already done by the caller.
+    downloads = {"ministry": (lambda: ministry) if ministry is not None else (lambda: fetch_ministry(config, session, urls))}
+    if fetch_circulo_conductores:
+        downloads["circulo_conductores"] = lambda: fetch_circulo_conductores_payload(
+            config["CIRCULO_CONDUCTORES_SHEET_URL"], session, config["CIRCULO_CONDUCTORES_TIMEOUT"]
+        )
+    return fetch_concurrently(downloads)
+
+def load_red_fleet_stations(config, payload=None):
+    df_cc = get_circulo_conductores_dataframe(
+        config["CIRCULO_CONDUCTORES_CSV_FILENAME"], config["CIRCULO_CONDUCTORES_SHEET_URL"], payload
     )
-
-    # Get the price of the nearest station
-    nearest_station = stations_filtered.loc[stations_filtered["distancia"].idxmin()]
-
-    # Remove the used station
-    # global stations_grouped
-    # stations_grouped = stations_grouped.drop(nearest_station.name)
-
-    return nearest_station["Precio Gasolina 95 E5"], nearest_station["Precio Gasoleo A"]
-
-def create_kml(df, filename="stations.kml"):
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    kml_header = '''<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2">
-<Document>
-    <name>Gasolineras</name>
-'''
-    kml_footer = '''</Document>
-</kml>
-'''
-
-    placemarks = []
-    for _, row in df.iterrows():
-        try:
-            lon = float(row["Coordenada X"])
-            lat = float(row["Coordenada Y"])
-        except (ValueError, TypeError):
-            continue  # Saltar si no hay coordenadas válidas
-
-        gasolina_95 = row.get("Precio Gasolina 95 E5", "")
-        gasoleo_a = row.get("Precio Gasoleo A", "")
-        provincia = escape(str(row.get("PROVINCIA", "")))
-        municipio = escape(str(row.get("MUNICIPIO", "")))
-        centro = escape(str(row.get("CENTRO", "")))
-        direccion = escape(str(row.get("DIRECCIÓN", "")))
-        concesion = escape(str(row.get("CONCESIÓN", ""))) 
-
-#         description = f""" Gasolina 95: {gasolina_95}<br/>
-# Gasóleo A: {gasoleo_a}<br/>
-# Provincia: {provincia}<br/>
-# Municipio: {municipio}<br/>
-# Centro: {centro}<br/>
-# Dirección: {direccion}<br/>
-# Fecha: {now}"""
-        # Use a detailed description instead of leaving it empty, as an empty description is not desirable
-        description = f"""Concesión {concesion}"""
-
-# TODO: Add a styleUrl if needed
-# <styleUrl>#miEstilo</styleUrl> <!-- Opcional -->
-
-        placemark = f"""
-    <Placemark>
-        <name>{centro}</name>
-        <description><![CDATA[{description}]]></description>
-        <ExtendedData>
-            <Data name="Gasolina 95 E5">
-                <value>{gasolina_95} €</value>
-            </Data>
-            <Data name="Gasóleo A">
-                <value>{gasoleo_a} €</value>
-            </Data>
-            <Data name="Dirección">
-                <value>{direccion}</value>
-            </Data>
-            <Data name="Municipio">
-                <value>{municipio}</value>
-            </Data>
-            <Data name="Provincia">
-                <value>{provincia}</value>
-            </Data>
-            <Data name="Fecha">
-                <value>{now}</value>
-            </Data>
-        </ExtendedData>
-        <Point>
-            <coordinates>{lon},{lat},0</coordinates>
-        </Point>
-    </Placemark>
-"""
-        placemarks.append(placemark)
-
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(kml_header)
-        for pm in placemarks:
-            f.write(pm)
-        f.write(kml_footer)
-  
-
-
-def create_gpx(df, filename="stations.gpx"):
-    gpx_header = '''<?xml version="1.0" encoding="UTF-8"?>
-<gpx version="1.1" creator="Gasolineras" xmlns="http://www.topografix.com/GPX/1/1">
-'''
-    gpx_footer = '''</gpx>
-'''
-
-    now = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-
-    waypoints = []
-    for _, row in df.iterrows():
+    # Keep the stations of any of the networks, by default those whose "Red Fleet" column is not "No"
+    return df_cc, select_networks(df_cc, config["STATION_NETWORKS"])
+
+def retrieve_stations(config, args, metrics, session=None, warm=None, ministry=None):
+    # One run of fetch, parse, match and export; returns the KML files written, empty when no price changed.
+    # warm is a dict kept by the caller between runs (see scheduler.py): it holds the Red Fleet stations,
+    # the spatial index and, if the caller opened them, the match cache and the price history, so later
+    # runs only download and parse the Ministry feed. ministry is the (payload, changed) of a Ministry
+    # download of ministry_urls already done.
+    # Download errors are raised as requests.RequestException.
+    warm = {} if warm is None else warm
+    fuels = config["FUEL_COLUMNS"]
+    own_session = session is None
+    df_all = None
+    with metrics.stage("fetch") as stage:
+        logging.info("📥 Retrieving Circulo Conductores and Ministry gas station data")
+        session = session or create_session()
         try:
-            lon = float(row["Coordenada X"])
-            lat = float(row["Coordenada Y"])
-        except (ValueError, TypeError):
-            continue
-
-        gasolina_95 = row.get("Precio Gasolina 95 E5", "")
-        gasoleo_a = row.get("Precio Gasoleo A", "")
-        provincia = escape(str(row.get("PROVINCIA", "")))
-        municipio = escape(str(row.get("MUNICIPIO", "")))
-        centro = escape(str(row.get("CENTRO", "")))
-        direccion = escape(str(row.get("DIRECCIÓN", "")))
-
-        description = f"""Gasolina 95: {gasolina_95}
-Gasoleo A: {gasoleo_a}
-Provincia: {provincia}
-Municipio: {municipio}
-Centro: {centro}
-Direccion: {direccion}"""
-
-        waypoint = f"""
-  <wpt lat="{lat}" lon="{lon}">
-    <name>{centro}</name>
-    <desc>{description}</desc>
-    <time>{now}</time>
-  </wpt>
-"""
-        waypoints.append(waypoint)
-
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(gpx_header)
-        for wp in waypoints:
-            f.write(wp)
-        f.write(gpx_footer)
+            need_circulo = "df_cc" not in warm and not os.path.exists(config["CIRCULO_CONDUCTORES_CSV_FILENAME"])
+            circulo_payload = None
+            if args.province_fetch and "df_cc" not in warm:
+                # The provinces to download come from the Red Fleet stations, so these are read first
+                if need_circulo:
+                    circulo_payload = fetch_circulo_conductores_payload(
+                        config["CIRCULO_CONDUCTORES_SHEET_URL"], session, config["CIRCULO_CONDUCTORES_TIMEOUT"]
+                    )
+                df_all, warm["df_cc"] = load_red_fleet_stations(config, circulo_payload)
+                need_circulo = False
+            urls = ministry_urls(config, warm["df_cc"]) if args.province_fetch else ministry_urls(config)
+            payloads = fetch_sources(config, session, need_circulo, ministry, urls)
+        finally:
+            if own_session:
+                session.close()
+        ministry_payload, ministry_changed = payloads["ministry"]
+        # Only the feeds of some provinces were downloaded
+        partial_feed = urls != ministry_urls(config)
+        circulo_payload = payloads.get("circulo_conductores", circulo_payload)
+        stage["ministry_feeds"] = len(urls)
+        # As transferred, compressed: nothing for a cached feed or a 304. A session of the caller counts from
+        # its last reset, which includes the Ministry download it passed.
+        stage["bytes_downloaded"] = bytes_received(session)
+
+    with metrics.stage("parse") as stage:
+        if "df_cc" not in warm:
+            logging.info("📥 Processing Circulo Conductores gas station data")
+            df_all, warm["df_cc"] = load_red_fleet_stations(config, circulo_payload)
+        if df_all is not None:
+            stage["circulo_conductores_rows"] = len(df_all)
+        df_cc = warm["df_cc"].copy()
+        stage["red_fleet_rows"] = len(df_cc)
+
+        logging.info("📥 Processing Ministry gas station data")
+        # The parsed DataFrame is cached by the set of feeds it comes from
+        df_min = get_ministry_dataframe(
+            " ".join(urls), config["MINISTRY_CACHE_DIR"], config["MINISTRY_CACHE_TTL"], payloads["ministry"], fuels=fuels
+        )
+        stage["ministry_rows"] = len(df_min)
+
+        df_cc, df_min = normalize_dfs(df_cc, df_min)
+
+    with metrics.stage("match") as stage:
+        # Spatial index over the Ministry stations, shared by every spatial query of this run and, while
+        # no station moves, by the next runs as well
+        coordinates = (df_min["Latitud"].to_numpy(), df_min["Longitud (WGS84)"].to_numpy())
+        cached_index = warm.get("ministry_index")
+        if cached_index is not None and all(np.array_equal(a, b, equal_nan=True) for a, b in zip(warm["ministry_coordinates"], coordinates)):
+            ministry_index = cached_index
+        else:
+            ministry_index = build_station_index(df_min)
+            warm["ministry_index"], warm["ministry_coordinates"] = ministry_index, coordinates
+
+        # A match cache opened by the caller stays open for the next runs
+        match_cache = warm.get("match_cache") or open_match_cache(config["MATCH_CACHE_FILE"])
+        if args.rebuild_matches:
+            clear_match_cache(match_cache)
+
+        by_province = args.match_by_province
+        if partial_feed and not by_province:
+            # Across province borders the nearest station may be in a province that was not downloaded
+            logging.warning("⚠️ Only the Ministry feeds of some provinces were downloaded, matching within each province")
+            by_province = True
+
+        logging.info("🔎 Matching gas station locations")
+        # Stations whose match is still valid and was found by the same search take the fresh prices of
+        # their Ministry station by IDEESS. The matches of a partial feed are stored as by-province ones,
+        # so a later national run across borders matches those stations again.
+        mode = match_mode(by_province, args.exact_matching)
+        matches, pending = cached_matches(match_cache, df_cc, df_min, fuels, mode)
+        logging.info(f"🔎 Reusing {int((~pending).sum())} cached matches")
+        if pending.any():
+            # Prices, IDEESS and distance of the nearest Ministry station
+            matches.loc[pending] = match_nearest_stations(
+                df_cc[pending], df_min, exact=args.exact_matching, index=ministry_index, by_province=by_province,
+                fuels=fuels, workers=args.workers
+            )
+        df_cc[match_columns(fuels)] = matches
+        store_matches(match_cache, df_cc, df_min, partial=partial_feed, mode=mode)
+        if match_cache is not warm.get("match_cache"):
+            match_cache.close()
+
+        stage["rows_in"] = len(df_cc)
+        stage["rows_out"] = int(df_cc["IDEESS"].notna().sum())
+        stage["cached_matches"] = int((~pending).sum())
+        stage["hit_rate"] = round(stage["rows_out"] / len(df_cc), 4) if len(df_cc) else 0.0
+
+    trend_columns = None
+    if args.price_trends and not config["PRICE_HISTORY_FILE"]:
+        logging.warning("⚠️ --price-trends needs PRICE_HISTORY_FILE, the KML is written without trends")
+    if config["PRICE_HISTORY_FILE"]:
+        with metrics.stage("history") as stage:
+            price_history = warm.get("price_history") or open_price_history(config["PRICE_HISTORY_FILE"])
+            # A cached payload has nothing new to add to the history
+            if ministry_changed:
+                stage["price_changes"] = record_snapshot(price_history, df_min, fuels=fuels)
+                if config["PRICE_HISTORY_DAYS"]:
+                    stage["pruned_rows"] = prune_history(price_history, config["PRICE_HISTORY_DAYS"])
+            if args.price_trends:
+                trends = price_trends(price_history, df_cc, args.price_trends, fuels=fuels)
+                df_cc[list(trends.columns)] = trends
+                trend_columns = list(trends.columns)
+            if price_history is not warm.get("price_history"):
+                price_history.close()
+
+    with metrics.stage("export") as stage:
+        stations_file = config["STATIONS_FILE"]
+        state = {} if args.full else load_state(config["STATIONS_STATE_FILE"])
+        changes, removed = price_changes(df_cc, state, fuels)
+        logging.info(f"💶 {len(changes)} new or changed stations, {len(removed)} removed stations")
+        for _, row in changes.iterrows():
+            logging.debug(f"💶 {row.get('CENTRO')}: " + ", ".join(
+                f"{row.get(f'{fuel} anterior')} -> {row.get(fuel)}" for fuel in fuels
+            ))
+        stage["rows_in"] = len(df_cc)
+        stage["changed_rows"] = len(changes)
+        stage["removed_rows"] = len(removed)
+
+        kml_files = []
+        # Bytes of the KML written by this run, for callers that upload it next (see redfleet.py run)
+        warm["kml"] = None
+        if state and changes.empty and not removed and os.path.exists(stations_file):
+            # Keeping the previous files untouched lets update_mymaps.py --skip-unchanged skip the upload
+            logging.info("✅ No price changes since the previous run, keeping the existing files")
+            stage["rows_out"] = 0
+        else:
+            # The KML may also be a .kmz, so the other files are named after the base name
+            stations_base = os.path.splitext(stations_file)[0]
+            df_cc.to_csv(stations_base + ".csv", index=False)
+            changes.to_csv(stations_base + "_changes.csv", index=False)
+
+            logging.info("🗺️ Creating KML and GPX files")
+            kml_buffer = io.BytesIO()
+            kml_files = create_kml(df_cc, stations_file, split_by=args.split_layers, extra_columns=trend_columns, fuels=fuels,
+                                   buffer=kml_buffer)
+            warm["kml"] = kml_buffer.getvalue()
+            logging.debug(f"🗺️ KML files: {', '.join(kml_files)}")
+            create_gpx(df_cc, stations_base + ".gpx", fuels=fuels)
+            stage["rows_out"] = len(df_cc)
+            stage["bytes_written"] = sum(os.path.getsize(f) for f in kml_files)
+
+        save_state(config["STATIONS_STATE_FILE"], df_cc, fuels)
+    # The matched stations and the Ministry prices of this run, for callers that serve them (see station_service.py)
+    warm["export"], warm["ministry"] = df_cc, df_min
+    return kml_files
+
+def retrieve_once(config, args, warm=None):
+    # One run with its metrics written, as run by the command line; returns the KML files written, or None
+    # when a source could not be downloaded. The metrics are written whether the run fails or not, with
+    # the stage that failed marked, so a failing run can be alerted on.
+    metrics = Metrics("retrieve_stations")
+    try:
+        return retrieve_stations(config, args, metrics, warm=warm)
+    except requests.RequestException as e:
+        logging.error(f"Error fetching gas station data: {e}")
+        return None
+    except ValueError as e:
+        # Such as a STATION_NETWORKS column that the Circulo Conductores sheet does not have
+        logging.error(f"❌ {e}")
+        print(f"❌ {e}")
+        return None
+    finally:
+        metrics.write(config["METRICS_FILE"], config["PROMETHEUS_TEXTFILE_DIR"])
 
 if __name__ == "__main__":
 
     load_dotenv('.env', override=True)
-
-    CIRCULO_CONDUCTORES_CSV_FILENAME = os.getenv("CIRCULO_CONDUCTORES_CSV_FILENAME", DEFAULT_CIRCULO_CONDUCTORES_CSV_FILENAME)
-    CIRCULO_CONDUCTORES_SHEET_URL = os.getenv("CIRCULO_CONDUCTORES_SHEET_URL", DEFAULT_CIRCULO_CONDUCTORES_SHEET_URL)
-    PRICE_URL = os.getenv("MINISTRY_PRICE_URL", DEFAULT_MINISTRY_PRICE_URL)
-    LOG_FILE = os.getenv("LOG_STATIONS_FILE", DEFAULT_LOG_FILE)
-    STATIONS_FILE = os.getenv("STATIONS_PRICE_FILE", DEFAULT_STATIONS_PRICE_FILE)
-    LOG_LEVEL = os.getenv("LOG_LEVEL", DEFAULT_LOG_LEVEL).upper()
+    try:
+        config = load_config()
+    except ValueError as e:
+        print(f"❌ {e}")
+        exit(1)
 
     parser = argparse.ArgumentParser(
         description="Downloading prices for Circulo Conductores petrol stations",
         allow_abbrev=False
     )
 
-    parser.add_argument(
-        "--log-console",
-        action="store_true",
-        default=False,
-        help="Enable logging to console (default: False)"
-    )
-
-    args = parser.parse_args()
-
-    # Set up logging to write to a file instead of the console
-    logger = logging.getLogger()
-    # Convert the string to a numeric logging level
-    log_level = getattr(logging, LOG_LEVEL, logging.INFO)
-    logger.setLevel(log_level)
-
-    # Handler para fichero rotativo (100MB, hasta 3 backups)
-    file_handler = RotatingFileHandler(
-        LOG_FILE, maxBytes=100*1024*1024, backupCount=3, encoding='utf-8'
-    )
-    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(message)s'))
-    logger.addHandler(file_handler)
-
-    # Handler para consola solo si --log-console está presente
-    if args.log_console:
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(message)s'))
-        logger.addHandler(console_handler)
+    add_log_console_argument(parser)
 
+    add_retrieve_arguments(parser)
 
-    logging.info("📥 Retrieving and processing Circulo Conductores gas station data")
-    df_cc = get_circulo_conductores_dataframe(CIRCULO_CONDUCTORES_CSV_FILENAME, CIRCULO_CONDUCTORES_SHEET_URL)
-
-    # Remove rows where the "Red Fleet" column is "No"
-    df_cc = df_cc[df_cc["Red Fleet"].str.lower() != "no"]
-    
-    logging.info("📥 Retrieving and processing Ministry gas station data")
-    df_min = get_ministry_dataframe(PRICE_URL)    
-
-    df_cc, df_min = normalize_dfs(df_cc, df_min)
-
-    # Group stations by province
-    stations_grouped = df_min.groupby("PROVINCIA")
-
-    logging.info("🔎 Matching gas station locations")
-    # Apply the function
-    df_cc[["Precio Gasolina 95 E5", "Precio Gasoleo A"]] = df_cc.apply(lambda row: price_nearest_station(row, stations_grouped), axis=1, result_type="expand")
+    args = parser.parse_args()
 
-    df_cc.to_csv(STATIONS_FILE.replace(".kml", ".csv"), index=False)
+    setup_logging(config["LOG_FILE"], config["LOG_LEVEL"], args.log_console)
 
-    logging.info("🗺️ Creating KML and GPX files")
-    create_kml(df_cc, STATIONS_FILE)
-    create_gpx(df_cc, STATIONS_FILE.replace(".kml", ".gpx"))
\ No newline at end of file
+    if retrieve_once(config, args) is None:
+        exit(1)
@@ -0,0 +1,225 @@
+import argparse
+import math
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from spatial_index import StationIndex, EARTH_RADIUS_KM
+from station_projection import parse_fuels, kml_label
+from station_writers import write_kml, write_gpx
+
+# Width of the corridor on each side of the route
+DEFAULT_BUFFER_KM = 5.0
+
+# The route is simplified until no dropped point is further than this from the simplified line, so the
+# distances to the route are off by at most this much
+DEFAULT_TOLERANCE_KM = 0.1
+
+# Columns added to the stations found along the route
+ROUTE_DISTANCE_COLUMN = "Distancia a la ruta (km)"
+ROUTE_POSITION_COLUMN = "Km de ruta"
+
+# Slack added to the prefilter radius for the error of the planar distances
+PREFILTER_MARGIN = 1.01
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def read_gpx_route(path):
+    # (lat, lon) arrays of the track points of a GPX file; route points or waypoints when it has no track
+    points = {"trkpt": [], "rtept": [], "wpt": []}
+    for _, element in ET.iterparse(path):
+        name = _local_name(element.tag)
+        if name in points:
+            points[name].append((float(element.get("lat")), float(element.get("lon"))))
+            element.clear()
+    route = points["trkpt"] or points["rtept"] or points["wpt"]
+    if not route:
+        raise ValueError(f"No track, route or waypoints in {path}")
+    lat, lon = np.array(route, dtype=float).T
+    return lat, lon
+
+
+def decode_polyline(text, precision=5):
+    # (lat, lon) arrays of an encoded polyline, the format of the Google and OSRM route APIs
+    values, value, shift = [], 0, 0
+    for char in text.strip():
+        byte = ord(char) - 63
+        value |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    coordinates = np.cumsum(np.array(values, dtype=float).reshape(-1, 2), axis=0) / 10 ** precision
+    return coordinates[:, 0], coordinates[:, 1]
+
+
+def read_route(path):
+    # GPX files by extension, any other file is read as an encoded polyline
+    if path.lower().endswith(".gpx"):
+        return read_gpx_route(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return decode_polyline(f.read())
+
+
+def _project(lat, lon, lon0):
+    # Sinusoidal projection in km centered on the route, so distances stay close to the real ones
+    # across a whole country and can be measured with plain plane geometry
+    phi = np.radians(lat)
+    return EARTH_RADIUS_KM * np.radians(lon - lon0) * np.cos(phi), EARTH_RADIUS_KM * phi
+
+
+def _segment_distances(px, py, ax, ay, bx, by):
+    # Distance from each point to its segment and the fraction of the segment where it is closest
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    t = np.where(length2 > 0, ((px - ax) * dx + (py - ay) * dy) / np.where(length2 > 0, length2, 1), 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy)), t
+
+
+def simplify_route(x, y, tolerance_km=DEFAULT_TOLERANCE_KM):
+    # Positions of the points kept by Douglas-Peucker over projected coordinates; each step measures a
+    # whole span at once with NumPy
+    n = len(x)
+    if n <= 2:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    spans = [(0, n - 1)]
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2:
+            continue
+        inner = slice(first + 1, last)
+        distances, _ = _segment_distances(x[inner], y[inner], x[first], y[first], x[last], y[last])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_km:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            spans += [(first, middle), (middle, last)]
+    return np.flatnonzero(keep)
+
+
+def corridor_stations(df, route_lat, route_lon, buffer_km=DEFAULT_BUFFER_KM, fuel="Precio Gasoleo A",
+                      tolerance_km=DEFAULT_TOLERANCE_KM, index=None):
+    # Stations of df within buffer_km of the route, ranked by the price of fuel (then by distance to the
+    # route), with their distance to the route and the km of the route where they are closest.
+    # index is a StationIndex over the coordinates of df, built here when not given.
+    route_lat, route_lon = np.asarray(route_lat, dtype=float), np.asarray(route_lon, dtype=float)
+    valid = np.isfinite(route_lat) & np.isfinite(route_lon)
+    route_lat, route_lon = route_lat[valid], route_lon[valid]
+    if len(route_lat) == 0:
+        raise ValueError("The route has no points")
+
+    lon0 = float(np.mean(route_lon))
+    rx, ry = _project(route_lat, route_lon, lon0)
+    kept = simplify_route(rx, ry, tolerance_km)
+    rx, ry, route_lat, route_lon = rx[kept], ry[kept], route_lat[kept], route_lon[kept]
+    if len(kept) == 1:
+        rx, ry, route_lat, route_lon = (np.repeat(v, 2) for v in (rx, ry, route_lat, route_lon))
+    lengths = np.hypot(np.diff(rx), np.diff(ry))
+    starts_km = np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+
+    station_lat = pd.to_numeric(df["Coordenada Y"], errors="coerce").to_numpy(dtype=float)
+    station_lon = pd.to_numeric(df["Coordenada X"], errors="coerce").to_numpy(dtype=float)
+    if index is None:
+        index = StationIndex(station_lat, station_lon)
+
+    # Prefilter: the stations within the circle around the middle of each segment that covers the
+    # segment and its buffer
+    stations, segments = [], []
+    mid_lat = (route_lat[:-1] + route_lat[1:]) / 2
+    mid_lon = (route_lon[:-1] + route_lon[1:]) / 2
+    for segment, (lat, lon, length) in enumerate(zip(mid_lat, mid_lon, lengths)):
+        candidates, _ = index.query_radius(lat, lon, (length / 2 + buffer_km) * PREFILTER_MARGIN)
+        stations.append(candidates)
+        segments.append(np.full(len(candidates), segment))
+    stations, segments = np.concatenate(stations), np.concatenate(segments)
+
+    # Exact point to segment distance of every (station, segment) pair, keeping the closest segment
+    px, py = _project(station_lat[stations], station_lon[stations], lon0)
+    distances, t = _segment_distances(px, py, rx[segments], ry[segments], rx[segments + 1], ry[segments + 1])
+    inside = distances <= buffer_km
+    stations, segments, distances, t = stations[inside], segments[inside], distances[inside], t[inside]
+    order = np.lexsort((distances, stations))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = stations[order][1:] != stations[order][:-1]
+    closest = order[first]
+
+    result = df.iloc[stations[closest]].copy()
+    result[ROUTE_DISTANCE_COLUMN] = distances[closest].round(3)
+    result[ROUTE_POSITION_COLUMN] = (starts_km[segments[closest]] + t[closest] * lengths[segments[closest]]).round(1)
+    price = pd.to_numeric(result[fuel], errors="coerce") if fuel in result.columns else pd.Series(np.nan, index=result.index)
+    order = np.lexsort((result[ROUTE_DISTANCE_COLUMN].to_numpy(), price.fillna(math.inf).to_numpy()))
+    return result.iloc[order]
+
+
+def export_corridor(df, filename, fuels):
+    # KML/KMZ with the distance and km of the route of each station in its ExtendedData, or GPX by extension
+    if filename.lower().endswith((".gpx", ".gpx.gz")):
+        write_gpx(df, filename, fuels=fuels)
+    else:
+        write_kml(df, filename, extra_columns=[ROUTE_DISTANCE_COLUMN, ROUTE_POSITION_COLUMN], fuels=fuels)
+
+
+if __name__ == "__main__":
+
+    load_dotenv('.env', override=True)
+    STATIONS_FILE = os.getenv("STATIONS_PRICE_FILE", "gasolineras_red_fleet_precio.kml")
+    try:
+        FUEL_COLUMNS = parse_fuels(os.getenv("FUEL_COLUMNS"))
+    except ValueError as e:
+        print(f"❌ Invalid FUEL_COLUMNS: {e}")
+        exit(1)
+
+    parser = argparse.ArgumentParser(
+        description="Rank the Red Fleet stations along a route (GPX track or encoded polyline) by price",
+        allow_abbrev=False
+    )
+    parser.add_argument("route", help="GPX file with the track, or a text file with an encoded polyline")
+    parser.add_argument(
+        "--buffer-km",
+        type=float,
+        default=DEFAULT_BUFFER_KM,
+        help=f"Maximum distance from the route (default: {DEFAULT_BUFFER_KM})"
+    )
+    parser.add_argument(
+        "--fuel",
+        default="Gasoleo A",
+        help="Fuel whose price ranks the stations (default: Gasoleo A)"
+    )
+    parser.add_argument(
+        "--tolerance-km",
+        type=float,
+        default=DEFAULT_TOLERANCE_KM,
+        help=f"Tolerance of the route simplification (default: {DEFAULT_TOLERANCE_KM})"
+    )
+    parser.add_argument(
+        "--stations",
+        default=os.path.splitext(STATIONS_FILE)[0] + ".csv",
+        help="CSV with the Red Fleet stations and prices written by retrieve_stations.py (default: next to STATIONS_PRICE_FILE)"
+    )
+    parser.add_argument("--limit", type=int, default=20, help="Number of stations to list (default: 20)")
+    parser.add_argument("--output", help="Write the stations found to this KML, KMZ or GPX file")
+    args = parser.parse_args()
+
+    try:
+        fuel = parse_fuels(args.fuel)[0]
+        route_lat, route_lon = read_route(args.route)
+        df = pd.read_csv(args.stations)
+        found = corridor_stations(df, route_lat, route_lon, args.buffer_km, fuel, args.tolerance_km)
+    except (OSError, ValueError, ET.ParseError) as e:
+        print(f"❌ {e}")
+        exit(1)
+
+    print(f"⛽ {len(found)} stations within {args.buffer_km:g} km of the route")
+    for rank, (_, row) in enumerate(found.head(args.limit).iterrows(), start=1):
+        print(f"{rank:>3}. {row.get(fuel)} € {kml_label(fuel)}  km {row[ROUTE_POSITION_COLUMN]:>7}  "
+              f"{row[ROUTE_DISTANCE_COLUMN]:>5.1f} km  {row.get('CENTRO')} ({row.get('MUNICIPIO')})")
+    if args.output:
+        export_corridor(found, args.output, [f for f in FUEL_COLUMNS if f in found.columns] or [fuel])
+        print(f"🗺️ Stations written to {args.output}")
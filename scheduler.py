@@ -0,0 +1,237 @@
+import argparse
+import hashlib
+import logging
+import os
+import signal
+import time
+import requests
+from dotenv import load_dotenv
+from playwright.sync_api import sync_playwright, Error as PlaywrightError
+from cli_common import setup_logging, add_log_console_argument, add_browser_arguments
+from http_cache import create_session, bytes_received
+from match_cache import open_match_cache
+from metrics import Metrics
+from price_history import open_price_history
+from retrieve_stations import (
+    load_config, add_retrieve_arguments, fetch_ministry, ministry_urls, load_red_fleet_stations, retrieve_stations
+)
+from station_service import StationService, StationDataset, DEFAULT_SERVICE_HOST
+from update_mymaps import MyMapsSession
+from upload_targets import (
+    file_payload, is_already_uploaded, mark_as_uploaded,
+    DEFAULT_USER_SESSION_DATA_DIR, DEFAULT_USER_SESSION_STATE_FILE, DEFAULT_METRICS_FILE as DEFAULT_MYMAPS_METRICS_FILE
+)
+
+DEFAULT_LOG_FILE = "scheduler.log"
+
+# The Ministry regenerates the price feed about every half hour; polls happen a few minutes after each
+# regeneration instead of at arbitrary times
+DEFAULT_SCHEDULER_INTERVAL = 1800
+DEFAULT_SCHEDULER_OFFSET = 300
+
+
+def ministry_fingerprint(payload):
+    # The feed starts with the time of the query, so only the station list tells whether the data is new
+    start = payload.find(b'"ListaEESSPrecio"')
+    return hashlib.sha256(payload[start:] if start >= 0 else payload).hexdigest()
+
+
+def next_poll(now, interval, offset):
+    # First instant after now that is offset seconds past a multiple of interval
+    return ((now - offset) // interval + 1) * interval + offset
+
+
+class StationsScheduler:
+    # Long-running process that keeps between refreshes what the two scripts rebuild on every run:
+    # the Red Fleet stations, the spatial index, the match cache, the HTTP connections and the logged
+    # in browser. Each poll asks the Ministry for its feed and runs retrieve, match, export and upload
+    # only when the station list changed.
+
+    def __init__(self, config, args, username, password, map_url, storage_state_file=None, service=None):
+        self.config = dict(config, MINISTRY_CACHE_TTL=0)  # Every poll asks the server
+        self.args = args
+        self.username = username
+        self.password = password
+        self.map_url = map_url
+        self.storage_state_file = storage_state_file
+        self.session = create_session()
+        self.warm = {"match_cache": open_match_cache(config["MATCH_CACHE_FILE"])}
+        if config["PRICE_HISTORY_FILE"]:
+            self.warm["price_history"] = open_price_history(config["PRICE_HISTORY_FILE"])
+        self.service = service  # StationService that gets the data of every refresh
+        self.circulo_mtime = None
+        self.fingerprint = None
+        self.playwright = None
+        self.browser_session = None
+
+    def close(self):
+        if self.service:
+            self.service.close()
+        self.close_browser()
+        self.warm["match_cache"].close()
+        if "price_history" in self.warm:
+            self.warm["price_history"].close()
+        self.session.close()
+
+    def close_browser(self):
+        try:
+            if self.browser_session:
+                self.browser_session.close()
+            if self.playwright:
+                self.playwright.stop()
+        except PlaywrightError as e:
+            logging.warning(f"⚠️ Error closing the browser: {e}")
+        self.browser_session = None
+        self.playwright = None
+
+    def refresh_red_fleet(self):
+        # The Red Fleet stations are read again only when their CSV file is replaced or removed
+        path = self.config["CIRCULO_CONDUCTORES_CSV_FILENAME"]
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime is None or mtime != self.circulo_mtime:
+            self.warm.pop("df_cc", None)
+        self.circulo_mtime = mtime
+
+    def poll(self):
+        # Returns True when new Ministry data was processed
+        self.refresh_red_fleet()
+        stations_changed = "df_cc" not in self.warm
+        # The bytes downloaded of a run are counted from here, with the poll of the feed
+        bytes_received(self.session, reset=True)
+        urls = ministry_urls(self.config)
+        if self.args.province_fetch:
+            # Only the feeds of the provinces of the Red Fleet stations are polled
+            if stations_changed:
+                self.warm["df_cc"] = load_red_fleet_stations(self.config)[1]
+            urls = ministry_urls(self.config, self.warm["df_cc"])
+        ministry = fetch_ministry(self.config, self.session, urls)
+        fingerprint = ministry_fingerprint(ministry[0])
+        if fingerprint == self.fingerprint and not stations_changed:
+            logging.info("💤 No new data from the Ministry")
+            self.upload_pending()
+            return False
+
+        metrics = Metrics("retrieve_stations")
+        try:
+            retrieve_stations(self.config, self.args, metrics, self.session, self.warm, ministry)
+        finally:
+            metrics.write(self.config["METRICS_FILE"], self.config["PROMETHEUS_TEXTFILE_DIR"])
+        self.circulo_mtime = os.path.getmtime(self.config["CIRCULO_CONDUCTORES_CSV_FILENAME"])
+        self.fingerprint = fingerprint
+        if self.service:
+            self.service.swap(StationDataset(self.warm["export"], self.warm["ministry"], self.config["FUEL_COLUMNS"]))
+        # --rebuild-matches and --full only apply to the first run
+        self.args.rebuild_matches = self.args.full = False
+
+        self.upload_pending()
+        return True
+
+    def upload_pending(self):
+        # Uploads the stations file unless it is the one already uploaded, so an upload that failed is
+        # retried on the next poll even when the feed or the prices did not change since
+        stations_file = self.config["STATIONS_FILE"]
+        if not self.map_url or not os.path.exists(stations_file):
+            return
+        # Read once: the same bytes are compared with the last upload, uploaded and recorded
+        payload, digest = file_payload(stations_file)
+        if not is_already_uploaded(stations_file, digest=digest):
+            self.upload(stations_file, payload, digest)
+
+    def upload(self, stations_file, payload=None, digest=None):
+        metrics = Metrics("update_mymaps")
+        try:
+            if self.browser_session is None:
+                self.playwright = sync_playwright().start()
+                self.browser_session = MyMapsSession(
+                    self.playwright, self.username, self.password, headless=not self.args.headed,
+                    persistent=self.args.persistent, docker_server=self.args.docker_server,
+                    user_data_dir=os.getenv("USER_SESSION_DATA_DIR", DEFAULT_USER_SESSION_DATA_DIR),
+                    storage_state_file=self.storage_state_file
+                )
+                self.browser_session.start()
+            self.browser_session.metrics = metrics
+            if self.browser_session.update_map(self.map_url, payload or stations_file):
+                mark_as_uploaded(stations_file, digest=digest)
+        except PlaywrightError as e:
+            # The browser is started again on the next upload
+            logging.error(f"❌ Error updating Google My Maps: {e}")
+            self.close_browser()
+        finally:
+            metrics.write(os.getenv("METRICS_MYMAPS_FILE", DEFAULT_MYMAPS_METRICS_FILE), self.config["PROMETHEUS_TEXTFILE_DIR"])
+
+    def run(self, interval, offset):
+        while True:
+            try:
+                self.poll()
+            except requests.RequestException as e:
+                logging.error(f"Error fetching gas station data: {e}")
+            except Exception as e:
+                # A bad feed or a full disk must not stop the scheduler; the next poll tries again
+                logging.exception(f"❌ Error refreshing the stations: {e}")
+            wake_at = next_poll(time.time(), interval, offset)
+            logging.info(f"⏰ Next poll at {time.strftime('%H:%M:%S', time.localtime(wake_at))}")
+            time.sleep(max(0, wake_at - time.time()))
+
+
+def stop(signum, frame):
+    # docker stop sends SIGTERM; leave through the finally blocks so the browser and files are closed
+    raise SystemExit(0)
+
+
+if __name__ == "__main__":
+
+    load_dotenv('.env', override=True)
+    try:
+        config = load_config()
+    except ValueError as e:
+        print(f"❌ {e}")
+        exit(1)
+    config["LOG_FILE"] = os.getenv("LOG_SCHEDULER_FILE", DEFAULT_LOG_FILE)
+    SCHEDULER_INTERVAL = int(os.getenv("SCHEDULER_INTERVAL", DEFAULT_SCHEDULER_INTERVAL))
+    SCHEDULER_OFFSET = int(os.getenv("SCHEDULER_OFFSET", DEFAULT_SCHEDULER_OFFSET))
+
+    parser = argparse.ArgumentParser(
+        description="Keep the Red Fleet stations map up to date, polling the Ministry feed",
+        allow_abbrev=False
+    )
+    add_log_console_argument(parser)
+    add_retrieve_arguments(parser)
+    parser.add_argument(
+        "--no-upload",
+        action="store_true",
+        default=False,
+        help="Only retrieve and export, do not update Google My Maps (default: False)"
+    )
+    add_browser_arguments(parser)
+    parser.add_argument(
+        "--serve",
+        type=int,
+        metavar="PORT",
+        required=False,
+        help="Also serve the stations and Ministry prices of every refresh as HTTP/JSON queries on PORT"
+    )
+    args = parser.parse_args()
+
+    USERNAME = os.getenv("USERNAME")
+    PASSWORD = os.getenv("PASSWORD")
+    MAP_URL = None if args.no_upload else os.getenv("MAP_URL")
+    if not args.no_upload and not (USERNAME and PASSWORD and MAP_URL):
+        print("❌ USERNAME, PASSWORD and MAP_URL are needed in the .env file to update Google My Maps (or use --no-upload)")
+        exit(1)
+
+    setup_logging(config["LOG_FILE"], config["LOG_LEVEL"], args.log_console)
+    signal.signal(signal.SIGTERM, stop)
+
+    storage_state_file = os.getenv("USER_SESSION_STATE_FILE", DEFAULT_USER_SESSION_STATE_FILE) if args.reuse_session else None
+    service = None
+    if args.serve:
+        service = StationService(host=os.getenv("SERVICE_HOST", DEFAULT_SERVICE_HOST), port=args.serve)
+        service.start()
+    scheduler = StationsScheduler(config, args, USERNAME, PASSWORD, MAP_URL, storage_state_file, service)
+    logging.info(f"⏰ Polling the Ministry every {SCHEDULER_INTERVAL}s, {SCHEDULER_OFFSET}s after each period")
+    try:
+        scheduler.run(SCHEDULER_INTERVAL, SCHEDULER_OFFSET)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.close()
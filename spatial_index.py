@@ -0,0 +1,102 @@
+import math
+import numpy as np
+
+# Mean Earth radius (IUGG) used by the haversine distance
+EARTH_RADIUS_KM = 6371.0088
+
+# Size of a grid cell in degrees (~11 km of latitude)
+DEFAULT_CELL_DEG = 0.1
+
+# First radius tried by nearest-neighbour queries, doubled until enough stations are found
+INITIAL_SEARCH_RADIUS_KM = 5.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    # Works on scalars or broadcastable NumPy arrays (degrees in, kilometers out)
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class StationIndex:
+    # Grid bucket index over station coordinates.
+    # Stations are sorted by cell key (row * ncols + col), so the cells of one grid row
+    # form a contiguous key range that is located with a binary search.
+
+    def __init__(self, lat, lon, cell_deg=DEFAULT_CELL_DEG):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.cell_deg = cell_deg
+        self._ncols = int(math.ceil(360 / cell_deg)) + 1
+        self._nrows = int(math.ceil(180 / cell_deg)) + 1
+
+        valid = np.flatnonzero(np.isfinite(self.lat) & np.isfinite(self.lon))
+        keys = self._row(self.lat[valid]) * self._ncols + self._col(self.lon[valid])
+        order = np.argsort(keys, kind="stable")
+        self._positions = valid[order]
+        self._keys = keys[order]
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _row(self, lat):
+        return np.floor((np.asarray(lat) + 90) / self.cell_deg).astype(np.int64)
+
+    def _col(self, lon):
+        return np.floor((np.asarray(lon) + 180) / self.cell_deg).astype(np.int64)
+
+    def _bbox_candidates(self, lat, lon, radius_km):
+        # Bounding box of a spherical cap (http://janmatuschek.de/LatitudeLongitudeBoundingCoordinates)
+        angular = radius_km / EARTH_RADIUS_KM
+        dlat = math.degrees(angular)
+        lat_min, lat_max = lat - dlat, lat + dlat
+        if lat_min <= -90 or lat_max >= 90 or angular >= math.pi / 2:
+            col_ranges = [(0, self._ncols - 1)]
+        else:
+            ratio = math.sin(angular) / math.cos(math.radians(lat))
+            if ratio >= 1:
+                col_ranges = [(0, self._ncols - 1)]
+            else:
+                dlon = math.degrees(math.asin(ratio))
+                lon_min, lon_max = lon - dlon, lon + dlon
+                # Split boxes crossing the antimeridian
+                if lon_min < -180:
+                    col_ranges = [(int(self._col(lon_min + 360)), self._ncols - 1), (0, int(self._col(lon_max)))]
+                elif lon_max >= 180:
+                    col_ranges = [(int(self._col(lon_min)), self._ncols - 1), (0, int(self._col(lon_max - 360)))]
+                else:
+                    col_ranges = [(int(self._col(lon_min)), int(self._col(lon_max)))]
+
+        row_min = max(0, int(self._row(max(lat_min, -90))))
+        row_max = min(self._nrows - 1, int(self._row(min(lat_max, 90))))
+        chunks = []
+        for row in range(row_min, row_max + 1):
+            for col_min, col_max in col_ranges:
+                lo = np.searchsorted(self._keys, row * self._ncols + col_min, side="left")
+                hi = np.searchsorted(self._keys, row * self._ncols + col_max, side="right")
+                if hi > lo:
+                    chunks.append(self._positions[lo:hi])
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(chunks)
+
+    def query_radius(self, lat, lon, radius_km):
+        # Positions of the stations within radius_km, sorted by haversine distance
+        candidates = self._bbox_candidates(lat, lon, radius_km)
+        distances = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.lexsort((candidates, distances))
+        return candidates[order], distances[order]
+
+    def query_nearest(self, lat, lon, k=1):
+        # Positions of the k nearest stations, sorted by haversine distance (ties by position)
+        k = min(k, len(self))
+        if k == 0 or not (np.isfinite(lat) and np.isfinite(lon)):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        radius = INITIAL_SEARCH_RADIUS_KM
+        while True:
+            candidates, distances = self.query_radius(lat, lon, radius)
+            if len(candidates) >= k or radius >= math.pi * EARTH_RADIUS_KM:
+                return candidates[:k], distances[:k]
+            radius *= 2
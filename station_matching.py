@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from geopy.distance import geodesic
+from spatial_index import StationIndex, haversine_km
+
+# Number of haversine candidates that are re-ranked with the exact geodesic distance
+DEFAULT_TOP_K = 5
+
+# Upper bound for the number of cells of a distance matrix computed in one NumPy pass
+MAX_MATRIX_CELLS = 2_000_000
+
+# Haversine and geodesic distances differ by less than 1%, so exact matching measures every
+# station whose haversine distance is within this factor of the nearest one
+EXACT_SEARCH_FACTOR = 1.02
+
+# Default fuels; station_projection declares the others that can be exported
+PRICE_COLUMNS = ["Precio Gasolina 95 E5", "Precio Gasoleo A"]
+MATCH_COLUMNS = PRICE_COLUMNS + ["IDEESS", "Distancia (km)"]
+
+# The Ministry publishes prices with three decimals
+PRICE_DECIMALS = 3
+
+# Size in degrees of the tiles the stations are grouped by for a parallel search across provinces, and
+# number of shards per worker, so that workers that finish early take more
+SHARD_TILE_DEG = 1.0
+SHARDS_PER_WORKER = 4
+
+
+def build_station_index(df_min):
+    # Built once per run and shared by every caller that needs spatial queries
+    return StationIndex(
+        df_min["Latitud"].to_numpy(dtype=float),
+        df_min["Longitud (WGS84)"].to_numpy(dtype=float)
+    )
+
+
+def match_columns(fuels=PRICE_COLUMNS):
+    return list(fuels) + ["IDEESS", "Distancia (km)"]
+
+
+def price_values(df_min, fuels=PRICE_COLUMNS):
+    # Prices as float64 rounded to the published decimals, so float32 prices of the compact loader
+    # come out as the same numbers as the ones parsed to float64
+    return np.round(df_min[list(fuels)].to_numpy(dtype=float), PRICE_DECIMALS)
+
+
+def closest_geodesic(lat, lon, cand_lat, cand_lon, candidates):
+    # Re-rank candidate positions with geodesic distance; ties resolve to the first position, like idxmin did
+    candidates = np.sort(candidates)
+    candidates = candidates[np.isfinite(cand_lat[candidates]) & np.isfinite(cand_lon[candidates])]
+    if len(candidates) == 0:
+        return -1, np.nan
+    exact = [geodesic((lat, lon), (cand_lat[c], cand_lon[c])).kilometers for c in candidates]
+    j = int(np.argmin(exact))
+    return candidates[j], exact[j]
+
+
+def nearest_stations(lat, lon, cand_lat, cand_lon, top_k):
+    # For every origin, return the position of the nearest candidate (-1 if none) and its geodesic distance.
+    # Candidates are prefiltered with haversine and only the top_k closest are re-ranked with geodesic.
+    n, m = len(lat), len(cand_lat)
+    best = np.full(n, -1, dtype=np.int64)
+    best_distance = np.full(n, np.nan)
+    if n == 0 or m == 0:
+        return best, best_distance
+
+    k = min(top_k, m)
+    chunk_size = max(1, MAX_MATRIX_CELLS // m)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        distances = haversine_km(lat[start:stop, None], lon[start:stop, None], cand_lat[None, :], cand_lon[None, :])
+        distances = np.where(np.isnan(distances), np.inf, distances)
+        if k < m:
+            shortlist = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            shortlist = np.broadcast_to(np.arange(m), (stop - start, m))
+
+        for offset, candidates in enumerate(shortlist):
+            i = start + offset
+            if np.isnan(lat[i]) or np.isnan(lon[i]):
+                continue
+            best[i], best_distance[i] = closest_geodesic(lat[i], lon[i], cand_lat, cand_lon, candidates)
+    return best, best_distance
+
+
+def nearest_stations_indexed(lat, lon, index, top_k, exact=False):
+    # Same contract as nearest_stations, but candidates come from the spatial index instead of
+    # a full distance matrix, so the search is not bounded by province
+    best = np.full(len(lat), -1, dtype=np.int64)
+    best_distance = np.full(len(lat), np.nan)
+    for i in range(len(lat)):
+        candidates, distances = index.query_nearest(lat[i], lon[i], top_k)
+        if len(candidates) == 0:
+            continue
+        if exact:
+            candidates, _ = index.query_radius(lat[i], lon[i], distances[0] * EXACT_SEARCH_FACTOR + 0.001)
+        best[i], best_distance[i] = closest_geodesic(lat[i], lon[i], index.lat, index.lon, candidates)
+    return best, best_distance
+
+
+def province_shards(df_cc, df_min):
+    # (rows of df_cc, positions of df_min) of every province of df_cc with Ministry stations
+    min_groups = df_min.groupby("PROVINCIA", observed=True).indices
+    for provincia, rows in df_cc.groupby("PROVINCIA", observed=True).indices.items():
+        candidates = min_groups.get(provincia)
+        if candidates is None:
+            logging.warning(f"⚠️ No Ministry stations found for province {provincia}")
+            continue
+        yield rows, candidates
+
+
+def tile_shards(lat, lon, count):
+    # Up to count groups of rows of neighbouring stations, so each worker looks up close grid cells
+    tiles = np.floor(np.nan_to_num(lat, nan=1e4) / SHARD_TILE_DEG) * 1e6 + np.floor(np.nan_to_num(lon, nan=1e4) / SHARD_TILE_DEG)
+    order = np.argsort(tiles, kind="stable")
+    return [rows for rows in np.array_split(order, max(1, min(count, len(order)))) if len(rows)]
+
+
+# Ministry coordinates and spatial index of a worker process, attached once by _init_worker
+_worker = {}
+
+
+def _init_worker(name, size):
+    # The pool shares the resource tracker of the parent, which removes the block once it is done
+    block = shared_memory.SharedMemory(name=name)
+    coordinates = np.ndarray((2, size), dtype=np.float64, buffer=block.buf)
+    _worker.update(block=block, lat=coordinates[0], lon=coordinates[1], index=StationIndex(coordinates[0], coordinates[1]))
+
+
+def _search(lat, lon, candidates, k, exact, min_lat, min_lon, index):
+    # Nearest Ministry station of each origin within candidates, or across the index when candidates is None
+    if candidates is None:
+        return nearest_stations_indexed(lat, lon, index, k, exact)
+    return nearest_stations(lat, lon, min_lat[candidates], min_lon[candidates], k)
+
+
+def _search_shard(task):
+    shard, lat, lon, candidates, k, exact = task
+    return shard, _search(lat, lon, candidates, k, exact, _worker["lat"], _worker["lon"], _worker["index"])
+
+
+def run_shards(shards, cc_lat, cc_lon, min_lat, min_lon, index, workers=1):
+    # (best, best_distance) of every shard (rows, candidates, k, exact), in the order of shards. With more
+    # than one worker the shards run on a process pool that reads the Ministry coordinates from shared
+    # memory; every shard is computed exactly as in the serial path, so the results are the same.
+    if workers <= 1 or len(shards) <= 1:
+        return [_search(cc_lat[rows], cc_lon[rows], candidates, k, exact, min_lat, min_lon, index)
+                for rows, candidates, k, exact in shards]
+
+    block = shared_memory.SharedMemory(create=True, size=max(1, 2 * len(min_lat) * 8))
+    try:
+        np.ndarray((2, len(min_lat)), dtype=np.float64, buffer=block.buf)[:] = (min_lat, min_lon)
+        tasks = [(shard, cc_lat[rows], cc_lon[rows], candidates, k, exact)
+                 for shard, (rows, candidates, k, exact) in enumerate(shards)]
+        # Largest shards first, so a big province does not start last
+        tasks.sort(key=lambda task: -len(task[1]) * (len(task[3]) if task[3] is not None else 1))
+        results = [None] * len(shards)
+        with multiprocessing.Pool(min(workers, len(shards)), _init_worker, (block.name, len(min_lat))) as pool:
+            for shard, result in pool.imap_unordered(_search_shard, tasks):
+                results[shard] = result
+        return results
+    finally:
+        block.close()
+        block.unlink()
+
+
+def match_nearest_stations(df_cc, df_min, top_k=DEFAULT_TOP_K, exact=False, index=None, by_province=False,
+                           fuels=PRICE_COLUMNS, workers=1):
+    # Prices, IDEESS and distance of the nearest Ministry station of every row of df_cc, searched in batches.
+    # By default the nearest station is searched with the spatial index across province borders.
+    # With by_province=True the search is limited to the station's province as before, and
+    # with exact=True as well every candidate of the province is measured with geodesic, which is
+    # the same computation as the original per-row path and is kept to check results.
+    # Every fuel is taken from the matched position in one pass, so more fuels do not mean more searches.
+    # workers > 1 spreads the search over that many processes (0 for every core) by province, or by
+    # tile across provinces; the result is identical to the serial one.
+    workers = workers or os.cpu_count() or 1
+    prices = np.full((len(df_cc), len(fuels)), np.nan)
+    ids = np.full(len(df_cc), None, dtype=object)
+    distances = np.full(len(df_cc), np.nan)
+
+    cc_lat = pd.to_numeric(df_cc["Coordenada Y"], errors="coerce").to_numpy(dtype=float)
+    cc_lon = pd.to_numeric(df_cc["Coordenada X"], errors="coerce").to_numpy(dtype=float)
+    min_lat = df_min["Latitud"].to_numpy(dtype=float)
+    min_lon = df_min["Longitud (WGS84)"].to_numpy(dtype=float)
+    min_prices = price_values(df_min, fuels)
+    min_ids = df_min["IDEESS"].to_numpy() if "IDEESS" in df_min.columns else df_min.index.to_numpy()
+
+    def assign(rows, candidates, best, best_distance):
+        found = best >= 0
+        positions = candidates[best[found]]
+        prices[rows[found]] = min_prices[positions]
+        ids[rows[found]] = min_ids[positions]
+        distances[rows[found]] = best_distance[found]
+
+    if by_province:
+        shards = [(rows, candidates, len(candidates) if exact else top_k, False)
+                  for rows, candidates in province_shards(df_cc, df_min)]
+    else:
+        tiles = [np.arange(len(df_cc))] if workers <= 1 else tile_shards(cc_lat, cc_lon, workers * SHARDS_PER_WORKER)
+        shards = [(rows, None, top_k, exact) for rows in tiles]
+        # Worker processes build their own index over the shared coordinates
+        if index is None and (workers <= 1 or len(shards) <= 1):
+            index = build_station_index(df_min)
+
+    all_positions = np.arange(len(df_min))
+    for (rows, candidates, _, _), (best, best_distance) in zip(
+        shards, run_shards(shards, cc_lat, cc_lon, min_lat, min_lon, index, workers)
+    ):
+        assign(rows, all_positions if candidates is None else candidates, best, best_distance)
+
+    result = pd.DataFrame(prices, index=df_cc.index, columns=list(fuels))
+    result["IDEESS"] = ids
+    result["Distancia (km)"] = distances
+    logging.info(f"🔎 Matched {int(result['IDEESS'].notna().sum())} of {len(df_cc)} stations")
+    return result
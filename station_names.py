@@ -0,0 +1,114 @@
+import re
+import unicodedata
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Articles the Ministry writes after the name, "PALMAS (LAS)", and the sheet before it, "Las Palmas"
+ARTICLE_SUFFIX = re.compile(r"^(.+?)\s*\((A|O|AS|OS|EL|LA|LOS|LAS|L'|ELS|LES|ES|SA|SES|ILLES)\)$")
+
+# Spelling variants of the provinces in the Ministry feed and the Circulo Conductores sheet, as returned
+# by normalize_name, and the name both are compared by
+PROVINCE_ALIASES = {
+    "ARABA/ALAVA": "ALAVA",
+    "ARABA": "ALAVA",
+    "ILLES BALEARS": "BALEARES",
+    "ISLAS BALEARES": "BALEARES",
+    "BIZKAIA": "VIZCAYA",
+    "CASTELLON / CASTELLO": "CASTELLON",
+    "CASTELLO": "CASTELLON",
+    "A CORUNA": "LA CORUNA",
+    "CORUNA": "LA CORUNA",
+    "GIPUZKOA": "GUIPUZCOA",
+    "GIRONA": "GERONA",
+    "LLEIDA": "LERIDA",
+    "OURENSE": "ORENSE",
+    "NAFARROA": "NAVARRA",
+    "SANTA CRUZ DE TENERIFE": "TENERIFE",
+    "VALENCIA / VALENCIA": "VALENCIA",
+    "ALICANTE / ALACANT": "ALICANTE",
+    "ALACANT": "ALICANTE",
+}
+
+# Bilingual and short forms of municipalities, normalized like the provinces
+MUNICIPALITY_ALIASES = {
+    "ALICANTE/ALACANT": "ALICANTE",
+    "ALACANT": "ALICANTE",
+    "BILBO": "BILBAO",
+    "CASTELLON DE LA PLANA/CASTELLO DE LA PLANA": "CASTELLON DE LA PLANA",
+    "CASTELLO DE LA PLANA": "CASTELLON DE LA PLANA",
+    "DONOSTIA/SAN SEBASTIAN": "SAN SEBASTIAN",
+    "DONOSTIA-SAN SEBASTIAN": "SAN SEBASTIAN",
+    "DONOSTIA": "SAN SEBASTIAN",
+    "ELCHE/ELX": "ELCHE",
+    "ELX": "ELCHE",
+    "A CORUNA": "LA CORUNA",
+    "GIRONA": "GERONA",
+    "LLEIDA": "LERIDA",
+    "OURENSE": "ORENSE",
+    "PAMPLONA/IRUNA": "PAMPLONA",
+    "IRUNA": "PAMPLONA",
+    "PALMA DE MALLORCA": "PALMA",
+    "VITORIA-GASTEIZ": "VITORIA",
+    "GASTEIZ": "VITORIA",
+}
+
+# Distinct names kept by normalize_name; the whole feed has about 8,000 municipalities
+NAME_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def normalize_name(text):
+    # Upper case, without accents or repeated spaces and with the article in front: "Coruña (A)" -> "A CORUNA"
+    text = unicodedata.normalize("NFD", text.upper())
+    text = " ".join("".join(c for c in text if unicodedata.category(c) != "Mn").split())
+    match = ARTICLE_SUFFIX.match(text)
+    if match:
+        name, article = match.groups()
+        text = f"{article}{name}" if article.endswith("'") else f"{article} {name}"
+    return text
+
+
+def normalize_names(values, aliases=None):
+    # normalize_name and the aliases applied to a Series. Each distinct value is normalized once and the
+    # results are spread over the rows by their codes; categorical Series stay categorical. Values that are
+    # not strings become NaN, as with the .str methods.
+    aliases = aliases or {}
+    categorical = isinstance(values.dtype, pd.CategoricalDtype)
+    if categorical:
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+    names = np.array(
+        [aliases.get(name, name) for name in (normalize_name(u) if isinstance(u, str) else np.nan for u in uniques)],
+        dtype=object
+    )
+    if categorical:
+        # Several categories may become the same name, so they are factorized again
+        name_codes, categories = pd.factorize(names)
+        result = pd.Categorical.from_codes(np.append(name_codes, -1)[codes], categories)
+    else:
+        # Code -1 (missing value) takes the NaN appended at the end
+        result = np.append(names, np.nan)[codes]
+    return pd.Series(result, index=values.index, name=values.name)
+
+
+# Codes of the provinces in the Ministry feed (IDProvincia, the INE codes) by the names normalize_names
+# gives with PROVINCE_ALIASES
+PROVINCE_IDS = {
+    "ALAVA": "01", "ALBACETE": "02", "ALICANTE": "03", "ALMERIA": "04", "AVILA": "05", "BADAJOZ": "06",
+    "BALEARES": "07", "BARCELONA": "08", "BURGOS": "09", "CACERES": "10", "CADIZ": "11", "CASTELLON": "12",
+    "CIUDAD REAL": "13", "CORDOBA": "14", "LA CORUNA": "15", "CUENCA": "16", "GERONA": "17", "GRANADA": "18",
+    "GUADALAJARA": "19", "GUIPUZCOA": "20", "HUELVA": "21", "HUESCA": "22", "JAEN": "23", "LEON": "24",
+    "LERIDA": "25", "LA RIOJA": "26", "LUGO": "27", "MADRID": "28", "MALAGA": "29", "MURCIA": "30",
+    "NAVARRA": "31", "ORENSE": "32", "ASTURIAS": "33", "PALENCIA": "34", "LAS PALMAS": "35", "PONTEVEDRA": "36",
+    "SALAMANCA": "37", "TENERIFE": "38", "CANTABRIA": "39", "SEGOVIA": "40", "SEVILLA": "41", "SORIA": "42",
+    "TARRAGONA": "43", "TERUEL": "44", "TOLEDO": "45", "VALENCIA": "46", "VALLADOLID": "47", "VIZCAYA": "48",
+    "ZAMORA": "49", "ZARAGOZA": "50", "CEUTA": "51", "MELILLA": "52",
+}
+
+
+def province_ids(provinces):
+    # (sorted Ministry codes, names without a code) of a Series of province names as written in either source
+    names = set(normalize_names(pd.Series(provinces, dtype=object), PROVINCE_ALIASES).dropna())
+    return sorted({PROVINCE_IDS[name] for name in names if name in PROVINCE_IDS}), sorted(names - PROVINCE_IDS.keys())
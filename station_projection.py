@@ -0,0 +1,63 @@
+from station_matching import PRICE_COLUMNS
+
+# Fuel price columns of the Ministry feed that can be exported, with their names in the KML and GPX files
+FUELS = {
+    "Precio Gasolina 95 E5": ("Gasolina 95 E5", "Gasolina 95"),
+    "Precio Gasolina 95 E10": ("Gasolina 95 E10", "Gasolina 95 E10"),
+    "Precio Gasolina 95 E5 Premium": ("Gasolina 95 E5 Premium", "Gasolina 95 Premium"),
+    "Precio Gasolina 98 E5": ("Gasolina 98 E5", "Gasolina 98"),
+    "Precio Gasolina 98 E10": ("Gasolina 98 E10", "Gasolina 98 E10"),
+    "Precio Gasoleo A": ("Gasóleo A", "Gasoleo A"),
+    "Precio Gasoleo B": ("Gasóleo B", "Gasoleo B"),
+    "Precio Gasoleo Premium": ("Gasóleo Premium", "Gasoleo Premium"),
+    "Precio Biodiesel": ("Biodiésel", "Biodiesel"),
+    "Precio Bioetanol": ("Bioetanol", "Bioetanol"),
+    "Precio Gases licuados del petróleo": ("GLP", "GLP"),
+    "Precio Gas Natural Comprimido": ("GNC", "GNC"),
+    "Precio Gas Natural Licuado": ("GNL", "GNL"),
+    "Precio Hidrogeno": ("Hidrógeno", "Hidrogeno"),
+}
+
+# Columns of the Circulo Conductores sheet that mark the networks of a station; a station belongs to a
+# network unless its column says "No"
+DEFAULT_NETWORKS = ["Red Fleet"]
+
+
+def _split(text):
+    return [item.strip() for item in (text or "").split(",") if item.strip()]
+
+
+def parse_fuels(text):
+    # Comma separated fuel columns, with or without the "Precio " prefix; the default ones when empty
+    fuels = []
+    for name in _split(text):
+        column = name if name.startswith("Precio ") else f"Precio {name}"
+        if column not in FUELS:
+            raise ValueError(f"Unknown fuel {name}, use one of: {', '.join(c.removeprefix('Precio ') for c in FUELS)}")
+        if column not in fuels:
+            fuels.append(column)
+    return fuels or list(PRICE_COLUMNS)
+
+
+def parse_networks(text):
+    return _split(text) or list(DEFAULT_NETWORKS)
+
+
+def kml_label(fuel):
+    return FUELS.get(fuel, (fuel, fuel))[0]
+
+
+def gpx_label(fuel):
+    return FUELS.get(fuel, (fuel, fuel))[1]
+
+
+def select_networks(df_cc, networks=DEFAULT_NETWORKS):
+    # Rows of the stations that belong to any of the networks
+    missing = [network for network in networks if network not in df_cc.columns]
+    if missing:
+        raise ValueError(f"Networks not found in the Circulo Conductores sheet: {', '.join(missing)}")
+    selected = None
+    for network in networks:
+        member = df_cc[network].fillna("").astype(str).str.lower() != "no"
+        selected = member if selected is None else selected | member
+    return df_cc[selected]
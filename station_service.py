@@ -0,0 +1,339 @@
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from cli_common import setup_logging, add_log_console_argument, DEFAULT_LOG_LEVEL, DEFAULT_STATIONS_PRICE_FILE
+from spatial_index import StationIndex
+from station_matching import price_values
+from station_names import normalize_name, PROVINCE_ALIASES
+from station_projection import FUELS, parse_fuels, kml_label
+
+DEFAULT_SERVICE_HOST = "127.0.0.1"
+DEFAULT_SERVICE_PORT = 8080
+
+DEFAULT_LOG_FILE = "service.log"
+
+# Seconds between checks of the stations CSV when the service runs on its own
+DEFAULT_RELOAD_INTERVAL = 10
+
+# Largest number of stations returned by one query
+MAX_RESULTS = 500
+DEFAULT_NEAREST = 5
+DEFAULT_CHEAPEST = 10
+
+# Sources of the stations a query can ask for with ?source=
+RED_FLEET = "red_fleet"
+MINISTRY = "ministry"
+
+
+def _json_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (np.floating, np.integer)):
+        return None if isinstance(value, np.floating) and np.isnan(value) else value.item()
+    return value
+
+
+def _records(df, columns, fuels):
+    # JSON of every row, encoded once when the dataset is built so that queries only join bytes.
+    # columns maps the output field to the column of df; missing columns are left out.
+    present = {field: column for field, column in columns.items() if column in df.columns}
+    fields = {field: df[column].tolist() for field, column in present.items()}
+    # Rounded, as the float32 prices of the compact loader would print as 1.4589999914169312
+    prices = dict(zip([kml_label(fuel) for fuel in fuels], price_values(df, fuels).T.tolist()))
+    records = []
+    for i in range(len(df)):
+        record = {field: _json_value(values[i]) for field, values in fields.items()}
+        record["prices"] = {label: _json_value(values[i]) for label, values in prices.items()}
+        records.append(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+    return records
+
+
+class StationLayer:
+    # Read-only indexes over one set of stations: spatial grid for nearest-N, coordinates sorted by latitude
+    # for bounding boxes, positions by id and, built on first use, positions sorted by price per province
+
+    def __init__(self, df, id_columns, columns, fuels):
+        self.fuels = [fuel for fuel in fuels if fuel in df.columns]
+        self.lat = pd.to_numeric(df[columns["lat"]], errors="coerce").to_numpy(dtype=float)
+        self.lon = pd.to_numeric(df[columns["lon"]], errors="coerce").to_numpy(dtype=float)
+        self.index = StationIndex(self.lat, self.lon)
+        self.records = _records(df, columns, self.fuels)
+
+        valid = np.flatnonzero(np.isfinite(self.lat) & np.isfinite(self.lon))
+        self._by_lat = valid[np.argsort(self.lat[valid], kind="stable")]
+        self._sorted_lat = self.lat[self._by_lat]
+
+        self.by_id = {}
+        for column in id_columns:
+            if column in df.columns:
+                for position, value in enumerate(df[column].tolist()):
+                    if _json_value(value) is not None:
+                        self.by_id.setdefault(str(value).removesuffix(".0"), position)
+
+        province_column = columns.get("province")
+        provinces = df[province_column] if province_column in df.columns else pd.Series("", index=df.index)
+        self.provinces = np.array([_province_key(p) for p in provinces.tolist()], dtype=object)
+        self.prices = {fuel: pd.to_numeric(df[fuel], errors="coerce").to_numpy(dtype=float) for fuel in self.fuels}
+        self._cheapest = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def nearest(self, lat, lon, n):
+        return self.index.query_nearest(lat, lon, n)
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, limit):
+        lo = np.searchsorted(self._sorted_lat, min_lat, side="left")
+        hi = np.searchsorted(self._sorted_lat, max_lat, side="right")
+        candidates = self._by_lat[lo:hi]
+        lon = self.lon[candidates]
+        inside = (lon >= min_lon) & (lon <= max_lon) if min_lon <= max_lon else (lon >= min_lon) | (lon <= max_lon)
+        return np.sort(candidates[inside])[:limit]
+
+    def cheapest(self, fuel, province, n):
+        key = (fuel, province)
+        order = self._cheapest.get(key)
+        if order is None:
+            with self._lock:
+                prices = self.prices[fuel]
+                rows = np.flatnonzero((self.provinces == province) & np.isfinite(prices))
+                order = self._cheapest[key] = rows[np.lexsort((rows, prices[rows]))]
+        return order[:n]
+
+
+def _province_key(value):
+    if not isinstance(value, str):
+        return ""
+    name = normalize_name(value)
+    return PROVINCE_ALIASES.get(name, name)
+
+
+RED_FLEET_COLUMNS = {
+    "id": "CÓDIGO", "name": "CENTRO", "address": "DIRECCIÓN", "municipality": "MUNICIPIO", "province": "PROVINCIA",
+    "brand": "CONCESIÓN", "lat": "Coordenada Y", "lon": "Coordenada X", "ideess": "IDEESS", "distance_km": "Distancia (km)"
+}
+MINISTRY_COLUMNS = {
+    "ideess": "IDEESS", "brand": "Rótulo", "municipality": "MUNICIPIO", "province": "PROVINCIA",
+    "lat": "Latitud", "lon": "Longitud (WGS84)"
+}
+
+
+class StationDataset:
+    # Everything one version of the data answers with. It is built completely before being published and
+    # never changed afterwards, so the requests that hold it need no locks.
+
+    def __init__(self, df_cc, df_min=None, fuels=None):
+        fuels = list(fuels) if fuels else [fuel for fuel in FUELS if fuel in df_cc.columns]
+        self.loaded_at = time.time()
+        self.layers = {RED_FLEET: StationLayer(df_cc, ["CÓDIGO", "IDEESS"], RED_FLEET_COLUMNS, fuels)}
+        if df_min is not None:
+            df_min = df_min.rename(columns={"Municipio": "MUNICIPIO", "Provincia": "PROVINCIA"})
+            self.layers[MINISTRY] = StationLayer(df_min, ["IDEESS"], MINISTRY_COLUMNS, fuels)
+
+    def summary(self):
+        return {
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "stations": {name: len(layer) for name, layer in self.layers.items()},
+            "fuels": [kml_label(fuel) for fuel in self.layers[RED_FLEET].fuels]
+        }
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _float(params, name, default=None):
+    try:
+        return float(params[name][0]) if name in params else default
+    except ValueError:
+        raise QueryError(400, f"{name} must be a number")
+
+
+def _int(params, name, default):
+    try:
+        return max(1, min(int(params[name][0]) if name in params else default, MAX_RESULTS))
+    except ValueError:
+        raise QueryError(400, f"{name} must be an integer")
+
+
+def _required(params, *names):
+    values = [_float(params, name) for name in names]
+    missing = [name for name, value in zip(names, values) if value is None]
+    if missing:
+        raise QueryError(400, f"Missing parameters: {', '.join(missing)}")
+    return values
+
+
+def _list(layer, positions, distances=None):
+    if distances is None:
+        items = [layer.records[p] for p in positions]
+    else:
+        items = [b'{"distance_km":%.3f,"station":%s}' % (d, layer.records[p]) for p, d in zip(positions, distances)]
+    return b'{"count":%d,"stations":[%s]}' % (len(items), b",".join(items))
+
+
+def answer(dataset, path, params):
+    # JSON body of a query on dataset; raises QueryError for bad or unknown queries
+    source = params.get("source", [RED_FLEET])[0]
+    if source not in dataset.layers:
+        raise QueryError(400, f"Unknown source {source}, use one of: {', '.join(dataset.layers)}")
+    layer = dataset.layers[source]
+
+    if path == "/nearest":
+        lat, lon = _required(params, "lat", "lon")
+        positions, distances = layer.nearest(lat, lon, _int(params, "n", DEFAULT_NEAREST))
+        return _list(layer, positions, distances)
+    if path == "/bbox":
+        min_lat, min_lon, max_lat, max_lon = _required(params, "min_lat", "min_lon", "max_lat", "max_lon")
+        return _list(layer, layer.bbox(min_lat, min_lon, max_lat, max_lon, _int(params, "limit", MAX_RESULTS)))
+    if path == "/cheapest":
+        if "fuel" not in params or "province" not in params:
+            raise QueryError(400, "Missing parameters: fuel, province")
+        try:
+            fuel = parse_fuels(params["fuel"][0])[0]
+        except ValueError as e:
+            raise QueryError(400, str(e))
+        if fuel not in layer.prices:
+            raise QueryError(400, f"No prices of {kml_label(fuel)} in this dataset")
+        return _list(layer, layer.cheapest(fuel, _province_key(params["province"][0]), _int(params, "n", DEFAULT_CHEAPEST)))
+    if path.startswith("/stations/"):
+        position = layer.by_id.get(unquote(path[len("/stations/"):]))
+        if position is None:
+            raise QueryError(404, "Station not found")
+        return layer.records[position]
+    if path == "/health":
+        return json.dumps(dataset.summary(), ensure_ascii=False).encode("utf-8")
+    raise QueryError(404, "Unknown query, use /nearest, /bbox, /cheapest, /stations/<id> or /health")
+
+
+class StationService:
+    # HTTP/JSON server over the latest StationDataset. swap() publishes a new dataset with a single
+    # assignment: requests already running finish with the dataset they started with and the next ones
+    # use the new one, so a refresh neither blocks nor drops requests.
+
+    def __init__(self, dataset=None, host=DEFAULT_SERVICE_HOST, port=DEFAULT_SERVICE_PORT):
+        self.dataset = dataset
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def swap(self, dataset):
+        self.dataset = dataset
+        logging.info(f"🔄 Serving new station data: {dataset.summary()['stations']}")
+
+    def start(self):
+        # Serves from a background thread, for processes that keep doing other work (see scheduler.py)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="station-service", daemon=True)
+        self.thread.start()
+        logging.info(f"🌐 Station service listening on http://{self.address[0]}:{self.address[1]}")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _handler(service):
+    class StationRequestHandler(BaseHTTPRequestHandler):
+        # Keep-alive, so clients can reuse the connection for many queries. Headers and body are written
+        # separately, so without TCP_NODELAY every response waits for the delayed ACK of the client (~40 ms).
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            dataset = service.dataset
+            try:
+                if dataset is None:
+                    raise QueryError(503, "No station data loaded yet")
+                status, body = 200, answer(dataset, url.path, parse_qs(url.query))
+            except QueryError as e:
+                status, body = e.status, json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(f"🌐 {self.address_string()} {format % args}")
+
+    return StationRequestHandler
+
+
+def load_csv_dataset(stations_csv, fuels=None):
+    return StationDataset(pd.read_csv(stations_csv, dtype={"CÓDIGO": str}), fuels=fuels)
+
+
+def watch_csv(service, stations_csv, interval, fuels=None):
+    # Loads the CSV written by retrieve_stations.py again whenever it is replaced
+    mtime = os.path.getmtime(stations_csv)
+    while True:
+        time.sleep(interval)
+        try:
+            current = os.path.getmtime(stations_csv)
+            if current != mtime:
+                service.swap(load_csv_dataset(stations_csv, fuels))
+                mtime = current
+        except (OSError, ValueError, pd.errors.ParserError) as e:
+            # Possibly caught halfway through a rewrite; the next check tries again
+            logging.warning(f"⚠️ Could not reload {stations_csv}: {e}")
+
+
+if __name__ == "__main__":
+
+    load_dotenv('.env', override=True)
+    STATIONS_FILE = os.getenv("STATIONS_PRICE_FILE", DEFAULT_STATIONS_PRICE_FILE)
+    SERVICE_HOST = os.getenv("SERVICE_HOST", DEFAULT_SERVICE_HOST)
+    SERVICE_PORT = int(os.getenv("SERVICE_PORT", DEFAULT_SERVICE_PORT))
+
+    parser = argparse.ArgumentParser(
+        description="Serve the Red Fleet stations and prices of the last export as HTTP/JSON queries",
+        allow_abbrev=False
+    )
+    parser.add_argument(
+        "--stations",
+        default=os.path.splitext(STATIONS_FILE)[0] + ".csv",
+        help="CSV with the Red Fleet stations and prices written by retrieve_stations.py (default: next to STATIONS_PRICE_FILE)"
+    )
+    parser.add_argument("--host", default=SERVICE_HOST, help=f"Address to listen on (default: {SERVICE_HOST})")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help=f"Port to listen on (default: {SERVICE_PORT})")
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=DEFAULT_RELOAD_INTERVAL,
+        help=f"Seconds between checks for a new stations CSV (default: {DEFAULT_RELOAD_INTERVAL})"
+    )
+    add_log_console_argument(parser)
+    args = parser.parse_args()
+    setup_logging(os.getenv("LOG_SERVICE_FILE", DEFAULT_LOG_FILE), os.getenv("LOG_LEVEL", DEFAULT_LOG_LEVEL).upper(),
+                  args.log_console)
+
+    try:
+        service = StationService(load_csv_dataset(args.stations), args.host, args.port)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        exit(1)
+    threading.Thread(target=watch_csv, args=(service, args.stations, args.reload_interval), daemon=True).start()
+    print(f"🌐 Serving {args.stations} on http://{service.address[0]}:{service.address[1]}")
+    try:
+        service.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server.server_close()
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from station_matching import PRICE_COLUMNS, match_columns
+
+DEFAULT_STATIONS_STATE_FILE = "stations_state.json"
+
+STATE_VERSION = 1
+
+KEY_COLUMNS = ["CENTRO", "MUNICIPIO", "DIRECCIÓN"]
+
+
+def station_keys(df_cc):
+    # Identify a Red Fleet station independently of its coordinates
+    columns = [col for col in KEY_COLUMNS if col in df_cc.columns]
+    return df_cc[columns].fillna("").astype(str).agg("|".join, axis=1)
+
+
+def _to_json_value(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (np.floating, np.integer)):
+        return value.item()
+    return value
+
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ Ignoring unreadable state file {state_file}: {e}")
+        return {}
+    if state.get("version") != STATE_VERSION:
+        logging.warning(f"⚠️ Ignoring state file {state_file} with unsupported version")
+        return {}
+    return state
+
+
+def save_state(state_file, df_cc, fuels=PRICE_COLUMNS):
+    columns = match_columns(fuels)
+    stations = {}
+    for key, lat, lon, values in zip(
+        station_keys(df_cc),
+        df_cc["Coordenada Y"],
+        df_cc["Coordenada X"],
+        df_cc[columns].itertuples(index=False, name=None)
+    ):
+        stations[key] = {"lat": _to_json_value(lat), "lon": _to_json_value(lon)}
+        stations[key].update({col: _to_json_value(v) for col, v in zip(columns, values)})
+
+    state = {
+        "version": STATE_VERSION,
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+        "stations": stations
+    }
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_file, state_file)
+
+
+def price_changes(df_cc, state, fuels=PRICE_COLUMNS):
+    # Returns (changes, removed): the rows that are new or whose prices moved, with the previous
+    # prices in "<column> anterior" columns, and the keys of stations that are no longer present
+    previous = state.get("stations", {})
+    keys = station_keys(df_cc)
+    changed = pd.Series(False, index=df_cc.index)
+    changes = df_cc.copy()
+    for col in fuels:
+        before = keys.map(lambda key: (previous.get(key) or {}).get(col))
+        before = pd.to_numeric(before, errors="coerce")
+        now = pd.to_numeric(df_cc[col], errors="coerce")
+        changes[f"{col} anterior"] = before
+        changed |= ~((before == now) | (before.isna() & now.isna()))
+    changed |= ~keys.isin(previous.keys())
+    removed = sorted(set(previous) - set(keys))
+    return changes[changed], removed
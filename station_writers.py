@@ -0,0 +1,286 @@
+import gzip
+import io
+import os
+import re
+import unicodedata
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+from xml.sax.saxutils import escape
+import numpy as np
+import pandas as pd
+from station_matching import PRICE_COLUMNS
+from station_projection import kml_label, gpx_label
+
+# Size of the write buffer of the output files
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+KML_HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+<Document>
+    <name>Gasolineras</name>
+'''
+KML_FOOTER = '''</Document>
+</kml>
+'''
+
+# Google My Maps imports at most 2,000 features per layer
+MAX_LAYER_FEATURES = 2000
+
+# Price bands used to style the placemarks of layered output: (style id, icon color as aabbggrr)
+PRICE_BANDS = [
+    ("barato", "ff00c000"),
+    ("medio", "ff00c0ff"),
+    ("caro", "ff0000ff"),
+]
+NO_PRICE_STYLE = ("sin_precio", "ff888888")
+PRICE_BAND_COLUMN = "Precio Gasoleo A"
+
+GPX_HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="Gasolineras" xmlns="http://www.topografix.com/GPX/1/1">
+'''
+GPX_FOOTER = '''</gpx>
+'''
+
+
+@contextmanager
+def open_output(filename, compression=None, buffer=None):
+    # Text handle for the output file: plain, gzip (.gz) or KMZ (a zip with a single doc.kml). With buffer,
+    # a binary file object such as io.BytesIO, the bytes of the file are written there instead and the
+    # buffer is left open.
+    if compression is None:
+        if filename.endswith(".kmz"):
+            compression = "kmz"
+        elif filename.endswith(".gz"):
+            compression = "gzip"
+
+    target = filename if buffer is None else buffer
+    if compression == "kmz":
+        with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            with io.TextIOWrapper(archive.open("doc.kml", "w"), encoding="utf-8") as f:
+                yield f
+    elif compression == "gzip":
+        with gzip.open(target, "wt", encoding="utf-8", compresslevel=6) as f:
+            yield f
+    elif buffer is not None:
+        f = io.TextIOWrapper(buffer, encoding="utf-8")
+        try:
+            yield f
+        finally:
+            f.flush()
+            f.detach()
+    else:
+        with open(filename, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
+            yield f
+
+
+def _coordinates(values):
+    # Same rule as float(row[...]) in the row-by-row writers: None if not convertible
+    result = []
+    for value in values:
+        try:
+            result.append(float(value))
+        except (ValueError, TypeError):
+            result.append(None)
+    return result
+
+
+def _column(df, column, escaped=True):
+    # Whole column as a list of Python values, escaped for XML if requested
+    if column not in df.columns:
+        return [""] * len(df)
+    values = df[column].tolist()
+    if escaped:
+        return [escape(str(v)) for v in values]
+    return values
+
+
+def price_bands(df, column=PRICE_BAND_COLUMN):
+    # Tertiles of the price across df; stations without price get their own band
+    prices = pd.to_numeric(df[column], errors="coerce") if column in df.columns else pd.Series(np.nan, index=df.index)
+    bands = pd.Series(NO_PRICE_STYLE[0], index=df.index, dtype=object)
+    valid = prices.notna()
+    if valid.any():
+        ranks = prices[valid].rank(method="first", pct=True)
+        names = [name for name, _ in PRICE_BANDS]
+        bands[valid] = [names[min(int(r * len(names) - 1e-9), len(names) - 1)] for r in ranks]
+    return bands
+
+
+def kml_styles():
+    styles = []
+    for style_id, color in PRICE_BANDS + [NO_PRICE_STYLE]:
+        styles.append(f"""    <Style id="{style_id}">
+        <IconStyle>
+            <color>{color}</color>
+            <Icon>
+                <href>https://maps.google.com/mapfiles/kml/shapes/gas_stations.png</href>
+            </Icon>
+        </IconStyle>
+    </Style>
+""")
+    return "".join(styles)
+
+
+def _extended_data(df, columns):
+    # Extra <Data> elements of every row for the given columns; missing values are left empty
+    if not columns:
+        return [""] * len(df)
+    parts = []
+    for col in columns:
+        name = escape(str(col), {'"': "&quot;"})
+        values = ["" if pd.isna(v) else escape(str(v)) for v in df[col].tolist()]
+        parts.append([f"""
+            <Data name="{name}">
+                <value>{value}</value>
+            </Data>""" for value in values])
+    return ["".join(row) for row in zip(*parts)]
+
+
+def _fuel_data(df, fuels):
+    # <Data> elements with the price of each fuel of every row, in the order of fuels
+    parts = []
+    for fuel in fuels:
+        name = escape(kml_label(fuel), {'"': "&quot;"})
+        parts.append([f"""
+            <Data name="{name}">
+                <value>{value} €</value>
+            </Data>""" for value in _column(df, fuel, escaped=False)])
+    return ["".join(row) for row in zip(*parts)] if parts else [""] * len(df)
+
+
+def _fuel_lines(df, fuels):
+    # "<fuel>: <price>" lines of the GPX description of every row
+    parts = [[f"{gpx_label(fuel)}: {value}\n" for value in _column(df, fuel, escaped=False)] for fuel in fuels]
+    return ["".join(row) for row in zip(*parts)] if parts else [""] * len(df)
+
+
+def iter_kml_placemarks(df, now, styles=None, extra_columns=None, fuels=PRICE_COLUMNS):
+    # extra_columns are appended to the ExtendedData of each placemark after the fixed fields
+    rows = zip(
+        _coordinates(df["Coordenada X"].tolist()),
+        _coordinates(df["Coordenada Y"].tolist()),
+        _fuel_data(df, fuels),
+        _column(df, "PROVINCIA"),
+        _column(df, "MUNICIPIO"),
+        _column(df, "CENTRO"),
+        _column(df, "DIRECCIÓN"),
+        _column(df, "CONCESIÓN"),
+        styles if styles is not None else [None] * len(df),
+        _extended_data(df, extra_columns)
+    )
+    for lon, lat, prices, provincia, municipio, centro, direccion, concesion, style, extra in rows:
+        if lon is None or lat is None:
+            continue  # Saltar si no hay coordenadas válidas
+        style_url = f"""
+        <styleUrl>#{style}</styleUrl>""" if style else ""
+        yield f"""
+    <Placemark>
+        <name>{centro}</name>
+        <description><![CDATA[Concesión {concesion}]]></description>{style_url}
+        <ExtendedData>{prices}
+            <Data name="Dirección">
+                <value>{direccion}</value>
+            </Data>
+            <Data name="Municipio">
+                <value>{municipio}</value>
+            </Data>
+            <Data name="Provincia">
+                <value>{provincia}</value>
+            </Data>
+            <Data name="Fecha">
+                <value>{now}</value>
+            </Data>{extra}
+        </ExtendedData>
+        <Point>
+            <coordinates>{lon},{lat},0</coordinates>
+        </Point>
+    </Placemark>
+"""
+
+
+def iter_gpx_waypoints(df, now, fuels=PRICE_COLUMNS):
+    rows = zip(
+        _coordinates(df["Coordenada X"].tolist()),
+        _coordinates(df["Coordenada Y"].tolist()),
+        _fuel_lines(df, fuels),
+        _column(df, "PROVINCIA"),
+        _column(df, "MUNICIPIO"),
+        _column(df, "CENTRO"),
+        _column(df, "DIRECCIÓN")
+    )
+    for lon, lat, prices, provincia, municipio, centro, direccion in rows:
+        if lon is None or lat is None:
+            continue
+        yield f"""
+  <wpt lat="{lat}" lon="{lon}">
+    <name>{centro}</name>
+    <desc>{prices}Provincia: {provincia}
+Municipio: {municipio}
+Centro: {centro}
+Direccion: {direccion}</desc>
+    <time>{now}</time>
+  </wpt>
+"""
+
+
+def write_kml(df, filename, compression=None, now=None, extra_columns=None, fuels=PRICE_COLUMNS, buffer=None):
+    # Streams the placemarks to the file instead of building them all in memory first. With buffer (an
+    # io.BytesIO) the file is written there and then saved in one write, so the caller keeps its bytes.
+    now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with open_output(filename, compression, buffer) as f:
+        f.write(KML_HEADER)
+        for placemark in iter_kml_placemarks(df, now, extra_columns=extra_columns, fuels=fuels):
+            f.write(placemark)
+        f.write(KML_FOOTER)
+    if buffer is not None:
+        with open(filename, "wb") as f:
+            f.write(buffer.getvalue())
+
+
+def _slug(text):
+    text = unicodedata.normalize("NFD", str(text))
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    return re.sub(r"[^A-Za-z0-9]+", "_", text).strip("_").lower() or "sin_nombre"
+
+
+def write_kml_layers(df, filename, split_by, compression=None, max_features=MAX_LAYER_FEATURES, now=None,
+                     extra_columns=None, fuels=PRICE_COLUMNS):
+    # Writes one KML/KMZ document per province or price band, next to filename, with the price band
+    # styles defined once per document. Groups larger than max_features are split in several parts.
+    # Returns the list of files written.
+    now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Bands follow the diesel price when it is exported, else the first fuel
+    bands = price_bands(df, PRICE_BAND_COLUMN if PRICE_BAND_COLUMN in fuels or not fuels else fuels[0])
+    if split_by == "province":
+        groups = df["PROVINCIA"].fillna("")
+    elif split_by == "price":
+        groups = bands
+    else:
+        raise ValueError(f"Unknown layer split: {split_by}")
+
+    base, extension = os.path.splitext(filename)
+    files = []
+    for group, layer in df.groupby(groups, sort=True):
+        for part, start in enumerate(range(0, len(layer), max_features), start=1):
+            chunk = layer.iloc[start:start + max_features]
+            suffix = f"_{part}" if len(layer) > max_features else ""
+            layer_file = f"{base}_{_slug(group)}{suffix}{extension}"
+            name = escape(f"Gasolineras - {group}{f' ({part})' if suffix else ''}")
+            with open_output(layer_file, compression) as f:
+                f.write(KML_HEADER.replace("<name>Gasolineras</name>", f"<name>{name}</name>"))
+                f.write(kml_styles())
+                for placemark in iter_kml_placemarks(chunk, now, bands[chunk.index].tolist(), extra_columns, fuels):
+                    f.write(placemark)
+                f.write(KML_FOOTER)
+            files.append(layer_file)
+    return files
+
+
+def write_gpx(df, filename, compression=None, now=None, fuels=PRICE_COLUMNS):
+    now = now or datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+    with open_output(filename, compression) as f:
+        f.write(GPX_HEADER)
+        for waypoint in iter_gpx_waypoints(df, now, fuels):
+            f.write(waypoint)
+        f.write(GPX_FOOTER)
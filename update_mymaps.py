@@ -1,11 +1,17 @@
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import sync_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
 import os
+import time
 import logging
-from logging.handlers import RotatingFileHandler
 import argparse
+import queue
+import threading
 from dotenv import load_dotenv
-
-DEFAULT_LOG_LEVEL = "INFO"
+from cli_common import setup_logging, add_log_console_argument, add_browser_arguments
+from metrics import Metrics
+from upload_targets import (
+    load_upload_config, add_upload_arguments, missing_upload_settings, print_upload_plan, load_manifest,
+    is_already_uploaded, mark_as_uploaded, DEFAULT_USER_SESSION_DATA_DIR, DEFAULT_BATCH_CONCURRENCY
+)
 
 # Chrome User-Agent on Windows 10
 CHROME_USER_AGENT = (
@@ -17,18 +23,25 @@ CHROME_USER_AGENT = (
 # URL of Google Account Login
 ACCOUNT_GOOGLE_URL = "https://accounts.google.com/"
 
-# Folder where the session is saved
-DEFAULT_USER_SESSION_DATA_DIR = "google_session"
+# STATIONS_FILE = r"D:\05_Proyectos_tlmat\gasolineras_all.kml"
 
-DEFAULT_LOG_FILE = "mymaps.log"
+# Deadline of each step of the My Maps flow, in milliseconds
+DEFAULT_STEP_TIMEOUT = 30000
 
-# STATIONS_FILE = r"D:\05_Proyectos_tlmat\gasolineras_all.kml"
+# Deadline for Google to take the file and close the import dialog, in milliseconds
+IMPORT_TIMEOUT = 120000
 
-def manual_session_google():
+# Once the import dialog closes, time given to the map to finish its requests before moving on
+IMPORT_SETTLE_TIMEOUT = 10000
+
+# Interval between checks while waiting on frames, which Playwright cannot wait on directly
+POLL_INTERVAL = 100
+
+def manual_session_google(user_data_dir=DEFAULT_USER_SESSION_DATA_DIR):
     with sync_playwright() as p:
         browser = p.chromium.launch_persistent_context(
             args=["--disable-blink-features=AutomationControlled"], 
-            user_data_dir=USER_DATA_DIR,
+            user_data_dir=user_data_dir,
             headless=False
         )
         page = browser.new_page()
@@ -37,11 +50,11 @@ def manual_session_google():
         input("✅ Press Enter here when you have finished logging in...")
         browser.close()
 
-def stored_session_google():
+def stored_session_google(user_data_dir=DEFAULT_USER_SESSION_DATA_DIR):
     with sync_playwright() as p:
         browser = p.chromium.launch_persistent_context(
             args=["--disable-blink-features=AutomationControlled"], 
-            user_data_dir=USER_SESSION_DATA_DIR,
+            user_data_dir=user_data_dir,
             headless=False
         )
         page = browser.new_page()
@@ -64,183 +77,423 @@ def stored_session_google():
 # https://www.zenrows.com/blog/disable-blink-features-automationcontrolled#permanently-avoid-getting-blocked
 
 
+def wait_for_file_picker(page, timeout):
+    # The file picker is loaded in an iframe of its own; returns the frame once its Browse button shows up
+    deadline = time.monotonic() + timeout / 1000
+    while True:
+        for frame in page.frames:
+            try:
+                if frame.get_by_role("button", name="Browse").is_visible() and frame.locator('input[type="file"]').count():
+                    return frame
+            except PlaywrightError:
+                pass  # The frame was detached while checking it
+        if time.monotonic() > deadline:
+            raise PlaywrightTimeoutError(f"No file picker with a Browse button after {timeout} ms")
+        page.wait_for_timeout(POLL_INTERVAL)
+
+
+def wait_for_import(page, picker, timeout):
+    # The import is complete when the picker dialog goes away and the requests it started are answered
+    deadline = time.monotonic() + timeout / 1000
+    while True:
+        try:
+            if picker.is_detached() or not picker.get_by_role("button", name="Browse").is_visible():
+                break
+        except PlaywrightError:
+            break  # Detached while checking it
+        if time.monotonic() > deadline:
+            raise PlaywrightTimeoutError(f"The import dialog was still open after {timeout} ms")
+        page.wait_for_timeout(POLL_INTERVAL)
+
+    # My Maps may keep long-polling connections open, so the page is not required to become idle
+    remaining = max(0, min(IMPORT_SETTLE_TIMEOUT, (deadline - time.monotonic()) * 1000))
+    try:
+        page.wait_for_load_state("networkidle", timeout=remaining)
+    except PlaywrightTimeoutError:
+        logging.debug("🌐 The map still had requests in flight after the import")
+
+
+def file_name_and_size(stations_file):
+    # stations_file is a path or a file already in memory, as the {name, mimeType, buffer} of Playwright
+    if isinstance(stations_file, dict):
+        return stations_file["name"], len(stations_file["buffer"])
+    return stations_file, os.path.getsize(stations_file)
+
+
+def layer_options(page, layer=None):
+    # Options button of the named layer; without a name the map is expected to have a single layer
+    button = page.get_by_label("Layer options")
+    if layer is None:
+        return button
+    # The innermost block holding both the layer name and an options button is the panel of that layer
+    panel = page.locator("div").filter(has=page.get_by_text(layer, exact=True)).filter(has=button).last
+    return panel.get_by_label("Layer options")
+
+
 # https://scribe.rawbit.ninja/@adequatica/google-authentication-with-playwright-8233b207b71a
-def update_mymap_google(headless=True, persistent=False, docker_server=None):
-    with sync_playwright() as p:
-        logging.info("🌐 Starting Playwright...")
-        if persistent:
-            # If you want to use a persistent session
-            browser = p.chromium.launch_persistent_context(
-                args=["--disable-blink-features=AutomationControlled"], 
-                user_data_dir=USER_DATA_DIR,
-                headless=headless)
-            page = browser.new_page()
-        else:
+class MyMapsSession:
+    # Browser session that logs in to Google once and is reused for several map updates.
+    # With storage_state_file the cookies and local storage of the session are saved after logging in
+    # and restored on the next run, so the full login only runs when Google rejects the stored session.
+
+    def __init__(self, playwright, username, password, headless=True, persistent=False, docker_server=None,
+                 user_data_dir=DEFAULT_USER_SESSION_DATA_DIR, storage_state_file=None, metrics=None,
+                 storage_state=None):
+        self.playwright = playwright
+        self.username = username
+        self.password = password
+        self.headless = headless
+        self.persistent = persistent
+        self.docker_server = docker_server
+        self.user_data_dir = user_data_dir
+        self.storage_state_file = storage_state_file
+        # Cookies and local storage taken from another session that is already logged in
+        self.storage_state = storage_state
+        self.metrics = metrics or Metrics("update_mymaps")
+        self.browser = None
+        self.context = None
+        self.logged_in = False
+        self.restored = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        with self.metrics.stage("browser"):
+            logging.info("🌐 Starting Playwright...")
+            if self.persistent:
+                # If you want to use a persistent session
+                self.context = self.playwright.chromium.launch_persistent_context(
+                    args=["--disable-blink-features=AutomationControlled"], 
+                    user_data_dir=self.user_data_dir,
+                    headless=self.headless)
+                # The profile keeps the Google login
+                self.logged_in = True
+                return
+
             # If you want to use a non-persistent session
-            if docker_server:
+            if self.docker_server:
                 # If running in Docker, connect to the Playwright server
-                logging.info(f"🔗 Connecting to Playwright in Docker: {docker_server}")
-                browser = p.chromium.connect(docker_server)
+                logging.info(f"🔗 Connecting to Playwright in Docker: {self.docker_server}")
+                self.browser = self.playwright.chromium.connect(self.docker_server)
             else:
                 # If running locally, launch a new browser instance
                 logging.info("🔗 Using Playwright locally...")
-                browser = p.chromium.launch(
+                self.browser = self.playwright.chromium.launch(
                     args=["--disable-blink-features=AutomationControlled"], 
-                    headless=headless)
-
-            context = browser.new_context(user_agent=CHROME_USER_AGENT)
-            page = context.new_page()
-
-        if not persistent:
-            # If not using a persistent session, log in manually
+                    headless=self.headless)
+
+            storage_state = None
+            if self.storage_state:
+                storage_state = self.storage_state
+                self.restored = True
+            elif self.storage_state_file and os.path.exists(self.storage_state_file):
+                logging.info(f"🍪 Restoring Google session from {self.storage_state_file}")
+                storage_state = self.storage_state_file
+                self.restored = True
+            self.context = self.browser.new_context(user_agent=CHROME_USER_AGENT, storage_state=storage_state)
+
+    def close(self):
+        if self.context:
+            self.save_session()
+            self.context.close()
+            self.context = None
+        if self.browser:
+            self.browser.close()
+            self.browser = None
+
+    def save_session(self):
+        # Saved again on close, so the cookies refreshed by Google are kept as well
+        if self.storage_state_file and self.logged_in and not self.persistent:
+            self.context.storage_state(path=self.storage_state_file)
+
+    def step(self, name, action, timeout=DEFAULT_STEP_TIMEOUT):
+        # Runs action(timeout) as a named step of the trace; a step that misses its deadline fails the
+        # update right there instead of letting a later step run on a page that is not ready
+        with self.metrics.step(name) as record:
+            try:
+                return action(timeout)
+            except PlaywrightTimeoutError:
+                record["status"] = "timeout"
+                logging.error(f"⌛ Step {name} did not finish within {timeout / 1000:g}s")
+                raise
+
+    def login(self, page):
+        with self.metrics.stage("login"):
             logging.info("🔐 Logging in to Google.")
-            # Code to log in every time the browser is opened
-            page.goto(ACCOUNT_GOOGLE_URL)
-            page.wait_for_timeout(2000)  # Wait 2 seconds for the page to load
-            page.fill("input[type='email']", USERNAME)
-            page.locator("#identifierNext >> button").click()
-            page.wait_for_timeout(2000)
-            page.fill("#password >> input[type='password']", PASSWORD)
-            page.locator('button >> nth=1').click()
-            page.wait_for_timeout(5000)
-
-        logging.info("🗺️ Opening Google My Maps...")
-        page.goto(MAP_URL)
-        page.wait_for_timeout(1000)  # Wait 1 second to view the page
-
-        logging.info("🔄 Reimporting the gas stations file...")
-        page.get_by_label("Layer options").click()
-        page.get_by_text("Reimport and merge►").click()
-        page.get_by_text("Reimport►").click()
-        page.get_by_text("Replace all items").click()
-        page.wait_for_timeout(1000)  # Wait 1 second to view the page
-
-        # Iterate over all frames on the page
-        for frame in page.frames:
+            self.step("login_page", lambda t: page.goto(ACCOUNT_GOOGLE_URL, wait_until="domcontentloaded", timeout=t))
+            # fill and click wait until the element is visible and enabled
+            self.step("email", lambda t: page.fill("input[type='email']", self.username, timeout=t))
+            self.step("email_next", lambda t: page.locator("#identifierNext >> button").click(timeout=t))
+            self.step("password", lambda t: page.fill("#password >> input[type='password']", self.password, timeout=t))
+            self.step("password_next", lambda t: page.locator('button >> nth=1').click(timeout=t))
+            # Google leaves the accounts site once the password is accepted
+            self.step("signed_in", lambda t: page.wait_for_url(lambda url: not url.startswith(ACCOUNT_GOOGLE_URL), timeout=t))
+        self.logged_in = True
+        self.save_session()
+
+    def open_map(self, page, map_url):
+        # Returns False when Google redirects to the login page instead of opening the map
+        with self.metrics.stage("open_map"):
+            logging.info("🗺️ Opening Google My Maps...")
+            self.step("open_map", lambda t: page.goto(map_url, wait_until="domcontentloaded", timeout=t))
+            # Either the layer menu of the map or the email field of the login page shows up
+            ready = page.get_by_label("Layer options").or_(page.locator("input[type='email']"))
+            self.step("map_ready", lambda t: ready.first.wait_for(state="visible", timeout=t))
+        return not page.url.startswith(ACCOUNT_GOOGLE_URL)
+
+    def reimport_file(self, page, stations_file, layer=None):
+        # stations_file is the path of the file to import or the file already in memory
+        name, size = file_name_and_size(stations_file)
+        uploaded = False
+        with self.metrics.stage("upload") as stage:
+            logging.info(f"🔄 Reimporting the gas stations file{f' into layer {layer}' if layer else ''}...")
             try:
-                # Try to locate the button by role and name within the frame
-                button = frame.get_by_role("button", name="Browse")
-                if button.is_visible():
-                    logging.info(f"🔎 'Browse' button found in frame: {frame.name}")
-                    # button.click()
-                    locator = frame.locator('input[type="file"]')
-                    if locator.count() > 0:
-                        locator.set_input_files(STATIONS_FILE)
-                        logging.info(f"📂 File uploaded: {STATIONS_FILE}")
-                        page.wait_for_timeout(5000)  # Wait 5 seconds to view the page
-                        logging.info("✅ Google My Maps updated successfully.")      
-                        break
-                    break  # Exit the loop after clicking
-            except:
-                pass  # If the frame does not contain the button or throws an error, ignore it
+                self.step("layer_options", lambda t: layer_options(page, layer).click(timeout=t))
+                self.step("reimport_and_merge", lambda t: page.get_by_text("Reimport and merge►").click(timeout=t))
+                self.step("reimport", lambda t: page.get_by_text("Reimport►").click(timeout=t))
+                self.step("replace_all", lambda t: page.get_by_text("Replace all items").click(timeout=t))
+                frame = self.step("file_picker", lambda t: wait_for_file_picker(page, t))
+                logging.info(f"🔎 'Browse' button found in frame: {frame.name}")
+                self.step("select_file", lambda t: frame.locator('input[type="file"]').set_input_files(stations_file, timeout=t))
+                logging.info(f"📂 File uploaded: {name}")
+                self.step("import", lambda t: wait_for_import(page, frame, t), timeout=IMPORT_TIMEOUT)
+                logging.info("✅ Google My Maps updated successfully.")
+                uploaded = True
+            except PlaywrightError as e:
+                logging.error(f"❌ Could not reimport {name}: {e}")
+            self.metrics.add(stage, "bytes_uploaded", size if uploaded else 0)
+            self.metrics.add(stage, "uploads", int(uploaded))
+        return uploaded
+
+    def open_authenticated(self, page, map_url):
+        # Opens the map, logging in first if there is no session or Google rejects it
+        if not self.logged_in and not self.restored:
+            # No session to reuse, log in every time the browser is opened
+            self.login(page)
+        if not self.open_map(page, map_url):
+            logging.info("🔐 The stored Google session was rejected.")
+            self.login(page)
+            if not self.open_map(page, map_url):
+                logging.error("❌ Could not open the map after logging in to Google.")
+                return False
+        self.logged_in = True
+        return True
+
+    def update_map(self, map_url, stations_file, layer=None):
+        # Replaces all the items of the map layer with stations_file; returns True if the file was uploaded
+        page = self.context.new_page()
+        try:
+            if not self.open_authenticated(page, map_url):
+                return False
+            return self.reimport_file(page, stations_file, layer)
+        finally:
+            page.close()
+
+    def authenticated_state(self, map_url):
+        # Cookies and local storage of the session once it is known to open map_url
+        page = self.context.new_page()
+        try:
+            if not self.open_authenticated(page, map_url):
+                return None
+        finally:
+            page.close()
+        self.save_session()
+        return self.context.storage_state()
+
+
+def update_mymap_google(username, password, map_url, stations_file, headless=True, persistent=False, docker_server=None,
+                        metrics=None, storage_state_file=None, user_data_dir=DEFAULT_USER_SESSION_DATA_DIR):
+    with sync_playwright() as p:
+        with MyMapsSession(p, username, password, headless=headless, persistent=persistent,
+                           docker_server=docker_server, user_data_dir=user_data_dir,
+                           storage_state_file=storage_state_file, metrics=metrics) as session:
+            return session.update_map(map_url, stations_file)
+
+
+def _update_target(session, target, metrics):
+    # One entry of the manifest; failures are reported in the result instead of stopping the batch
+    with metrics.step("target") as record:
+        record.update(target)
+        try:
+            uploaded = session.update_map(target["map_url"], target["file"], target["layer"])
+        except PlaywrightError as e:
+            logging.error(f"❌ {target['map_url']} ({target['layer'] or 'single layer'}): {e}")
+            uploaded = False
+        record["status"] = "uploaded" if uploaded else "failed"
+    if uploaded:
+        mark_as_uploaded(target["file"], target)
+    return dict(record)
+
+
+def update_manifest_google(targets, username, password, concurrency=DEFAULT_BATCH_CONCURRENCY, headless=True,
+                           persistent=False, docker_server=None, metrics=None, storage_state_file=None,
+                           skip_unchanged=False, user_data_dir=DEFAULT_USER_SESSION_DATA_DIR):
+    # Updates every (map, layer, file) target over one Google login. The sync API of Playwright is tied
+    # to the thread that started it, so each extra worker runs its own browser, started from the cookies
+    # of the session that logged in. Returns one result per target with its status and duration.
+    metrics = metrics or Metrics("update_mymaps")
+    results, pending = [], []
+    for target in targets:
+        if skip_unchanged and is_already_uploaded(target["file"], target):
+            logging.info(f"✅ {target['file']} has not changed since the last upload to {target['map_url']}, skipping.")
+            results.append(dict(target, status="skipped", seconds=0))
+        else:
+            pending.append(target)
+    if not pending:
+        return results
 
-        browser.close()
+    workers = max(1, min(concurrency, len(pending)))
+    with sync_playwright() as p:
+        with MyMapsSession(p, username, password, headless=headless, persistent=persistent,
+                           docker_server=docker_server, user_data_dir=user_data_dir,
+                           storage_state_file=storage_state_file, metrics=metrics) as session:
+            if workers == 1:
+                return results + [_update_target(session, target, metrics) for target in pending]
+            storage_state = session.authenticated_state(pending[0]["map_url"])
+    if storage_state is None:
+        return results + [dict(target, status="failed", seconds=0) for target in pending]
+
+    todo = queue.Queue()
+    for target in pending:
+        todo.put(target)
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            with sync_playwright() as p:
+                with MyMapsSession(p, username, password, headless=headless, docker_server=docker_server,
+                                   metrics=metrics, storage_state=storage_state) as worker_session:
+                    while True:
+                        try:
+                            target = todo.get_nowait()
+                        except queue.Empty:
+                            return
+                        result = _update_target(worker_session, target, metrics)
+                        with lock:
+                            results.append(result)
+        except PlaywrightError as e:
+            logging.error(f"❌ Browser of {threading.current_thread().name} failed: {e}")
+
+    threads = [threading.Thread(target=worker, name=f"mymaps-{i}") for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Any target left behind by a worker whose browser could not start
+    while not todo.empty():
+        results.append(dict(todo.get_nowait(), status="failed", seconds=0))
+    return results
+
+
+def log_results(results):
+    for r in results:
+        logging.info(f"{'✅' if r['status'] != 'failed' else '❌'} {r['status']:<8} {r['seconds']:7.1f}s "
+                     f"{r['map_url']} [{r['layer'] or 'single layer'}] {r['file']}")
+    failed = sum(r["status"] == "failed" for r in results)
+    logging.info(f"📋 {len(results) - failed} of {len(results)} targets up to date, {failed} failed")
+    return failed
+
+
+def upload(config, args, payloads=None):
+    # The update of the command line, with its metrics written; returns the exit code. payloads maps files
+    # already in memory to their (payload, digest) from upload_targets.file_payload, so they are checked,
+    # uploaded and recorded without reading them again.
+    payloads = payloads or {}
+    # A Playwright server in Docker runs its own headless browser
+    if args.docker_server:
+        args.persistent = False
+        args.headed = False
+
+    metrics = Metrics("update_mymaps")
+    browser = {
+        "headless": not args.headed,
+        "persistent": args.persistent,
+        "docker_server": args.docker_server,
+        "metrics": metrics,
+        "storage_state_file": config["USER_SESSION_STATE_FILE"] if args.reuse_session else None,
+        "user_data_dir": config["USER_SESSION_DATA_DIR"],
+    }
+    if args.manifest:
+        try:
+            targets = load_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            print(f"❌ Invalid manifest: {e}")
+            return 1
+        try:
+            results = update_manifest_google(targets, config["USERNAME"], config["PASSWORD"], concurrency=args.concurrency,
+                                             skip_unchanged=args.skip_unchanged, **browser)
+        finally:
+            metrics.write(config["METRICS_FILE"], config["PROMETHEUS_TEXTFILE_DIR"])
+        return 1 if log_results(results) else 0
+
+    stations_file = config["STATIONS_FILE"]
+    payload, digest = payloads.get(stations_file, (stations_file, None))
+    if args.skip_unchanged and is_already_uploaded(stations_file, digest=digest):
+        logging.info(f"✅ {stations_file} has not changed since the last upload, skipping.")
+        return 0
+
+    try:
+        uploaded = update_mymap_google(config["USERNAME"], config["PASSWORD"], config["MAP_URL"], payload, **browser)
+    except PlaywrightError as e:
+        logging.error(f"❌ {config['MAP_URL']}: {e}")
+        uploaded = False
+    finally:
+        metrics.write(config["METRICS_FILE"], config["PROMETHEUS_TEXTFILE_DIR"])
+    if not uploaded:
+        logging.error(f"❌ {stations_file} was not uploaded")
+        return 1
+    mark_as_uploaded(stations_file, digest=digest)
+    return 0
 
 
 if __name__ == "__main__":
 
-    load_dotenv('.env', override=True)
     # Load environment variables from .env if they exist
-    USERNAME = os.getenv("USERNAME")
-    PASSWORD = os.getenv("PASSWORD")
-    MAP_URL = os.getenv("MAP_URL")
-    STATIONS_FILE = os.getenv("STATIONS_PRICE_FILE")
-    missing_vars = [var for var, val in [
-        ("USERNAME", USERNAME),
-        ("PASSWORD", PASSWORD),
-        ("MAP_URL", MAP_URL),
-        ("STATIONS_FILE", STATIONS_FILE)
-    ] if not val]
-    if missing_vars:
-        print(f"❌ The following variables are missing in the .env file: {', '.join(missing_vars)}")
-        exit(1)
-    LOG_FILE = os.getenv("LOG_MYMAPS_FILE", DEFAULT_LOG_FILE)
-    USER_SESSION_DATA_DIR = os.getenv("USER_SESSION_DATA_DIR", DEFAULT_USER_SESSION_DATA_DIR)
-    LOG_LEVEL = os.getenv("LOG_LEVEL", DEFAULT_LOG_LEVEL).upper()
+    load_dotenv('.env', override=True)
+    config = load_upload_config()
 
     parser = argparse.ArgumentParser(
         description="Update Google My Maps with Playwright",
         allow_abbrev=False
     )
-    parser.add_argument(
-        "--persistent",
-        action="store_true",
-        default=False,
-        help="Use persistent session (default: False)"
-    )
-    parser.add_argument(
-        "--headed",
-        action="store_true",
-        default=False,
-        help="Run in headed mode (default: False)"
-    )
-
-    parser.add_argument(
-        "--docker-server",
-        required=False,
-        help="WebSocket URL of the Playwright server running in Docker (e.g., ws://localhost:3000)"
-    )
-
-    parser.add_argument(
-        "--log-console",
-        action="store_true",
-        default=False,
-        help="Enable logging to console (default: False)"
-    )
-
-    parser.add_argument(
-        "--file",
-        required=False,
-        help="Path to the KML file to import (if provided, overrides configuration)"
-    )
+    add_browser_arguments(parser)
+    add_log_console_argument(parser)
+    add_upload_arguments(parser)
     args = parser.parse_args()
 
     # Validate that only allowed arguments are passed
-    allowed_args = {"persistent", "headed", "log_console", "file", "docker_server"}
+    allowed_args = {"persistent", "headed", "log_console", "file", "docker_server", "skip_unchanged", "reuse_session",
+                    "manifest", "concurrency", "dry_run"}
     for arg in vars(args):
         if arg not in allowed_args:
             parser.error(f"Argument not allowed: --{arg.replace('_', '-')}")
 
     # If --file is provided, override STATIONS_FILE
     if args.file:
-        STATIONS_FILE = args.file
-
-    # If --docker-server is provided, override persistent and headed to False
-    if args.docker_server:
-        args.persistent = False
-        args.headed = False
+        config["STATIONS_FILE"] = args.file
 
-    # Set up logging to write to a file instead of the console
-    logger = logging.getLogger()
-    # Convert the string to a numeric logging level
-    log_level = getattr(logging, LOG_LEVEL, logging.INFO)
-    logger.setLevel(log_level)
+    if args.dry_run:
+        try:
+            exit(1 if print_upload_plan(config, args.manifest) else 0)
+        except (OSError, ValueError) as e:
+            print(f"❌ Invalid manifest: {e}")
+            exit(1)
 
-    # Handler para fichero rotativo (100MB, hasta 3 backups)
-    file_handler = RotatingFileHandler(
-        LOG_FILE, maxBytes=100*1024*1024, backupCount=3, encoding='utf-8'
-    )
-    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(message)s'))
-    logger.addHandler(file_handler)
-
-    # Handler para consola solo si --log-console está presente
-    if args.log_console:
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(message)s'))
-        logger.addHandler(console_handler)
+    # The manifest replaces the single map and file of the configuration
+    missing_vars = missing_upload_settings(config, args.manifest)
+    if missing_vars:
+        print(f"❌ The following variables are missing in the .env file: {', '.join(missing_vars)}")
+        exit(1)
 
-    # logging.basicConfig(
-    #     filename='mymaps.log',
-    #     level=logging.INFO,
-    #     format='%(asctime)s %(levelname)s:%(message)s'
-    # )
+    setup_logging(config["LOG_FILE"], config["LOG_LEVEL"], args.log_console)
 
     logging.debug("🔧 Current configuration:")
-    logging.debug(f"  USERNAME: {USERNAME}")
-    logging.debug(f"  PASSWORD: {'*' * len(PASSWORD) if PASSWORD else ''}")
-    logging.debug(f"  MAP_URL: {MAP_URL}")
-    logging.debug(f"  STATIONS_FILE: {STATIONS_FILE}")
-    logging.debug(f"  LOG_FILE: {LOG_FILE}")
-    logging.debug(f"  USER_SESSION_DATA_DIR: {USER_SESSION_DATA_DIR}")
-
-    update_mymap_google(headless=(not args.headed), persistent=args.persistent)
+    for key, value in config.items():
+        logging.debug(f"  {key}: {'*' * len(value) if key == 'PASSWORD' and value else value}")
+
+    exit(upload(config, args))
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+from cli_common import DEFAULT_LOG_LEVEL, DEFAULT_STATIONS_PRICE_FILE
+
+# Settings and bookkeeping of the My Maps upload that need neither Playwright nor pandas, so that
+# checking what would be uploaded stays cheap (see redfleet.py status and upload --dry-run)
+
+# Folder where the session is saved
+DEFAULT_USER_SESSION_DATA_DIR = "google_session"
+
+# File where the cookies and local storage of the session are saved with --reuse-session
+DEFAULT_USER_SESSION_STATE_FILE = "google_session_state.json"
+
+DEFAULT_LOG_FILE = "mymaps.log"
+
+DEFAULT_METRICS_FILE = "mymaps_metrics.json"
+
+# Maximum number of targets of a manifest updated at the same time
+DEFAULT_BATCH_CONCURRENCY = 2
+
+# Suffix of the file that records the hash of the last successfully uploaded file
+UPLOADED_HASH_SUFFIX = ".uploaded"
+
+# What an upload does with a file of each upload_status
+UPLOAD_PLAN_LABELS = {
+    "uploaded": ("✅", "up to date"),
+    "changed": ("📤", "would upload (changed)"),
+    "new": ("📤", "would upload (never uploaded)"),
+    "missing": ("❌", "missing file"),
+}
+
+# Content types of the files My Maps imports, for the files uploaded from memory
+MIME_TYPES = {
+    ".kml": "application/vnd.google-earth.kml+xml",
+    ".kmz": "application/vnd.google-earth.kmz",
+    ".gpx": "application/gpx+xml",
+    ".csv": "text/csv",
+}
+
+
+def load_upload_config():
+    # Settings of the upload, from the environment (and .env) with their defaults
+    return {
+        "USERNAME": os.getenv("USERNAME"),
+        "PASSWORD": os.getenv("PASSWORD"),
+        "MAP_URL": os.getenv("MAP_URL"),
+        "STATIONS_FILE": os.getenv("STATIONS_PRICE_FILE", DEFAULT_STATIONS_PRICE_FILE),
+        "LOG_FILE": os.getenv("LOG_MYMAPS_FILE", DEFAULT_LOG_FILE),
+        "USER_SESSION_DATA_DIR": os.getenv("USER_SESSION_DATA_DIR", DEFAULT_USER_SESSION_DATA_DIR),
+        "USER_SESSION_STATE_FILE": os.getenv("USER_SESSION_STATE_FILE", DEFAULT_USER_SESSION_STATE_FILE),
+        "METRICS_FILE": os.getenv("METRICS_MYMAPS_FILE", DEFAULT_METRICS_FILE),
+        "PROMETHEUS_TEXTFILE_DIR": os.getenv("PROMETHEUS_TEXTFILE_DIR"),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", DEFAULT_LOG_LEVEL).upper()
+    }
+
+
+def missing_upload_settings(config, manifest=None):
+    # The manifest replaces the single map and file of the configuration
+    return [name for name, value in [
+        ("USERNAME", config["USERNAME"]),
+        ("PASSWORD", config["PASSWORD"]),
+        ("MAP_URL", config["MAP_URL"] or manifest),
+        ("STATIONS_FILE", config["STATIONS_FILE"] or manifest)
+    ] if not value]
+
+
+def add_upload_arguments(parser):
+    # Options of the files and maps to update
+    parser.add_argument(
+        "--file",
+        required=False,
+        help="Path to the KML file to import (if provided, overrides configuration)"
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        default=False,
+        help="Skip the upload if the file is the same as the last one uploaded successfully (default: False)"
+    )
+    parser.add_argument(
+        "--manifest",
+        required=False,
+        help="JSON list of {map_url, layer, file} targets to update instead of MAP_URL and STATIONS_PRICE_FILE"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_BATCH_CONCURRENCY,
+        help=f"Targets of the manifest updated at the same time (default: {DEFAULT_BATCH_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Only list the files that would be uploaded, without starting a browser (default: False)"
+    )
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def file_payload(path, buffer=None):
+    # The file read once into memory, as the {name, mimeType, buffer} that Playwright takes as a file to
+    # upload, and its hash; the same bytes are then checked, uploaded and recorded. buffer is the content
+    # of the file when the caller has it in memory already, so it is not read back.
+    if buffer is None:
+        with open(path, "rb") as f:
+            buffer = f.read()
+    extension = os.path.splitext(path)[1].lower()
+    payload = {"name": os.path.basename(path), "mimeType": MIME_TYPES.get(extension, "application/octet-stream"), "buffer": buffer}
+    return payload, hashlib.sha256(buffer).hexdigest()
+
+
+def uploaded_hash_file(stations_file, target=None):
+    # A file imported into several maps or layers keeps one hash per map and layer
+    if target is None:
+        return stations_file + UPLOADED_HASH_SUFFIX
+    key = hashlib.sha256(f"{target['map_url']}\n{target.get('layer') or ''}".encode("utf-8")).hexdigest()[:12]
+    return f"{stations_file}.{key}{UPLOADED_HASH_SUFFIX}"
+
+
+def is_already_uploaded(stations_file, target=None, digest=None):
+    # digest is the hash of the file when the caller already has it, so the file is not read again
+    try:
+        with open(uploaded_hash_file(stations_file, target), "r", encoding="utf-8") as f:
+            return f.read().strip() == (digest or file_sha256(stations_file))
+    except OSError:
+        return False
+
+
+def mark_as_uploaded(stations_file, target=None, digest=None):
+    digest = digest or file_sha256(stations_file)
+    with open(uploaded_hash_file(stations_file, target), "w", encoding="utf-8") as f:
+        f.write(digest)
+
+
+def load_manifest(manifest_file):
+    # JSON list of {"map_url": ..., "layer": ..., "file": ...}; layer may be omitted for maps with a single
+    # layer and relative files are taken from the folder of the manifest
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    targets = []
+    for i, entry in enumerate(entries):
+        missing = [key for key in ("map_url", "file") if not entry.get(key)]
+        if missing:
+            raise ValueError(f"Entry {i} of {manifest_file} is missing: {', '.join(missing)}")
+        targets.append({
+            "map_url": entry["map_url"],
+            "layer": entry.get("layer"),
+            "file": os.path.join(base_dir, entry["file"])
+        })
+    return targets
+
+
+def upload_status(stations_file, target=None):
+    # "uploaded" when the file is the one last uploaded, "changed" when a different one was, "new" when none
+    # was uploaded yet and "missing" when the file does not exist
+    if not os.path.exists(stations_file):
+        return "missing"
+    if is_already_uploaded(stations_file, target):
+        return "uploaded"
+    return "changed" if os.path.exists(uploaded_hash_file(stations_file, target)) else "new"
+
+
+def print_upload_plan(config, manifest=None):
+    # What an upload would do with each target, from the recorded hashes and without any browser.
+    # Returns the number of targets that could not be uploaded because their file is missing.
+    if manifest:
+        targets = [(target["file"], target) for target in load_manifest(manifest)]
+    else:
+        targets = [(config["STATIONS_FILE"], None)]
+    missing = 0
+    for stations_file, target in targets:
+        if not stations_file:
+            print("❌ No STATIONS_PRICE_FILE to upload")
+            missing += 1
+            continue
+        status = upload_status(stations_file, target)
+        missing += status == "missing"
+        icon, action = UPLOAD_PLAN_LABELS[status]
+        where = f"{target['map_url']} [{target['layer'] or 'single layer'}]" if target else config["MAP_URL"] or "MAP_URL"
+        print(f"{icon} {action:<29} {stations_file} -> {where}")
+    return missing